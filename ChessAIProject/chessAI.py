@@ -6,8 +6,17 @@ from copy import deepcopy
 from math import sqrt
 from math import inf
 from random import choice
+from random import Random
+import os
+import sys
+import threading
 import time
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batched evaluation
+    np = None
+
 # based on https://repl.it/@f9we/chess
 
 
@@ -38,8 +47,44 @@ class Chess:
         self.board = ChessBoard(self.pen, Chess.SQUARE_SIZE)
         self.piece = ChessPiece(self.board)
         self.update = turtle.update
-        self.user_input = Input(self.board, self.piece, self.window,
-                                self.update)
+
+        # Game records and engine state are set up once here, for the Input that plays the game. The Inputs
+        # ChessPiece makes for each copy of the pieces get none of them.
+        # Record the game as PGN if CHESSAI_PGN names a file to append it to
+        pgn = None
+        pgn_path = os.environ.get("CHESSAI_PGN")
+        if pgn_path:
+            from chessAIPGN import PGNWriter
+            pgn = PGNWriter(open(pgn_path, "a", encoding="utf-8"))
+            pgn.begin_game({"Event": "chessAI game", "Date": time.strftime("%Y.%m.%d"),
+                            "White": "Human", "Black": "chessAI"})
+
+        # Opening book the AI plays from before searching, if CHESSAI_BOOK names a book file
+        book = None
+        book_path = os.environ.get("CHESSAI_BOOK")
+        if book_path:
+            from chessAIBook import OpeningBook
+            book = OpeningBook(book_path)
+
+        # Endgame tablebases the AI plays perfectly from, if CHESSAI_TABLEBASES names their directory
+        tablebases = None
+        tablebase_path = os.environ.get("CHESSAI_TABLEBASES")
+        if tablebase_path:
+            from chessAITablebase import Tablebases
+            tablebases = Tablebases(tablebase_path)
+
+        # Search results kept between games, if CHESSAI_ANALYSIS names the file to keep them in
+        analysis_store = None
+        analysis_path = os.environ.get("CHESSAI_ANALYSIS")
+        if analysis_path:
+            from chessAIStore import AnalysisStore
+            analysis_store = AnalysisStore(analysis_path)
+
+        # The AI's engine, kept for the whole game so each search starts from what the last one found
+        engine = EngineSession(tablebases=tablebases, analysis_store=analysis_store)
+
+        self.user_input = Input(self.board, self.piece, self.window, self.update, pgn=pgn, book=book,
+                                tablebases=tablebases, analysis_store=analysis_store, engine=engine)
         turtle.tracer(0, 0)
         self.pen.speed(0)
         self.pen.ht()
@@ -104,7 +149,7 @@ class ChessBoard:
         """Inits chess board attributes.
         
         Args:
-            pen: Object of turtle pen.
+            pen: Object of turtle pen. None for a headless board that is never drawn.
             square_side_size: Integer representing side of square.
             squares: If pass, setup board with particular setup.
                            This could be used for testing or for practice.
@@ -136,6 +181,49 @@ class ChessBoard:
         copy = ChessBoard(self.pen, self.square_side_size, squares=squares_copy)
         return copy
 
+    def placement_fen(self):
+        """
+        Piece placement field of FEN for the squares, rank 8 (row 0) first
+        """
+        ranks = []
+        for row in self.squares:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += ChessPiece.GLYPH_TO_FEN[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        return "/".join(ranks)
+
+    def load_placement(self, placement):
+        """
+        Sets the squares from the piece placement field of a FEN. Nothing is drawn.
+        """
+        ranks = placement.split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN placement needs 8 ranks: %r" % placement)
+        squares = []
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend([None] * int(char))
+                elif char in ChessPiece.FEN_TO_GLYPH:
+                    row.append(ChessPiece.FEN_TO_GLYPH[char])
+                else:
+                    raise ValueError("Bad FEN piece %r in %r" % (char, placement))
+            if len(row) != 8:
+                raise ValueError("FEN rank needs 8 squares: %r" % rank)
+            squares.append(row)
+        self.squares = squares
+
     def print_board(self):
         """
         Prints a unicode chess board in console for troubleshooting
@@ -159,6 +247,8 @@ class ChessBoard:
             color: Color tuple (r,g,b).
             fill: True if fill.
         """
+        if self.pen is None:
+            return
         self.pen.up()
         self.pen.color(color)
         self.pen.goto(left_x, top_y)
@@ -193,6 +283,8 @@ class ChessBoard:
             col: 2nd dimension location.
             adjustment_x: Fraction * square_side_size added to x. (text)
         """
+        if self.pen is None:
+            return
         self._goto_piece_xy(row, col, adjustment_x, adjustment_y)
         self.pen.color(color)
         self.pen.write(char, font=("Courier", round(self.square_side_size * .7),
@@ -237,6 +329,9 @@ class ChessBoard:
 
     def draw_board(self):
         """Draws border and board. No pieces are drawn."""
+        if self.pen is None:
+            return
+
         # Clears screen of all turtle drawings
         self.pen.clear()
 
@@ -345,6 +440,12 @@ class ChessPiece:
     B_KNIGHT = u'♞'
     B_PAWN = u'♟'
 
+    FEN_TO_GLYPH = {'K': W_KING, 'Q': W_QUEEN, 'R': W_ROOK, 'B': W_BISHOP, 'N': W_KNIGHT, 'P': W_PAWN,
+                    'k': B_KING, 'q': B_QUEEN, 'r': B_ROOK, 'b': B_BISHOP, 'n': B_KNIGHT, 'p': B_PAWN}
+    GLYPH_TO_FEN = {glyph: char for char, glyph in FEN_TO_GLYPH.items()}
+
+    START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
     def __init__(self, chess_board, moveHistory=None, blackCanCastleQside=True, blackCanCastleKside=True,
                  whiteCanCastleQside=True, whiteCanCastleKside=True, testing=False):
         """Inits attributes.
@@ -352,8 +453,6 @@ class ChessPiece:
         Args:
             chess_board: Object of ChessBoard.
         """
-        import turtle
-
         self.board = chess_board
 
         # move history
@@ -369,10 +468,22 @@ class ChessPiece:
         # set to True if just testing validity
         self.testing = testing
 
-        # Take user input for pawn promotion
-        self.window = turtle.Screen()
-        self.update = turtle.update
-        self.user_input = Input(self.board, self, self.window, self.update)
+        # Move counters of a position loaded from FEN: plies played before it, and how many moveHistory
+        # entries were made up to stand for it rather than played.
+        self.halfmove_clock = 0
+        self.ply_start = 0
+        self.history_start = 0
+
+        # Take user input for pawn promotion. A headless board has no window to take it from.
+        if chess_board.pen is None:
+            self.window = None
+            self.update = None
+            self.user_input = None
+        else:
+            import turtle
+            self.window = turtle.Screen()
+            self.update = turtle.update
+            self.user_input = Input(self.board, self, self.window, self.update)
 
     def deep_copy(self, testing=False):
         """
@@ -387,6 +498,98 @@ class ChessPiece:
                           whiteCanCastleKside=self.whiteCanCastleKside, testing=testing)
         return copy
 
+    def headless_copy(self):
+        """
+        Copy of the pieces and move history on a board with no pen, for playing moves that must not be drawn
+        """
+        board_copy = ChessBoard(None, self.board.square_side_size, squares=[list(row) for row in self.board.squares])
+        copy = ChessPiece(board_copy, moveHistory=list(self.moveHistory),
+                          blackCanCastleQside=self.blackCanCastleQside,
+                          blackCanCastleKside=self.blackCanCastleKside,
+                          whiteCanCastleQside=self.whiteCanCastleQside,
+                          whiteCanCastleKside=self.whiteCanCastleKside)
+        copy.moveHistory = list(self.moveHistory)
+        copy.halfmove_clock = self.halfmove_clock
+        copy.ply_start = self.ply_start
+        copy.history_start = self.history_start
+        return copy
+
+    @classmethod
+    def from_fen(cls, fen, pen=None, square_side_size=50):
+        """
+        New ChessPiece on a new board set up from a FEN string. The board is headless unless a pen is given.
+        """
+        pieces = cls(ChessBoard(pen, square_side_size))
+        pieces.load_fen(fen)
+        return pieces
+
+    def load_fen(self, fen):
+        """
+        Sets the board, castling rights, side to move and en passant square from a FEN string.
+
+        The side to move and en passant square are kept the same way a played game keeps them, as the last
+        move of moveHistory: a double pawn push onto the en passant square, or a stand-in entry otherwise.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: %r" % fen)
+        placement, color, castling, en_passant = fields[:4]
+        if color not in ("w", "b"):
+            raise ValueError("Bad FEN side to move %r" % color)
+
+        self.board.load_placement(placement)
+        self.whiteCanCastleKside = "K" in castling
+        self.whiteCanCastleQside = "Q" in castling
+        self.blackCanCastleKside = "k" in castling
+        self.blackCanCastleQside = "q" in castling
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.ply_start = 2 * (int(fields[5]) - 1 if len(fields) > 5 else 0) + (1 if color == "b" else 0)
+
+        if en_passant != "-":
+            col = ord(en_passant[0]) - ord("a")
+            if color == "b":  # white just pushed a pawn two squares
+                self.moveHistory = [(ChessPiece.W_PAWN, 6, col, 4, col)]
+            else:
+                self.moveHistory = [(ChessPiece.B_PAWN, 1, col, 3, col)]
+        elif color == "b":
+            self.moveHistory = [(None, 0, 0, 0, 0)]
+        else:
+            self.moveHistory = [(ChessPiece.B_PAWN, 0, 0, 0, 0)]
+        self.history_start = 1
+
+    def to_fen(self):
+        """
+        FEN string of the current position. Castling rights come from the *CanCastle* flags, kept only while
+        the king and rook are still on their squares. The halfmove clock is only known until a move is made,
+        since captures are not recorded, so after that it is written as 0.
+        """
+        squares = self.board.squares
+        color = side_to_move(self)
+
+        castling = ""
+        if self.whiteCanCastleKside and squares[7][4] == ChessPiece.W_KING and squares[7][7] == ChessPiece.W_ROOK:
+            castling += "K"
+        if self.whiteCanCastleQside and squares[7][4] == ChessPiece.W_KING and squares[7][0] == ChessPiece.W_ROOK:
+            castling += "Q"
+        if self.blackCanCastleKside and squares[0][4] == ChessPiece.B_KING and squares[0][7] == ChessPiece.B_ROOK:
+            castling += "k"
+        if self.blackCanCastleQside and squares[0][4] == ChessPiece.B_KING and squares[0][0] == ChessPiece.B_ROOK:
+            castling += "q"
+
+        en_passant = "-"
+        if self.moveHistory:
+            piece, from_row, from_col, to_row, to_col = self.moveHistory[-1]
+            if piece == ChessPiece.W_PAWN and from_row == 6 and to_row == 4:
+                en_passant = chr(ord("a") + to_col) + "3"
+            elif piece == ChessPiece.B_PAWN and from_row == 1 and to_row == 3:
+                en_passant = chr(ord("a") + to_col) + "6"
+
+        fullmove = 1 + (self.ply_start + len(self.moveHistory) - self.history_start) // 2
+        halfmove = self.halfmove_clock if len(self.moveHistory) == self.history_start else 0
+
+        return "%s %s %s %s %d %d" % (self.board.placement_fen(), "w" if color == "white" else "b",
+                                      castling or "-", en_passant, halfmove, fullmove)
+
     def start_at_beginning(self):
         """Draw pieces at the beginning of game."""
         b_pieces = [ChessPiece.B_ROOK,
@@ -786,6 +989,35 @@ class ChessPiece:
                                            to_row, to_col)
 
 
+    def push_move(self, from_row, from_col, to_row, to_col, promotion=None):
+        """
+        Validates and plays a move the way a player's move is played: the rook of a castling king and a pawn
+        taken en passant are moved too, a pawn reaching the last rank is promoted, and the move is added to
+        moveHistory.
+
+        Args:
+            promotion: piece a promoted pawn becomes, a queen of its color if None.
+
+        Raises:
+            ValueError if there is no piece on the from square or the move is not valid.
+        """
+        piece = self.board.squares[from_row][from_col]
+        if piece is None or not self.is_move_valid(from_row, from_col, to_row, to_col):
+            raise ValueError("Invalid move (%d, %d) -> (%d, %d)" % (from_row, from_col, to_row, to_col))
+
+        self.board.move_piece(from_row, from_col, to_row, to_col)
+
+        if (piece == ChessPiece.W_PAWN and to_row == 0) or (piece == ChessPiece.B_PAWN and to_row == 7):
+            if promotion is None:
+                promotion = ChessPiece.W_QUEEN if piece == ChessPiece.W_PAWN else ChessPiece.B_QUEEN
+            self.board.overwrite_board_square(to_row, to_col)
+            self.board.put_piece(promotion, to_row, to_col)
+            self.board.squares[to_row][to_col] = promotion
+
+        # move is organized as: ("piece", fromRow, fromCol, toRow, toCol)
+        self.moveHistory.append((self.board.squares[to_row][to_col], from_row, from_col, to_row, to_col))
+
+
 class Threat:
     """
     Calculates which spaces are threatened by each piece
@@ -1185,10 +1417,8 @@ class Threat:
             for col in range(8):
                 if self.board.squares[row][col] == ChessPiece.B_KING:  # Black king symbol
                     bk = True
-                    break
-                if self.board.squares[row][col] == ChessPiece.W_KING:  # Black king symbol
+                if self.board.squares[row][col] == ChessPiece.W_KING:  # White king symbol
                     wk = True
-                    break
 
         # If a king is missing, end the game. This fixes a bug we were having
         if bk == False:
@@ -1416,29 +1646,463 @@ class Threat:
         return True
 
 
+################################################################################
+# Zobrist keys for position hashing. Fixed seed so hashes are stable between runs.
+_zobrist_random = Random(5100)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in [ChessPiece.W_KING, ChessPiece.W_QUEEN, ChessPiece.W_ROOK, ChessPiece.W_BISHOP,
+                                ChessPiece.W_KNIGHT, ChessPiece.W_PAWN, ChessPiece.B_KING, ChessPiece.B_QUEEN,
+                                ChessPiece.B_ROOK, ChessPiece.B_BISHOP, ChessPiece.B_KNIGHT, ChessPiece.B_PAWN]}
+ZOBRIST_WHITE_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(4)]
+
+
+def side_to_move(pieces):
+    """
+    The color to move next, going by the last move in the move history (as Threat.stalemate does).
+    White moves first if there is no history.
+    """
+    if not pieces.moveHistory:  # Nobody has moved yet
+        return "white"
+    if pieces.piece_color(pieces.moveHistory[-1][0]) == "black":
+        return "white"
+    return "black"
+
+
+def square_name(row, col):
+    """
+    Algebraic name of a board square, row 0 is the 8th rank.
+    """
+    return "abcdefgh"[col] + str(8 - row)
+
+
+def parse_square(name):
+    """
+    (row, col) of an algebraic square name such as "e4".
+    """
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise ValueError("Bad square %r" % name)
+    return 8 - int(name[1]), ord(name[0]) - ord("a")
+
+
+def uci_move(board_state, move):
+    """
+    Long algebraic (UCI) notation of a ((fromRow, fromCol), (toRow, toCol)) move on board_state,
+    with the queen promotion the engine always makes.
+    """
+    (from_row, from_col), (to_row, to_col) = move
+    text = square_name(from_row, from_col) + square_name(to_row, to_col)
+    piece = board_state.squares[from_row][from_col]
+    if (piece == ChessPiece.W_PAWN and to_row == 0) or (piece == ChessPiece.B_PAWN and to_row == 7):
+        text += "q"
+    return text
+
+
+def uci_pv(board_state, pv):
+    """
+    UCI moves of a principal variation, played out on a copy of board_state for the piece on each square.
+    """
+    board = board_state.deep_copy()
+    line = []
+    for (from_row, from_col), (to_row, to_col) in pv:
+        line.append(uci_move(board, ((from_row, from_col), (to_row, to_col))))
+        board.squares[to_row][to_col] = board.squares[from_row][from_col]
+        board.squares[from_row][from_col] = None
+    return line
+
+
+def parse_uci_move(text):
+    """
+    :return: (move, promotion) for a UCI move such as "e7e8q", the promotion is the lowercase FEN letter
+             of the piece or None
+    """
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] not in "qrbn"):
+        raise ValueError("Bad UCI move %r" % text)
+    return (parse_square(text[:2]), parse_square(text[2:4])), (text[4] if len(text) == 5 else None)
+
+
+def position_hash(board_state, pieces):
+    """
+    64 bit Zobrist hash of the squares of board_state, castling rights and the side to move
+    """
+    h = 0
+    square = 0
+    for row in board_state.squares:
+        for piece in row:
+            if piece is not None:
+                h ^= ZOBRIST_PIECES[piece][square]
+            square += 1
+    if side_to_move(pieces) == "white":
+        h ^= ZOBRIST_WHITE_TO_MOVE
+    castling = [pieces.whiteCanCastleKside, pieces.whiteCanCastleQside,
+                pieces.blackCanCastleKside, pieces.blackCanCastleQside]
+    for i in range(4):
+        if castling[i]:
+            h ^= ZOBRIST_CASTLING[i]
+    return h
+
+
+class EvalCache:
+    """
+    Fixed-size table of evaluate results keyed by position hash. Each hash maps to one slot, and a new
+    entry replaces whatever was in its slot. The table is cleared when the heuristic weights change.
+    """
+
+    def __init__(self, size=65536):
+        self.size = size
+        self.keys = [None] * size
+        self.values = [0] * size
+        self.vals = None
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.values = [0] * self.size
+
+    def _check_vals(self, vals):
+        # Scores are only valid for the weights they were computed with
+        if vals is not self.vals:
+            if self.vals is None or list(vals) != list(self.vals):
+                self.clear()
+            self.vals = vals
+
+    def probe(self, key, vals):
+        """
+        :return: the cached heuristic value of the position, None on a miss
+        """
+        self._check_vals(vals)
+        slot = key % self.size
+        if self.keys[slot] == key:
+            self.hits += 1
+            return self.values[slot]
+        self.misses += 1
+        return None
+
+    def store(self, key, vals, value):
+        self._check_vals(vals)
+        slot = key % self.size
+        self.keys[slot] = key
+        self.values[slot] = value
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of minimax results keyed by position hash: the depth searched, the value, whether the
+    value is exact or only a lower or upper bound, and the best move. An entry is replaced by a search of
+    the same position at least as deep, or by any other position hashing to its slot. The table is cleared
+    when the heuristic weights change.
+
+    Optionally backed by an on-disk analysis store (chessAIStore.AnalysisStore): deep enough results are
+    saved to it, and looked up in it when this table has not searched the position as deep.
+    """
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, size=262144, analysis_store=None, store_depth=2):
+        """
+        :param store_depth: shallowest search depth looked up in and saved to the analysis store
+        """
+        self.size = size
+        self.keys = [None] * size
+        self.entries = [None] * size
+        # Search each entry was last stored or found in, see new_search
+        self.ages = [0] * size
+        self.generation = 0
+        self.vals = None
+        self.hits = 0
+        self.misses = 0
+        self.analysis_store = analysis_store
+        self.store_depth = store_depth
+        self.store_hits = 0
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.entries = [None] * self.size
+        self.ages = [0] * self.size
+
+    def new_search(self):
+        """
+        Starts a new generation. Entries of earlier searches stay valid but give up their slots to the
+        current search's entries first.
+        """
+        self.generation += 1
+
+    def _check_vals(self, vals):
+        # Values are only valid for the weights they were searched with
+        if vals is not self.vals:
+            if self.vals is None or list(vals) != list(self.vals):
+                self.clear()
+            self.vals = vals
+
+    def probe(self, key, vals, depth=0):
+        """
+        :param depth: depth the caller is about to search the position to
+        :return: (depth, value, flag, move) of the position, None on a miss
+        """
+        self._check_vals(vals)
+        slot = key % self.size
+        entry = self.entries[slot] if self.keys[slot] == key else None
+        # The analysis store may have searched the position deeper than this table has
+        if self.analysis_store is not None and depth >= self.store_depth and (entry is None or entry[0] < depth):
+            saved = self.analysis_store.get(key, vals)
+            if saved is not None and (entry is None or saved[0] > entry[0]):
+                self.store_hits += 1
+                self.keys[slot] = key
+                self.entries[slot] = entry = saved
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.ages[slot] = self.generation
+        return entry
+
+    def store(self, key, vals, depth, value, flag, move):
+        """
+        Saves a result unless its slot holds a deeper search of the same position, or a deeper search of
+        another position made by the current search.
+        """
+        self._check_vals(vals)
+        slot = key % self.size
+        if self.keys[slot] is not None and self.entries[slot][0] > depth and \
+                (self.keys[slot] == key or self.ages[slot] == self.generation):
+            return
+        self.keys[slot] = key
+        self.entries[slot] = (depth, value, flag, move)
+        self.ages[slot] = self.generation
+        if self.analysis_store is not None and depth >= self.store_depth:
+            self.analysis_store.put(key, vals, depth, value, flag, move)
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+
+class SearchStats:
+    """
+    What a search did. opponent_AI fills one in while searching and search() returns it with the move.
+
+    Attributes:
+        nodes: minimax nodes visited.
+        qnodes: quiescence nodes. The search has no quiescence stage, so this stays 0.
+        cutoffs: alpha-beta cutoffs.
+        first_move_cutoffs: cutoffs made by the first move searched at a node.
+        tt_probes: transposition table lookups.
+        tt_hits: transposition table lookups that found the position.
+        eval_probes: evaluation cache lookups.
+        eval_hits: evaluation cache lookups that found the position.
+        forward_pruned: moves discarded by forward pruning.
+        tb_hits: positions looked up in the endgame tablebases.
+        iterations: one dict per completed iterative deepening pass with its depth, value, move,
+                    principal variation, nodes, seconds and effective branching factor.
+        profile: SearchProfiler summary if the search was profiled, otherwise None.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.eval_probes = 0
+        self.eval_hits = 0
+        self.forward_pruned = 0
+        self.tb_hits = 0
+        self.iterations = []
+        self.profile = None
+
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def effective_branching_factor(self):
+        """
+        Nodes of the last iteration over nodes of the one before it (the depth-th root of the nodes
+        if there was only one iteration)
+        """
+        if not self.iterations:
+            return 0.0
+        return self.iterations[-1]["ebf"]
+
+    def as_dict(self):
+        return {"nodes": self.nodes, "qnodes": self.qnodes, "cutoffs": self.cutoffs,
+                "first_move_cutoffs": self.first_move_cutoffs,
+                "first_move_cutoff_rate": self.first_move_cutoff_rate(),
+                "tt_probes": self.tt_probes, "tt_hits": self.tt_hits,
+                "eval_probes": self.eval_probes, "eval_hits": self.eval_hits,
+                "forward_pruned": self.forward_pruned, "tb_hits": self.tb_hits,
+                "effective_branching_factor": self.effective_branching_factor(),
+                "iterations": self.iterations, "profile": self.profile}
+
+
+class SearchProfiler:
+    """
+    Profiles one search. cProfile times every function, written out as a pstats file, and a sampling
+    thread records the searching thread's call stack every interval, written out in collapsed-stack
+    format for flame graph tools.
+
+    Attributes:
+        path: Path prefix of the <path>.pstats and <path>.collapsed files.
+        interval: Seconds between stack samples.
+        samples: Dictionary of collapsed stack to sample count.
+    """
+    # Functions whose time is broken out in the summary
+    SUMMARY_FUNCTIONS = ["getThreat", "evaluate", "deep_copy", "is_game_over", "forward_prune"]
+
+    def __init__(self, path, interval=0.001):
+        if os.path.isdir(path):
+            path = os.path.join(path, "search-%d" % int(time.time() * 1000))
+        self.path = path
+        self.interval = interval
+        self.samples = {}
+        self.profile = None
+        self._thread_id = None
+        self._sampler = None
+        self._running = False
+
+    def start(self):
+        import cProfile
+        self._thread_id = threading.get_ident()
+        self._running = True
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        """
+        Stops profiling and writes the pstats and collapsed-stack files.
+        :return: summary dict with the file paths and the cumulative seconds of SUMMARY_FUNCTIONS
+        """
+        import pstats
+        self.profile.disable()
+        self._running = False
+        self._sampler.join()
+
+        self.profile.dump_stats(self.path + ".pstats")
+        with open(self.path + ".collapsed", "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write("%s %d\n" % (stack, count))
+
+        # Cumulative time per function, keyed by name and place since e.g. both ChessBoard and ChessPiece
+        # have a deep_copy
+        functions = {}
+        for (filename, line, name), (_, _, _, cumulative, _) in pstats.Stats(self.profile).stats.items():
+            if name in SearchProfiler.SUMMARY_FUNCTIONS:
+                functions["%s (%s:%d)" % (name, os.path.basename(filename), line)] = cumulative
+        return {"pstats": self.path + ".pstats", "collapsed": self.path + ".collapsed",
+                "cumulative_seconds": functions}
+
+
 class opponent_AI:
 
-    def __init__(self, board, pieces):
+    # Default heuristic values if none is provided from the genetic algorithm
+    DEFAULT_VALS = [2, 6, 6, 8, 1000, 2, 6, 6, 8, 1000, 3, 5, 3, 5, 10, 6, 6, 8, 50, 100, 4, 6, 6, 8, 50, 15, 10, 5,
+                    15, 5, 10, 6, 6, 8, 50, 4, 6, 6, 8, 15, 10, 5, 15, 5]
+
+    # Optimized weights for the evaluation function
+    # generated by chessAIGeneticAlgo.py
+    TUNED_VALS = [1019, 1228, 1222, 1449, 2934, 693, 400, 520, 615, 832, 157,
+                  1407, 861, 1147, 786, 527, 616, 994, 1053, 1173, 255, 713,
+                  633, 1308, 768, 974, 612, 205, 730, 562, 1462, 742, 208,
+                  844, 593, 1486, 563, 1267, 586, 729, 2, 941, 990, 547, 854,
+                  1054, 147, 934, 451, 258, 895, 109]
+
+    def __init__(self, board, pieces, eval_cache_size=65536, tablebases=None, tt_size=262144, analysis_store=None):
+        """
+        :param eval_cache_size: slots in the evaluation cache, 0 disables it
+        :param tablebases: chessAITablebase.Tablebases to look endgames up in, or None
+        :param tt_size: slots in the transposition table, 0 disables it
+        :param analysis_store: chessAIStore.AnalysisStore keeping deep results between runs, or None
+        """
         self.board = board
         self.pieces = pieces
-
-    def evaluate(self, board_state, pieces, vals=None):
+        self.eval_cache = EvalCache(eval_cache_size) if eval_cache_size else None
+        self.tt = TranspositionTable(tt_size, analysis_store) if tt_size else None
+        self.tablebases = tablebases
+        self.stats = SearchStats()
+        self.stopped = False
+        self.node_limit = None
+        # Principal variation found at each ply by the search
+        self.pv = {}
+        # Move ordering: the last two quiet moves that caused a cutoff at each ply, and for each move the
+        # cutoffs it caused weighted by depth squared. Both are kept between searches, see EngineSession.
+        self.killers = {}
+        self.history = {}
+        # Move to search first at the root when the transposition table has none, such as the reply the
+        # last search predicted
+        self.root_move = None
+
+    def evaluate(self, board_state, pieces, vals=None, alpha=-inf, beta=inf, board_threat=None):
         """
         Generates a value based on the current game state. If black has the advantage,
         the heuristic value is positive, and for white it is negative.
         
         The majority of the heuristic relies on threat made by each side.
+
+        Values are looked up in (and saved to) the evaluation cache by position hash.
+
+        If an (alpha, beta) window is given, the evaluation may stop early once the value is known to be
+        outside of it, and returns a bound on the far side of the window instead of the exact value.
+        board_threat can be passed in when the caller already has the position's Threat.
         """
-        if vals is None:
-            # Default heuristic values if none is provided from the genetic algorithm
-            hVals = [2, 6, 6, 8, 1000, 2, 6, 6, 8, 1000, 3, 5, 3, 5, 10, 6, 6, 8, 50, 100, 4, 6, 6, 8, 50, 15, 10, 5,
-                     15, 5, 10, 6, 6, 8, 50, 4, 6, 6, 8, 15, 10, 5, 15, 5]
-        else:
-            hVals = vals
+        hVals = opponent_AI.DEFAULT_VALS if vals is None else vals
+
+        if self.eval_cache is None:
+            return self._evaluate(board_state, pieces, hVals, alpha, beta, board_threat)[0]
 
+        key = position_hash(board_state, pieces)
+        value = self.eval_cache.probe(key, hVals)
+        if value is None:
+            value, exact = self._evaluate(board_state, pieces, hVals, alpha, beta, board_threat)
+            if exact:  # Bounds are only good for the window they were computed with
+                self.eval_cache.store(key, hVals, value)
+        return value
+
+    def _margins(self, hVals):
+        """
+        Largest weight magnitudes of the threat terms, per unit of threat, used to bound how much the
+        later evaluation stages can change the score. Remembered for the last weights seen.
+        """
+        if getattr(self, "_margin_vals", None) is not hVals:
+            self._margin_vals = hVals
+            self._margin_weights = (
+                abs(hVals[10]), abs(hVals[11]), abs(hVals[12]), abs(hVals[13]),
+                max(max(abs(v) for v in hVals[14:23]), abs(hVals[23] * 5)) +
+                max(abs(hVals[24]), abs(hVals[25]), abs(hVals[26])) + max(abs(hVals[27]), abs(hVals[28])),
+                max(max(abs(v) for v in hVals[29:38]), abs(hVals[38] * 5)) +
+                max(abs(hVals[39]), abs(hVals[40]), abs(hVals[41])) + max(abs(hVals[42]), abs(hVals[43])))
+        return self._margin_weights
+
+    def _evaluate(self, board_state, pieces, hVals, alpha=-inf, beta=inf, board_threat=None):
+        """
+        The heuristic itself, without the cache. It is computed in stages, cheapest first: material and
+        attacked kings, then king distance, then piece threats and center control. Between stages, if the
+        remaining stages cannot bring the value back inside (alpha, beta), the bound is returned.
+        :return: (value, exact) where exact is False if value is only a bound outside the window
+        """
         h = 0
-        board_threat = Threat(board_state, pieces)
-        board_threat.getThreat()
+        if board_threat is None:
+            board_threat = Threat(board_state, pieces)
+            board_threat.getThreat()
         # Location markers for both kings for distance to king measurements
         whiteKing = None
         blackKing = None
@@ -1446,13 +2110,13 @@ class opponent_AI:
         # Check for terminal states before wasting time evaluating
         gameOver = board_threat.is_game_over()
         if gameOver == 1:  # White wins
-            return -1000000
+            return -1000000, True
 
         elif gameOver == 2:  # Black wins
-            return 1000000
+            return 1000000, True
 
         elif gameOver == 3:  # Tie
-            return 0
+            return 0, True
 
         # Tally up all of the materials on the board. Values from hVals array are weights for each piece
         for row in range(8):
@@ -1470,6 +2134,8 @@ class opponent_AI:
                 elif board_state.squares[row][col] == ChessPiece.B_KING:
                     blackKing = (row, col)  # Save the king's location
                     h += 100000  # Kings are always worth much more than other pieces
+                    if (row, col) in board_threat.whiteThreat:  # White is attacking the black king
+                        h -= 100000
                 elif board_state.squares[row][col] == ChessPiece.W_PAWN:
                     h -= hVals[5]
                 elif board_state.squares[row][col] == ChessPiece.W_KNIGHT:
@@ -1483,6 +2149,25 @@ class opponent_AI:
                 elif board_state.squares[row][col] == ChessPiece.W_KING:
                     whiteKing = (row, col)  # Save the king's location
                     h -= 100000  # Kings are always worth much more than other pieces
+                    if (row, col) in board_threat.blackThreat:  # Black is attacking the white king
+                        h += 100000
+
+        # Bound what the threat stages can still add, and stop here if that can't reach the window
+        windowed = alpha > -inf or beta < inf
+        if windowed:
+            blackCount = sum(board_threat.blackThreat.values())
+            whiteCount = sum(board_threat.whiteThreat.values())
+            wCount, wDist, bCount, bDist, blackTarget, whiteTarget = self._margins(hVals)
+            targetMargin = blackCount * blackTarget + whiteCount * whiteTarget
+            distanceMargin = 0
+            if whiteKing is not None and blackKing is not None:
+                distanceMargin = (blackCount * wCount + len(board_threat.blackThreat) * wDist * sqrt(98) +
+                                  whiteCount * bCount + len(board_threat.whiteThreat) * bDist * sqrt(98))
+            margin = distanceMargin + targetMargin
+            if h + margin <= alpha:
+                return round(h + margin), False
+            if h - margin >= beta:
+                return round(h - margin), False
 
         # Calculates the distance each threatened space is from the king. Rewards threatening spaces closer to the king
         if whiteKing is not None and blackKing is not None:
@@ -1499,6 +2184,12 @@ class opponent_AI:
                     if (row, col) in board_threat.whiteThreat.keys():
                         h -= hVals[12] * board_threat.whiteThreat[(row, col)] + ((distBK * hVals[13]))
 
+        if windowed:
+            if h + targetMargin <= alpha:
+                return round(h + targetMargin), False
+            if h - targetMargin >= beta:
+                return round(h - targetMargin), False
+
         # Weighs the heuristic to reward black for protecting its own pieces and for threatening white pieces
         for move, threat in board_threat.blackThreat.items():
             if board_state.squares[move[0]][move[1]] == ChessPiece.B_PAWN:
@@ -1521,8 +2212,6 @@ class opponent_AI:
                 h += hVals[22] * threat
             elif board_state.squares[move[0]][move[1]] == ChessPiece.W_QUEEN:
                 h += hVals[23] * threat * 5
-            elif board_state.squares[move[0]][move[1]] == ChessPiece.W_KING:
-                h += 100000
 
             # Rewards black for controlling the center of the board
             if move[0] == 4:
@@ -1558,8 +2247,6 @@ class opponent_AI:
                 h -= hVals[37] * threat
             elif board_state.squares[move[0]][move[1]] == ChessPiece.B_QUEEN:
                 h -= hVals[38] * threat * 5
-            elif board_state.squares[move[0]][move[1]] == ChessPiece.B_KING:
-                h -= 100000
 
             # Rewards white for controlling the center of the board
             if move[0] == 3:
@@ -1573,19 +2260,220 @@ class opponent_AI:
             if move[1] == 2 or move[1] == 5:
                 h -= hVals[43] * threat
 
-        return round(h)
+        return round(h), True
+
+    # Piece order of the planes used by batched evaluation. Matches the material order of hVals.
+    PLANE_PIECES = [ChessPiece.B_PAWN, ChessPiece.B_KNIGHT, ChessPiece.B_BISHOP, ChessPiece.B_ROOK,
+                    ChessPiece.B_QUEEN, ChessPiece.B_KING, ChessPiece.W_PAWN, ChessPiece.W_KNIGHT,
+                    ChessPiece.W_BISHOP, ChessPiece.W_ROOK, ChessPiece.W_QUEEN, ChessPiece.W_KING]
+
+    def position_planes(self, board_state, pieces):
+        """
+        Encodes a position for evaluate_batch.
+        :return: (piece planes of shape (12, 8, 8), threat count planes of shape (2, 8, 8) with black
+                 threat first, is_game_over() result)
+        """
+        if np is None:
+            raise RuntimeError("Batched evaluation requires numpy")
+
+        board_threat = Threat(board_state, pieces)
+        board_threat.getThreat()
+
+        piece_planes = np.zeros((12, 8, 8), dtype=np.int8)
+        for row in range(8):
+            for col in range(8):
+                piece = board_state.squares[row][col]
+                if piece is not None:
+                    piece_planes[opponent_AI.PLANE_PIECES.index(piece), row, col] = 1
+
+        threat_planes = np.zeros((2, 8, 8), dtype=np.int16)
+        for (row, col), threat in board_threat.blackThreat.items():
+            threat_planes[0, row, col] = threat
+        for (row, col), threat in board_threat.whiteThreat.items():
+            threat_planes[1, row, col] = threat
+
+        return piece_planes, threat_planes, board_threat.is_game_over()
+
+    def stack_positions(self, positions):
+        """
+        Encodes many (board_state, pieces) positions at once.
+        :return: (piece planes (N, 12, 8, 8), threat planes (N, 2, 8, 8), game over results (N,))
+        """
+        encoded = [self.position_planes(board_state, pieces) for board_state, pieces in positions]
+        if not encoded:
+            return (np.zeros((0, 12, 8, 8), dtype=np.int8), np.zeros((0, 2, 8, 8), dtype=np.int16),
+                    np.zeros(0, dtype=np.int8))
+        piece_planes, threat_planes, game_over = zip(*encoded)
+        return np.stack(piece_planes), np.stack(threat_planes), np.array(game_over, dtype=np.int8)
+
+    def evaluate_batch(self, piece_planes, threat_planes, game_over=None, vals=None):
+        """
+        Vectorized version of evaluate for N positions at once. Uses the same weights as evaluate and
+        returns the same scores, up to float rounding.
+        :param piece_planes: (N, 12, 8, 8) array, one plane per piece in PLANE_PIECES order
+        :param threat_planes: (N, 2, 8, 8) array of black and white threat counts
+        :param game_over: optional (N,) array of is_game_over() results for the terminal scores
+        :param vals: heuristic weights, the evaluate defaults if None
+        :return: (N,) int64 array of heuristic values
+        """
+        if np is None:
+            raise RuntimeError("Batched evaluation requires numpy")
+
+        if vals is None:
+            vals = opponent_AI.DEFAULT_VALS
+        hVals = np.asarray(vals[:44], dtype=np.float64)
+
+        planes = np.asarray(piece_planes, dtype=np.float64)
+        blackThreat = np.asarray(threat_planes[:, 0], dtype=np.float64)
+        whiteThreat = np.asarray(threat_planes[:, 1], dtype=np.float64)
+        blackThreatened = blackThreat > 0
+        whiteThreatened = whiteThreat > 0
+
+        # Material, kings are always worth much more than other pieces
+        counts = planes.sum(axis=(2, 3))
+        h = counts[:, 0:5] @ hVals[0:5] - counts[:, 6:11] @ hVals[5:10] + 100000 * (counts[:, 5] - counts[:, 11])
+
+        # Distance of each threatened space from the king, only when both kings are on the board
+        kings = (counts[:, 5] > 0) & (counts[:, 11] > 0)
+        grid_row, grid_col = np.indices((8, 8))
+        blackKing = planes[:, 5].reshape(-1, 64).argmax(axis=1)
+        whiteKing = planes[:, 11].reshape(-1, 64).argmax(axis=1)
+        distWK = np.sqrt((grid_row - (whiteKing // 8)[:, None, None]) ** 2 +
+                         (grid_col - (whiteKing % 8)[:, None, None]) ** 2)
+        distBK = np.sqrt((grid_row - (blackKing // 8)[:, None, None]) ** 2 +
+                         (grid_col - (blackKing % 8)[:, None, None]) ** 2)
+        distance = (np.where(blackThreatened, hVals[10] * blackThreat + distWK * hVals[11], 0).sum(axis=(1, 2)) -
+                    np.where(whiteThreatened, hVals[12] * whiteThreat + distBK * hVals[13], 0).sum(axis=(1, 2)))
+        h += np.where(kings, distance, 0)
+
+        # Protecting own pieces and threatening the opponent's, per piece plane
+        blackWeights = np.concatenate((hVals[14:19], [0], hVals[19:23], [hVals[23] * 5, 0]))
+        whiteWeights = np.concatenate((hVals[34:38], [hVals[38] * 5, 0], hVals[29:34], [0]))
+        h += np.einsum("npij,p,nij->n", planes, blackWeights, blackThreat)
+        h -= np.einsum("npij,p,nij->n", planes, whiteWeights, whiteThreat)
+        h += 100000 * (planes[:, 11] * blackThreatened).sum(axis=(1, 2))
+        h -= 100000 * (planes[:, 5] * whiteThreatened).sum(axis=(1, 2))
+
+        # Center control
+        blackRows = np.array([0, 0, hVals[26], hVals[25], hVals[24], hVals[26], 0, 0])
+        whiteRows = np.array([0, 0, hVals[41], hVals[39], hVals[40], hVals[41], 0, 0])
+        blackCols = np.array([0, 0, hVals[28], hVals[27], hVals[27], hVals[28], 0, 0])
+        whiteCols = np.array([0, 0, hVals[43], hVals[42], hVals[42], hVals[43], 0, 0])
+        h += (blackThreat * (blackRows[:, None] + blackCols[None, :])).sum(axis=(1, 2))
+        h -= (whiteThreat * (whiteRows[:, None] + whiteCols[None, :])).sum(axis=(1, 2))
+
+        scores = np.round(h).astype(np.int64)
+        if game_over is not None:
+            game_over = np.asarray(game_over)
+            scores[game_over == 1] = -1000000
+            scores[game_over == 2] = 1000000
+            scores[game_over == 3] = 0
+        return scores
+
+    def forward_prune(self, board_state, pieces, color, validMoves, vals=None):
+        """
+        Evaluates each potential child state and discards the worse half of the moves for color.
+        The children are scored in one evaluate_batch call when numpy is available.
+        """
+        children = []
+        for move in validMoves:  # Generate each child state
+            boardCopy = board_state.deep_copy()
+            piecesCopy = pieces.deep_copy()
+            children.append(self.makeMove(boardCopy, piecesCopy, move))
+
+        # Evaluate the states and save the value with the move to sort moves by the heuristic of the state
+        if np is not None:
+            hVals = opponent_AI.DEFAULT_VALS if vals is None else vals
+            scores = [None] * len(children)
+            keys = [None] * len(children)
+            if self.eval_cache is not None:
+                for i in range(len(children)):
+                    keys[i] = position_hash(*children[i])
+                    scores[i] = self.eval_cache.probe(keys[i], hVals)
+            missing = [i for i in range(len(children)) if scores[i] is None]
+            if missing:
+                batch = self.evaluate_batch(*self.stack_positions([children[i] for i in missing]), vals=hVals)
+                for i, value in zip(missing, batch.tolist()):
+                    scores[i] = value
+                    if self.eval_cache is not None:
+                        self.eval_cache.store(keys[i], hVals, value)
+        else:
+            scores = [self.evaluate(boardMoved, piecesMoved, vals=vals) for boardMoved, piecesMoved in children]
+        evaluatedMoves = list(zip(scores, validMoves))
+
+        # Sorting child states by heuristic and choose the best half (first or last half based on color)
+        def getKey(item):
+            return item[0]
+
+        half = int(len(evaluatedMoves) / 2)
+        s = sorted(evaluatedMoves, key=getKey)
+        if color == "black":
+            return [m for _, m in s[half:]]
+        return [m for _, m in s[:half]]
 
-    def minimax(self, board_state, pieces, color, depth, alpha=-inf, beta=inf, vals=None, timeout=None):
+    def stop(self):
+        """
+        Makes a running search give up as if it ran out of time. Safe to call from another thread.
+        Whoever starts the next search clears stopped again.
+        """
+        self.stopped = True
+
+    def _timed_out(self, timeout):
+        """
+        True once the search is past its timeout, has been stopped, or has used up its node limit.
+        A timeout of None never runs out.
+        """
+        if self.stopped:
+            return True
+        if self.node_limit is not None and self.stats.nodes >= self.node_limit:
+            return True
+        return timeout is not None and time.time() > timeout
+
+    def minimax(self, board_state, pieces, color, depth, alpha=-inf, beta=inf, vals=None, timeout=None, ply=0):
         """
         This minimax algorithm is the heart of our AI solution.
         Using a heuristic optimized by the genetic algorithm, and doing forward pruning,
         alpha-beta pruning, and limited depth search to decrease performance cost,
         the best moves for the AI and the user are predicted up to a specified depth
         and returned to be moved.
-        
+
+        timeout is the time.time() to give up at, or None to search to depth however long it takes.
+        ply is the distance from the root, the best line from this node is left in self.pv[ply].
         """
-        if time.time() > timeout:  # Timeout check to break out of the loop if out of time
+        if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
             return -1, None
+        self.stats.nodes += 1
+        self.pv[ply] = []
+
+        # Endgames in the tablebases have their exact value, the search below them is not needed
+        if self.tablebases is not None and ply > 0:
+            value = self.tablebases.value(board_state, color)
+            if value is not None:
+                self.stats.tb_hits += 1
+                return value, None
+
+        # Transposition table. A result of a search at least as deep ends the search of this node if it is
+        # exact or a bound outside the window, otherwise its best move is searched first. At the root only
+        # an exact result with a move is used.
+        key = None
+        hashMove = None
+        alphaOrig, betaOrig = alpha, beta
+        if self.tt is not None:
+            key = position_hash(board_state, pieces)
+            hVals = opponent_AI.DEFAULT_VALS if vals is None else vals
+            self.stats.tt_probes += 1
+            entry = self.tt.probe(key, hVals, depth)
+            if entry is not None:
+                self.stats.tt_hits += 1
+                ttDepth, ttValue, ttFlag, hashMove = entry
+                if ttDepth >= depth:
+                    if ttFlag == TranspositionTable.EXACT and (ply > 0 or hashMove is not None):
+                        self.pv[ply] = self._tt_line(board_state, pieces, hashMove, hVals, ttDepth) \
+                            if ply == 0 else [hashMove] if hashMove is not None else []
+                        return ttValue, hashMove
+                    if ply > 0 and ((ttFlag == TranspositionTable.LOWER and ttValue >= beta) or
+                                    (ttFlag == TranspositionTable.UPPER and ttValue <= alpha)):
+                        return ttValue, hashMove
 
         # Generates a threat object and calculates/stores all the threatened spaces and possible moves
         board_threat = Threat(board_state, pieces)
@@ -1599,53 +2487,48 @@ class opponent_AI:
         # Check if the game is over before continuing the computation intensive part of minimax
         gameOver = board_threat.is_game_over()
 
+        ##### Terminal states #####
+        # If it's a terminal state (game over or max depth) return the heuristic of the state. The leaf is
+        # evaluated against the current window, reusing this node's threat. Leaves are not forward pruned.
+        if depth == 0 or gameOver == 1 or gameOver == 2 or gameOver == 3:
+            if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
+                return (-1, None)
+            value = self.evaluate(board_state, pieces, vals=vals, alpha=alpha, beta=beta, board_threat=board_threat)
+            return (value, None)
+
         ##### Forward Pruning #####
         # Forward pruning part of minimax. If there are 20 or fewer valid moves, skip this part and continue
         # with minimax. Otherwise, evaluate each potential child state and discard the bottom half before
         # continuing with minimax
-        if len(validMoves) <= 20:
-            pass
+        if len(validMoves) > 20:
+            prunedMoves = self.forward_prune(board_state, pieces, color, validMoves, vals=vals)
+            self.stats.forward_pruned += len(validMoves) - len(prunedMoves)
+            validMoves = prunedMoves
+
+        # The best move found for this position before is searched first, even if it was pruned
+        if hashMove is None and ply == 0:
+            hashMove = self.root_move
+        if hashMove is not None and hashMove in (board_threat.blackMoves if color == "black"
+                                                 else board_threat.whiteMoves):
+            validMoves = [hashMove] + [m for m in validMoves if m != hashMove]
         else:
-            prunedMoves = []
-            evaluatedMoves = []
-            for move in validMoves:  # Generate each child state
-                boardCopy = board_state.deep_copy()
-                piecesCopy = pieces.deep_copy()
-
-                boardMoved, piecesMoved = self.makeMove(boardCopy, piecesCopy, move)
-
-                # Evaluate the state and save the value with the move to sort moves by the heuristic of the state
-                tempVal = self.evaluate(boardMoved, piecesMoved, vals=vals)
-                evaluatedMoves.append((tempVal, move))
-
-            # Sorting child states by heuristic and choose the best half (first or last half based on color)
-            def getKey(item):
-                return item[0]
+            hashMove = None
 
-            half = int(len(evaluatedMoves) / 2)
-            s = sorted(evaluatedMoves, key=getKey)
-            if color == "black":
-                for i in range(half, len(s)):
-                    prunedMoves.append(s[i][1])
-            else:
-                for i in range(half):
-                    prunedMoves.append(s[i][1])
-
-            validMoves = prunedMoves  # The new list of valid moves is the shorter list of moves
+        # Then the killer moves of this ply, then the rest by history. Moves with no history keep their order.
+        killers = self.killers.get(ply, [])
+        if killers or self.history:
+            first = [hashMove] if hashMove is not None else []
+            rest = validMoves[len(first):]
+            killerMoves = [m for m in killers if m in rest]
+            rest = sorted([m for m in rest if m not in killerMoves], key=lambda m: -self.history.get(m, 0))
+            validMoves = first + killerMoves + rest
 
         ##### Minimax search on the pruned list of moves #####
-        # If it's a terminal state (game over or max depth) return the heuristic of the state
-        if depth == 0 or gameOver == 1 or gameOver == 2 or gameOver == 3:
-            if time.time() > timeout:  # Timeout check to break out of the loop if out of time
-                return (-1, None)
-            value = self.evaluate(board_state, pieces, vals=vals)
-            return (value, None)
-
         # Otherwise we recursively call minimax with a decreased depth.
         if color == "white":  # USER
             value = inf
             move = choice(validMoves)
-            for m in validMoves:  # Generate all children states
+            for i, m in enumerate(validMoves):  # Generate all children states
 
                 # Deep copy the board and pieces. Create a new search node
                 boardCopy = board_state.deep_copy()
@@ -1653,16 +2536,17 @@ class opponent_AI:
 
                 boardMoved, piecesMoved = self.makeMove(boardCopy, piecesCopy, m)
 
-                if time.time() > timeout:  # Timeout check to break out of the loop if out of time
+                if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
                     return (-1, None)
 
                 tempVal = self.minimax(boardMoved, piecesMoved, "black", depth - 1, alpha, beta, vals=vals,
-                                       timeout=timeout)[0]
+                                       timeout=timeout, ply=ply + 1)[0]
 
                 # Save the move if it's better than what is already saved
                 if value > tempVal:
                     value = tempVal
                     move = m
+                    self.pv[ply] = [m] + self.pv.get(ply + 1, [])
 
                 # Adjust the beta value if a better one is found
                 if value < beta:
@@ -1670,17 +2554,22 @@ class opponent_AI:
 
                 # Prune the rest of the branch if there isn't a possibility of finding better states
                 if alpha >= beta:
+                    self.stats.cutoffs += 1
+                    if i == 0:
+                        self.stats.first_move_cutoffs += 1
+                    self._record_cutoff(board_state, m, depth, ply)
                     break
 
-            if time.time() > timeout:  # Timeout check to break out of the loop if out of time
+            if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
                 return (-1, None)
 
+            self._store(key, vals, depth, value, move, alphaOrig, betaOrig)
             return (value, move)  # Return the best move from the children and it's value
 
         else:  # BLACK AI
             value = -inf
             move = choice(validMoves)
-            for m in validMoves:  # Generate all children states
+            for i, m in enumerate(validMoves):  # Generate all children states
 
                 # Deep copy the board and pieces. Create a new search node
                 boardCopy = board_state.deep_copy()
@@ -1688,16 +2577,17 @@ class opponent_AI:
 
                 boardMoved, piecesMoved = self.makeMove(boardCopy, piecesCopy, m)
 
-                if time.time() > timeout:  # Timeout check to break out of the loop if out of time
+                if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
                     return (-1, None)
 
                 tempVal = self.minimax(boardMoved, piecesMoved, "white", depth - 1, alpha, beta, vals=vals,
-                                       timeout=timeout)[0]
+                                       timeout=timeout, ply=ply + 1)[0]
 
                 # Save the move if it's better than what is already saved
                 if value < tempVal:
                     value = tempVal
                     move = m
+                    self.pv[ply] = [m] + self.pv.get(ply + 1, [])
 
                 # Adjust the alpha value if a better one is found
                 if value > alpha:
@@ -1705,13 +2595,164 @@ class opponent_AI:
 
                 # Prune the rest of the branch if there isn't a possibility of finding better states
                 if alpha >= beta:
+                    self.stats.cutoffs += 1
+                    if i == 0:
+                        self.stats.first_move_cutoffs += 1
+                    self._record_cutoff(board_state, m, depth, ply)
                     break
 
-            if time.time() > timeout:  # Timeout check to break out of the loop if out of time
+            if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
                 return (-1, None)
 
+            self._store(key, vals, depth, value, move, alphaOrig, betaOrig)
             return (value, move)  # Return the best move from the children and it's value
 
+    def _record_cutoff(self, board_state, move, depth, ply):
+        """
+        Updates the killer moves and history of a quiet move that caused a cutoff. Captures are not
+        recorded, they are good in fewer positions than the ones they were found in.
+        """
+        if board_state.squares[move[1][0]][move[1][1]] is not None:
+            return
+        killers = self.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        self.history[move] = self.history.get(move, 0) + depth * depth
+
+    def _tt_line(self, board_state, pieces, move, vals, depth):
+        """
+        Principal variation of up to depth moves starting with move, following the best moves saved in the
+        transposition table.
+        """
+        line = [move]
+        boardCopy = board_state.deep_copy()
+        piecesCopy = pieces.deep_copy()
+        piecesCopy.moveHistory = list(pieces.moveHistory)
+        while len(line) < depth:
+            boardCopy, piecesCopy = self.makeMove(boardCopy, piecesCopy, line[-1])
+            entry = self.tt.probe(position_hash(boardCopy, piecesCopy), vals, depth - len(line))
+            if entry is None or entry[3] is None or boardCopy.squares[entry[3][0][0]][entry[3][0][1]] is None:
+                break
+            line.append(entry[3])
+        return line
+
+    def _store(self, key, vals, depth, value, move, alpha, beta):
+        """
+        Saves a node's result in the transposition table, as a bound if it fell outside the window (alpha, beta)
+        it was searched with.
+        """
+        if self.tt is None:
+            return
+        if value <= alpha:
+            flag = TranspositionTable.UPPER
+        elif value >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.tt.store(key, opponent_AI.DEFAULT_VALS if vals is None else vals, depth, value, flag, move)
+
+    def search(self, board_state, pieces, color, depth=2, max_depth=4, vals=None, timeout=None, callback=None,
+               profile=None, node_limit=None):
+        """
+        Iterative deepening minimax search from depth to max_depth, keeping the result of the deepest
+        search that finished before the timeout, the node limit, or a call to stop().
+        :param callback: called as callback(stats, iteration) after each completed iteration
+        :param profile: path prefix (or directory) to profile this search to, see SearchProfiler. Defaults
+                        to the CHESSAI_PROFILE environment variable; no profiling if neither is set.
+        :return: (value, move, stats) with the SearchStats of the whole search. The move is None if not
+                 even the first iteration finished.
+        """
+        if profile is None:
+            profile = os.environ.get("CHESSAI_PROFILE")
+        if not profile:
+            return self._search(board_state, pieces, color, depth, max_depth, vals, timeout, callback, node_limit)
+
+        profiler = SearchProfiler(profile)
+        profiler.start()
+        try:
+            val, move, stats = self._search(board_state, pieces, color, depth, max_depth, vals, timeout, callback,
+                                            node_limit)
+        finally:
+            summary = profiler.stop()
+        stats.profile = summary
+        return val, move, stats
+
+    def _tablebase_move(self, board_state, pieces, color):
+        """
+        Best move at the root by the tablebases: the fastest win, a draw, or the slowest loss.
+        :return: (value, move) or None if the position's moves are not all in the tablebases
+        """
+        if self.tablebases.probe(board_state, color) is None:
+            return None
+        threat = Threat(board_state, pieces)
+        threat.getThreat()
+        opponent = "white" if color == "black" else "black"
+        best = None
+        for m in (threat.blackMoves if color == "black" else threat.whiteMoves):
+            # Headless, so the moves tried are not drawn on the game's board
+            child = pieces.headless_copy()
+            try:
+                child.push_move(m[0][0], m[0][1], m[1][0], m[1][1])
+            except ValueError:
+                continue
+            value = self.tablebases.value(child.board, opponent)
+            self.stats.tb_hits += 1
+            if value is None:  # the move leaves its own king in check
+                continue
+            if best is None or (value > best[0] if color == "black" else value < best[0]):
+                best = (value, m)
+        return best
+
+    def _search(self, board_state, pieces, color, depth, max_depth, vals, timeout, callback, node_limit):
+        self.stats = SearchStats()
+        self.node_limit = node_limit
+
+        if self.tablebases is not None:
+            start = time.time()
+            found = self._tablebase_move(board_state, pieces, color)
+            if found is not None:
+                value, move = found
+                iteration = {"depth": 1, "value": value, "move": move, "pv": [move], "nodes": 0,
+                             "seconds": time.time() - start, "ebf": 0.0}
+                self.stats.iterations.append(iteration)
+                if callback is not None:
+                    callback(self.stats, iteration)
+                return value, move, self.stats
+        evalHits = self.eval_cache.hits if self.eval_cache is not None else 0
+        evalMisses = self.eval_cache.misses if self.eval_cache is not None else 0
+        curVal = None  # The deepest current value returned from minimax
+        curMove = None  # The corresponding current move
+        while depth <= max_depth:
+            nodes = self.stats.nodes
+            start = time.time()
+
+            val, move = self.minimax(board_state, pieces, color, depth, vals=vals, timeout=timeout)
+
+            # Only a search that completed is kept
+            if move is not None:
+                curVal = val
+                curMove = move
+                iterationNodes = self.stats.nodes - nodes
+                previous = self.stats.iterations[-1]["nodes"] if self.stats.iterations else 0
+                iteration = {"depth": depth, "value": val, "move": move, "pv": self.pv.get(0, [move]),
+                             "nodes": iterationNodes, "seconds": time.time() - start,
+                             "ebf": iterationNodes / previous if previous else iterationNodes ** (1 / depth)}
+                self.stats.iterations.append(iteration)
+                if callback is not None:
+                    callback(self.stats, iteration)
+
+            if self._timed_out(timeout):  # Timeout check to break out of the loop if out of time
+                break
+            depth += 1
+
+        if self.eval_cache is not None:
+            self.stats.eval_hits = self.eval_cache.hits - evalHits
+            self.stats.eval_probes = self.stats.eval_hits + self.eval_cache.misses - evalMisses
+        if self.tt is not None and self.tt.analysis_store is not None:
+            self.tt.analysis_store.flush()
+        return curVal, curMove, self.stats
+
     def makeMove(self, board, pieces, move):
         """
         Moves piece on a virtual board without affecting the GUI.
@@ -1726,6 +2767,71 @@ class opponent_AI:
         return board, pieces
 
 
+class EngineSession:
+    """
+    One engine kept for a whole game, so each search starts from what the last one learned instead of
+    from nothing. The transposition table, evaluation cache, killer moves, history and last principal
+    variation carry over between moves and are aged for the moves played since:
+
+    - transposition table entries of earlier searches give up their slots first (TranspositionTable.new_search)
+    - history counts are halved each search, so recent cutoffs count most
+    - killer moves are shifted by the plies played, so the killers of what is now ply 1 were found at ply 1
+    - if the moves played are the ones the last principal variation predicted, the rest of it is searched first
+
+    Attributes:
+        ai: the opponent_AI kept between searches.
+        last_pv: principal variation of the last search.
+        predicted: the part of last_pv still ahead of the current position, empty if the game left it.
+    """
+
+    def __init__(self, eval_cache_size=65536, tt_size=262144, tablebases=None, analysis_store=None):
+        self.ai = opponent_AI(None, None, eval_cache_size=eval_cache_size, tablebases=tablebases, tt_size=tt_size,
+                              analysis_store=analysis_store)
+        self.last_pv = []
+        self.predicted = []
+        # Length of the move history at the last search, None before the first one
+        self.history_length = None
+
+    def new_game(self):
+        """
+        Forgets the move ordering state. Transposition table entries stay, they are keyed by position.
+        """
+        self.ai.killers = {}
+        self.ai.history = {}
+        self.last_pv = []
+        self.predicted = []
+        self.history_length = None
+
+    def _age(self, pieces):
+        played = len(pieces.moveHistory) - self.history_length if self.history_length is not None else -1
+        if played < 0:  # First search, or a different game
+            self.new_game()
+            return
+        if self.ai.tt is not None:
+            self.ai.tt.new_search()
+        self.ai.history = {move: count // 2 for move, count in self.ai.history.items() if count > 1}
+        self.ai.killers = {ply - played: killers for ply, killers in self.ai.killers.items() if ply >= played}
+
+        # Still on the predicted line if each move played is the next move of the last principal variation
+        self.predicted = []
+        moves = [((entry[1], entry[2]), (entry[3], entry[4])) for entry in pieces.moveHistory[-played:]] \
+            if played else []
+        if moves == self.last_pv[:played]:
+            self.predicted = self.last_pv[played:]
+
+    def search(self, board_state, pieces, color, **kwargs):
+        """
+        opponent_AI.search from the state of the last search.
+        :return: (value, move, stats)
+        """
+        self._age(pieces)
+        self.ai.root_move = self.predicted[0] if self.predicted else None
+        value, move, stats = self.ai.search(board_state, pieces, color, **kwargs)
+        self.last_pv = stats.iterations[-1]["pv"] if stats.iterations else []
+        self.history_length = len(pieces.moveHistory)
+        return value, move, stats
+
+
 ################################################################################
 class Input:
     """Get input from user for move.
@@ -1738,10 +2844,16 @@ class Input:
         selected_row: row of selected piece.
         selected_col: col of selected piece.
         turn_color: color of player taking current turn.
+        pgn: PGNWriter recording the game, or None.
+        book: OpeningBook the AI plays from, or None.
+        tablebases: Tablebases the AI plays endgames from, or None.
+        analysis_store: AnalysisStore the AI's search results are kept in, or None.
+        engine: EngineSession the AI searches with, None for an Input that does not play the AI's moves.
         
     """
 
-    def __init__(self, chess_board, pieces, window, update):
+    def __init__(self, chess_board, pieces, window, update, pgn=None, book=None, tablebases=None,
+                 analysis_store=None, engine=None):
         """Inits and setup keyboard input handlers.
         
         Args:
@@ -1749,6 +2861,11 @@ class Input:
             pieces: Object of CheckPiece
             window: Turtle screen.
             update: Refers to update().
+            pgn: PGNWriter recording the game, None for no record.
+            book: OpeningBook of the AI's moves, None for no book.
+            tablebases: Tablebases of the AI's endgames, None for none.
+            analysis_store: AnalysisStore of the AI's search results, None for none.
+            engine: EngineSession of the AI's searches.
         """
         import turtle
 
@@ -1761,8 +2878,62 @@ class Input:
         self.turn_color = "white"
         self.window = turtle.Screen()
 
+        self.pgn = pgn
+        self.book = book
+        self.tablebases = tablebases
+        self.analysis_store = analysis_store
+        self.engine = engine
+
         window.onclick(self.onclick)
 
+    def play_book_move(self):
+        """
+        Plays the AI's move from the opening book, if the position is in it
+        :return: True if a book move was played
+        """
+        if self.book is None:
+            return False
+        found = self.book.probe(self.board, self.pieces)
+        if found is None:
+            return False
+        move, promotion = found
+        try:
+            self.pieces.push_move(move[0][0], move[0][1], move[1][0], move[1][1], promotion)
+        except ValueError:
+            return False
+        print("book move")
+        return True
+
+    def record_move(self):
+        """
+        Prints the last move and adds it to the PGN record
+        """
+        print(self.pieces.moveHistory[-1])
+        if self.pgn is not None:
+            self.pgn.write_move(self.pieces.moveHistory[-1])
+
+    def record_result(self, result):
+        """
+        Ends the PGN record with the game's result, and closes the opening book, tablebases and analysis store
+        """
+        if self.pgn is not None:
+            self.pgn.end_game(result)
+            self.pgn.stream.close()
+        if self.book is not None:
+            self.book.close()
+        if self.tablebases is not None:
+            self.tablebases.close()
+        if self.analysis_store is not None:
+            self.analysis_store.close()
+
+    def print_iteration(self, stats, iteration):
+        """
+        Prints each completed iterative deepening pass of the AI's search to the console
+        """
+        print("depth %d: value %s, move %s, %d nodes in %.2fs, %d cutoffs (%.0f%% first move)" %
+              (iteration["depth"], iteration["value"], iteration["move"], iteration["nodes"],
+               iteration["seconds"], stats.cutoffs, 100 * stats.first_move_cutoff_rate()))
+
     def onclick(self, x, y):
         """
         Essentially the main function of the whole program. Contains all of the logic for how to handle clicks with the
@@ -1834,7 +3005,7 @@ class Input:
         self.pieces.moveHistory.append(
             (self.pieces.board.squares[row][col], self.selected_row, self.selected_col, row, col))
 
-        print(self.pieces.moveHistory[-1])
+        self.record_move()
 
         self.board.print_board()
 
@@ -1849,12 +3020,15 @@ class Input:
             pass
         elif result == 1:
             print("White wins")
+            self.record_result("1-0")
             exit(0)
         elif result == 2:
             print("Black wins")
+            self.record_result("0-1")
             exit(0)
         elif result == 3:
             print("Tie")
+            self.record_result("1/2-1/2")
             exit(0)
 
         # switch player
@@ -1868,52 +3042,29 @@ class Input:
             self.board._put_chr_at("Turn: White", 9, 1, (255, 255, 255))
             self.board._put_chr_at("Turn: Black", 9, 1, (0, 0, 0))
 
-        ai = opponent_AI(self.board, self.pieces)
-
-        # Optimized weights for the evaluation function
-        # generated by chessAIGeneticAlgo.py
-        weights = [1019, 1228, 1222, 1449, 2934, 693, 400, 520, 615, 832, 157,
-                   1407, 861, 1147, 786, 527, 616, 994, 1053, 1173, 255, 713,
-                   633, 1308, 768, 974, 612, 205, 730, 562, 1462, 742, 208,
-                   844, 593, 1486, 563, 1267, 586, 729, 2, 941, 990, 547, 854,
-                   1054, 147, 934, 451, 258, 895, 109]
-
-        ##### Iterative Deepening #####
-        # Iterative depth deepening minimax search. Starting with depth of 3, which takes under a minute to compute, and
-        # then trying to compute depth 4 within the alloted 4 minutes.
-        # Timeout checks are in minimax to break out if the time runs out
-        timeout = time.time() + (60 * 4)  # four minutes per turn
-        depth = 2  # Starting depth
-        curVal = None  # The deepest current value returned from minimax
-        curMove = None  # The corresponding current move
-        while depth <= 4:
-            time.sleep(1)
-
-            val, move = ai.minimax(self.board, self.pieces, "black", depth, vals=weights, timeout=timeout)
-
-            # If the minimax didn't complete, reset the values to what they were before
-            if val == -1 or move is None:
-                val = curVal
-                move = curMove
+        # Book moves are played instantly, without a search
+        if not self.play_book_move():
+            # Optimized weights for the evaluation function
+            weights = opponent_AI.TUNED_VALS
 
-            # If the minimax did complete, save the new results
-            curVal = val
-            curMove = move
+            ##### Iterative Deepening #####
+            # Iterative depth deepening minimax search. Starting with depth of 2, and then trying to compute
+            # depth 4 within the alloted 4 minutes.
+            # Timeout checks are in minimax to break out if the time runs out
+            timeout = time.time() + (60 * 4)  # four minutes per turn
+            val, move, stats = self.engine.search(self.board, self.pieces, "black", depth=2, max_depth=4,
+                                                  vals=weights, timeout=timeout, callback=self.print_iteration)
 
-            if time.time() > timeout:  # Timeout check to break out of the loop if out of time
-                break
-            depth += 1
+            self.board.move_piece(move[0][0], move[0][1], move[1][0], move[1][1])
 
-        self.board.move_piece(move[0][0], move[0][1], move[1][0], move[1][1])
+            if move[1][0] == 7 and self.board.squares[move[1][0]][move[1][1]] == ChessPiece.B_PAWN:
+                self.board.overwrite_board_square(move[1][0], move[1][1])
+                self.board.put_piece(ChessPiece.B_QUEEN, move[1][0], move[1][1])
 
-        if move[1][0] == 7 and self.board.squares[move[1][0]][move[1][1]] == ChessPiece.B_PAWN:
-            self.board.overwrite_board_square(move[1][0], move[1][1])
-            self.board.put_piece(ChessPiece.B_QUEEN, move[1][0], move[1][1])
+            self.pieces.moveHistory.append((self.pieces.board.squares[move[1][0]][move[1][1]],
+                                            move[0][0], move[0][1], move[1][0], move[1][1]))
 
-        self.pieces.moveHistory.append((self.pieces.board.squares[move[1][0]][move[1][1]],
-                                        move[0][0], move[0][1], move[1][0], move[1][1]))
-
-        print(self.pieces.moveHistory[-1])
+        self.record_move()
 
         # Troubleshooting Code for boardthreat/moves
 #         test = Threat(self.board, self.pieces)
@@ -1939,12 +3090,15 @@ class Input:
             pass
         elif result == 1:
             print("White wins")
+            self.record_result("1-0")
             exit(0)
         elif result == 2:
             print("Black wins")
+            self.record_result("0-1")
             exit(0)
         elif result == 3:
             print("Tie")
+            self.record_result("1/2-1/2")
             exit(0)
 
         # switch player
@@ -1965,5 +3119,6 @@ class Input:
 ################################################################################
 # Run the Game.
 # print "\x1b[30m \x1b[0m"
-chess = Chess()
-chess.run()
+if __name__ == "__main__":
+    chess = Chess()
+    chess.run()
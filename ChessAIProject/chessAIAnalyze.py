@@ -0,0 +1,170 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Bulk position analysis. Streams positions from an EPD or FEN file (one per line), searches each one to a
+# fixed depth or node budget on a pool of worker processes, and writes one JSON object per position, in
+# input order, with the score, best move, principal variation, nodes and time.
+#
+# Only a bounded window of positions is in flight at once, so memory use does not grow with the input.
+#
+# usage: python3 chessAIAnalyze.py positions.epd [--depth 3 | --nodes 20000] [--processes 4] [--output out.jsonl]
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from chessAI import ChessPiece, opponent_AI, side_to_move, uci_move, uci_pv
+
+# Deepest pass of a search limited by nodes only
+MAX_DEPTH = 64
+
+# Engine of each worker process, kept between positions so its evaluation cache stays warm
+_engine = None
+
+
+def parse_position(line):
+    """
+    Splits an EPD or FEN line.
+    :return: (fen, operations) where operations are the EPD opcodes, such as id or bm, as a dict
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Not an EPD or FEN line: %r" % line)
+    fen = " ".join(fields[:4])
+    rest = fields[4] if len(fields) > 4 else ""
+
+    # FEN lines end with the halfmove and fullmove counters, EPD lines with operations
+    counters = rest.split()
+    if len(counters) == 2 and all(c.isdigit() for c in counters):
+        return fen + " " + rest, {}
+    operations = {}
+    for operation in rest.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operations[opcode] = operand.strip().strip('"')
+    return fen + " 0 1", operations
+
+
+def init_worker(eval_cache_size):
+    global _engine
+    _engine = opponent_AI(None, None, eval_cache_size=eval_cache_size)
+
+
+def analyze(job):
+    """
+    Searches one position with the worker's engine.
+    :param job: (line number, input line, depth, node limit)
+    :return: the JSON-ready result, with an error instead if the position could not be analyzed
+    """
+    try:
+        return _analyze(job)
+    except Exception as e:  # One position that breaks the search must not end the whole batch
+        return {"line": job[0], "error": "%s: %s" % (type(e).__name__, e)}
+
+
+def _analyze(job):
+    number, line, depth, node_limit = job
+    result = {"line": number}
+    try:
+        fen, operations = parse_position(line)
+        pieces = ChessPiece.from_fen(fen)
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+    if "id" in operations:
+        result["id"] = operations["id"]
+    result["fen"] = fen
+
+    color = side_to_move(pieces)
+    start = time.time()
+    if node_limit is None:
+        value, move, stats = _engine.search(pieces.board, pieces, color, depth=depth, max_depth=depth,
+                                            vals=opponent_AI.TUNED_VALS)
+    else:
+        value, move, stats = _engine.search(pieces.board, pieces, color, depth=1, max_depth=depth or MAX_DEPTH,
+                                            vals=opponent_AI.TUNED_VALS, node_limit=node_limit)
+
+    pv = stats.iterations[-1]["pv"] if stats.iterations else []
+    result.update({
+        "depth": stats.iterations[-1]["depth"] if stats.iterations else 0,
+        "value": value if move is not None else None,
+        # Centipawns for the side to move, like UCI scores
+        "cp": (value if color == "black" else -value) * 100 // opponent_AI.TUNED_VALS[0]
+        if move is not None else None,
+        "bestmove": uci_move(pieces.board, move) if move is not None else None,
+        "pv": uci_pv(pieces.board, pv),
+        "nodes": stats.nodes,
+        "seconds": time.time() - start,
+    })
+    return result
+
+
+def jobs(lines, depth, node_limit):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield number, line, depth, node_limit
+
+
+def run(lines, out, depth=3, node_limit=None, processes=None, eval_cache_size=65536):
+    """
+    Analyzes every position of lines, writing JSON lines to out in input order.
+    :param depth: search depth, or the deepest iteration when node_limit is given
+    :param node_limit: nodes to search each position for, instead of a fixed depth
+    :param processes: worker processes, 1 analyzes in this process
+    :return: positions analyzed
+    """
+    count = 0
+    if processes == 1:
+        init_worker(eval_cache_size)
+        for job in jobs(lines, depth, node_limit):
+            out.write(json.dumps(analyze(job)) + "\n")
+            count += 1
+        return count
+
+    processes = processes or os.cpu_count() or 1
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(eval_cache_size,)) as pool:
+        # A few positions per worker are queued ahead. Results are written from the front of the window,
+        # so output stays in input order and the window never grows.
+        window = collections.deque()
+        for job in jobs(lines, depth, node_limit):
+            window.append(pool.apply_async(analyze, (job,)))
+            if len(window) >= 4 * processes:
+                out.write(json.dumps(window.popleft().get()) + "\n")
+                count += 1
+        while window:
+            out.write(json.dumps(window.popleft().get()) + "\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze EPD or FEN positions in bulk, writing JSON lines")
+    parser.add_argument("input", help="EPD or FEN file, one position per line, - for stdin")
+    parser.add_argument("--depth", type=int, help="fixed search depth (default 3), or deepest iteration with --nodes")
+    parser.add_argument("--nodes", type=int, help="node budget per position instead of a fixed depth")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--eval-cache", type=int, default=65536, help="evaluation cache slots per worker")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    depth = args.depth if args.depth is not None else (None if args.nodes else 3)
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        run(source, out, depth=depth, node_limit=args.nodes, processes=args.processes,
+            eval_cache_size=args.eval_cache)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Headless benchmark of the chess AI. Loads a fixed suite of positions (the genetic algorithm's training
+# boards plus standard middlegame and endgame positions) and reports evaluate and getThreat throughput,
+# and fixed-depth minimax nodes/sec and time-to-depth, as JSON so runs can be compared.
+#
+# usage: python3 chessAIBenchmark.py [--depth 2] [--repeat 3] [--output bench.json]
+
+import argparse
+import json
+import platform
+import time
+
+from chessAI import ChessBoard, ChessPiece, Threat, opponent_AI, side_to_move, np
+from chessAIGeneticAlgo import TRAINING_BOARDS
+
+STANDARD_POSITIONS = [
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1"),
+    ("italian", "r1bq1rk1/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQ1RK1 w - - 0 1"),
+    ("queens_gambit", "rnbqkb1r/ppp2ppp/4pn2/3p2B1/2PP4/2N5/PP2PPPP/R2QKBNR b - - 0 1"),
+    ("sicilian", "r1bqkb1r/pp2pppp/2np1n2/8/3NP3/2N5/PPP2PPP/R1BQKB1R w - - 0 1"),
+    ("rook_endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("philidor", "3k4/R7/3K4/3P4/8/8/8/7r w - - 0 1"),
+    ("kpk", "8/8/8/8/8/4k3/4P3/4K3 w - - 0 1"),
+    ("krk", "8/8/8/4k3/8/8/8/4K2R w - - 0 1"),
+]
+
+
+def load_suite():
+    """
+    :return: list of (name, color to move, board, pieces)
+    """
+    fens = []
+    for number in sorted(TRAINING_BOARDS):
+        # The training boards are graded with black to move
+        placement = ChessBoard(None, 50, squares=TRAINING_BOARDS[number]).placement_fen()
+        fens.append(("board%d" % number, placement + " b - - 0 1"))
+    fens.extend(STANDARD_POSITIONS)
+
+    suite = []
+    for name, fen in fens:
+        pieces = ChessPiece.from_fen(fen)
+        suite.append((name, side_to_move(pieces), pieces.board, pieces))
+    return suite
+
+
+def rate(calls, seconds):
+    return {"calls": calls, "seconds": seconds, "per_second": calls / seconds if seconds else None}
+
+
+def bench_evaluate(suite, repeat, vals):
+    ai = opponent_AI(None, None, eval_cache_size=0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, _, board, pieces in suite:
+            ai.evaluate(board, pieces, vals=vals)
+    return rate(repeat * len(suite), time.perf_counter() - start)
+
+
+def bench_threat(suite, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, _, board, pieces in suite:
+            Threat(board, pieces).getThreat()
+    return rate(repeat * len(suite), time.perf_counter() - start)
+
+
+def bench_minimax(suite, depth, vals):
+    """
+    Iterative deepening from depth 1 to depth on each position with a fresh AI.
+    """
+    results = []
+    total_nodes = 0
+    total_seconds = 0.0
+    for name, color, board, pieces in suite:
+        ai = opponent_AI(None, None)
+        value, move, stats = ai.search(board, pieces, color, depth=1, max_depth=depth, vals=vals)
+        iterations = []
+        time_to_depth = 0.0
+        for iteration in stats.iterations:
+            time_to_depth += iteration["seconds"]
+            iterations.append(dict(iteration, time_to_depth=time_to_depth,
+                                   nodes_per_second=iteration["nodes"] / iteration["seconds"]
+                                   if iteration["seconds"] else None))
+        stats.iterations = iterations
+        total_nodes += stats.nodes
+        total_seconds += time_to_depth
+        results.append(dict(stats.as_dict(), name=name, color=color))
+    return {"depth": depth, "nodes": total_nodes, "seconds": total_seconds,
+            "nodes_per_second": total_nodes / total_seconds if total_seconds else None,
+            "positions": results}
+
+
+def run(depth=2, repeat=3, vals=None):
+    """
+    Runs the whole benchmark and returns the report as a dict.
+    """
+    if vals is None:
+        vals = opponent_AI.TUNED_VALS
+    suite = load_suite()
+    return {
+        "python": platform.python_version(),
+        "numpy": np is not None,
+        "positions": len(suite),
+        "repeat": repeat,
+        "evaluate": bench_evaluate(suite, repeat, vals),
+        "getThreat": bench_threat(suite, repeat),
+        "minimax": bench_minimax(suite, depth, vals),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless chess AI benchmark")
+    parser.add_argument("--depth", type=int, default=2, help="deepest fixed-depth minimax search")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the suite for throughput numbers")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(depth=args.depth, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
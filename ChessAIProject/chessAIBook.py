@@ -0,0 +1,230 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Opening book. build_book turns a PGN corpus into a binary book file, and OpeningBook memory-maps the file
+# and binary searches it for the current position, so book moves cost no search time.
+#
+# The file has the Polyglot layout: 16 byte big-endian entries (key, move, weight, learn) sorted by key,
+# with moves encoded the Polyglot way (castling as the king taking its rook). The keys are this program's
+# position_hash, not Polyglot's Zobrist keys, so books built by other tools will not find our positions.
+#
+# usage: python3 chessAIBook.py games.pgn [more.pgn ...] --output book.bin [--plies 20] [--processes 4]
+
+import argparse
+import collections
+import mmap
+import multiprocessing
+import os
+import struct
+from random import Random
+
+from chessAI import ChessPiece, position_hash
+from chessAIPGN import PGNGame, read_games
+
+ENTRY = struct.Struct(">QHHI")
+
+# Polyglot promotion piece numbers
+PROMOTION_CODES = {"n": 1, "b": 2, "r": 3, "q": 4}
+PROMOTION_LETTERS = {code: letter for letter, code in PROMOTION_CODES.items()}
+
+# Book weights per game result for the side that played the move, Polyglot style: 2 for a win, 1 for a draw
+RESULT_WEIGHTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+def encode_move(board_state, move, promotion=None):
+    """
+    Polyglot move number of a ((fromRow, fromCol), (toRow, toCol)) move on board_state.
+    """
+    (from_row, from_col), (to_row, to_col) = move
+    piece = board_state.squares[from_row][from_col]
+    if piece in (ChessPiece.W_KING, ChessPiece.B_KING) and from_col == 4 and abs(to_col - from_col) == 2:
+        to_col = 7 if to_col == 6 else 0
+    code = to_col | (7 - to_row) << 3 | from_col << 6 | (7 - from_row) << 9
+    if promotion is not None:
+        code |= PROMOTION_CODES[ChessPiece.GLYPH_TO_FEN[promotion].lower()] << 12
+    return code
+
+
+def decode_move(board_state, code):
+    """
+    :return: (move, promotion) for a Polyglot move number, the promotion as the piece the pawn becomes or None
+    """
+    to_col, to_row = code & 7, 7 - (code >> 3 & 7)
+    from_col, from_row = code >> 6 & 7, 7 - (code >> 9 & 7)
+    piece = board_state.squares[from_row][from_col]
+    if piece in (ChessPiece.W_KING, ChessPiece.B_KING) and from_col == 4 and to_col in (0, 7) and \
+            to_row == from_row:
+        to_col = 6 if to_col == 7 else 2
+    promotion = None
+    if code >> 12 & 7:
+        letter = PROMOTION_LETTERS[code >> 12 & 7]
+        promotion = ChessPiece.FEN_TO_GLYPH[letter.upper() if piece == ChessPiece.W_PAWN else letter]
+    return ((from_row, from_col), (to_row, to_col)), promotion
+
+
+def book_moves(game, plies):
+    """
+    Book entries of the first plies moves of a game.
+    :param game: (starting FEN, SAN moves, result)
+    :return: list of (key, move, weight)
+    """
+    fen, sans, result = game
+    if result not in RESULT_WEIGHTS:
+        return []
+    weights = RESULT_WEIGHTS[result]
+    entries = []
+    replay = PGNGame({"FEN": fen}, sans[:plies], result).replay()
+    for pieces, move, promotion in replay:
+        weight = weights[0] if pieces.piece_color(pieces.board.squares[move[0][0]][move[0][1]]) == "white" \
+            else weights[1]
+        entries.append((position_hash(pieces.board, pieces), encode_move(pieces.board, move, promotion), weight))
+    return entries
+
+
+def _book_batch(args):
+    """
+    :return: Counters of games played and weight for each (key, move) of a batch of games
+    """
+    games, plies = args
+    played = collections.Counter()
+    weights = collections.Counter()
+    for game in games:
+        for key, move, weight in book_moves(game, plies):
+            played[key, move] += 1
+            weights[key, move] += weight
+    return played, weights
+
+
+def _batches(paths, batch_size):
+    batch = []
+    for path in paths:
+        for game in read_games(path):
+            batch.append((game.fen, game.sans, game.result))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def build_book(paths, output, plies=20, processes=None, min_games=1, batch_size=200):
+    """
+    Builds a book file from PGN files. Games are replayed in batches on a process pool, with a bounded
+    number of batches in flight so the corpus is never all in memory.
+    :param plies: moves from the start of each game that go in the book
+    :param min_games: leaves out moves played in fewer games
+    :return: number of entries written
+    """
+    played = collections.Counter()
+    weights = collections.Counter()
+
+    def add(counts):
+        played.update(counts[0])
+        weights.update(counts[1])
+
+    processes = processes or os.cpu_count() or 1
+    with multiprocessing.Pool(processes) as pool:
+        window = collections.deque()
+        for batch in _batches(paths, batch_size):
+            window.append(pool.apply_async(_book_batch, ((batch, plies),)))
+            if len(window) >= 2 * processes:
+                add(window.popleft().get())
+        while window:
+            add(window.popleft().get())
+
+    entries = sorted((key, move, weights[key, move]) for (key, move), games in played.items() if games >= min_games)
+    # Weights are 16 bits, scale them down to fit keeping their proportions. Moves that only lost keep
+    # weight 1 so there is still a book move for the losing side.
+    scale = max([weight for _, _, weight in entries] + [0xffff]) / 0xffff
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as f:
+        for key, move, weight in entries:
+            f.write(ENTRY.pack(key, move, max(1, int(weight / scale)), 0))
+    os.replace(tmp, output)
+    return len(entries)
+
+
+class OpeningBook:
+    """
+    Read-only book file, memory-mapped and binary searched by position_hash.
+    """
+
+    def __init__(self, path, seed=None):
+        """
+        :param seed: seed for picking among book moves by weight, None always picks the heaviest move
+        """
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.size = size // ENTRY.size
+        self.random = Random(seed) if seed is not None else None
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _key(self, index):
+        return ENTRY.unpack_from(self.map, index * ENTRY.size)[0]
+
+    def entries(self, key):
+        """
+        :return: list of (Polyglot move, weight) for a position key
+        """
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.size:
+            entry_key, move, weight, _ = ENTRY.unpack_from(self.map, low * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((move, weight))
+            low += 1
+        return found
+
+    def probe(self, board_state, pieces):
+        """
+        Book move for the position, picked by weight.
+        :return: (move, promotion) or None if the position is not in the book
+        """
+        found = [(code, weight) for code, weight in self.entries(position_hash(board_state, pieces)) if weight]
+        if not found:
+            return None
+        if self.random is None:
+            code = max(found, key=lambda entry: entry[1])[0]
+        else:
+            pick = self.random.randrange(sum(weight for _, weight in found))
+            for code, weight in found:
+                pick -= weight
+                if pick < 0:
+                    break
+        return decode_move(board_state, code)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN files")
+    parser.add_argument("pgn", nargs="+", help="PGN files of games")
+    parser.add_argument("--output", default="book.bin", help="book file to write")
+    parser.add_argument("--plies", type=int, default=20, help="moves from the start of each game to keep")
+    parser.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    count = build_book(args.pgn, args.output, plies=args.plies, processes=args.processes,
+                       min_games=args.min_games)
+    print("%d book entries written to %s" % (count, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,28 @@
 # Author: Rajesh Sakhamuru, Rohan Subramaniam
 # Version: 12/13/2019
 
+import csv
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import statistics
+import sys
+import time
+from collections import OrderedDict
 from copy import deepcopy
 from math import sqrt
 from random import randint
 from random import random
+from random import getstate
+from random import seed as seed_random
+from random import setstate
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for grading whole populations at once
+    np = None
 
 # based on https://repl.it/@f9we/chess
 
@@ -348,8 +366,6 @@ class ChessPiece:
         Args:
             chess_board: Object of ChessBoard.
         """
-        import turtle
-
         self.board = chess_board
 
         # move history
@@ -365,10 +381,16 @@ class ChessPiece:
         # set to True if just testing validity
         self.testing = testing
 
-        # Take user input for pawn promotion
-        self.window = turtle.Screen()
-        self.update = turtle.update
-        self.user_input = Input(self.board, self, self.window, self.update)
+        # Take user input for pawn promotion. A headless board has no window to take it from.
+        if chess_board.pen is None:
+            self.window = None
+            self.update = None
+            self.user_input = None
+        else:
+            import turtle
+            self.window = turtle.Screen()
+            self.update = turtle.update
+            self.user_input = Input(self.board, self, self.window, self.update)
 
     def deep_copy(self, testing=False):
         board_copy = self.board.deep_copy()
@@ -1665,6 +1687,534 @@ class opponent_AI:
 
         return round(h)
 
+    def features(self, board_state, pieces):
+        """
+        evaluate as a linear function of the heuristic weights: evaluate(board_state, pieces, Vals=hVals) is
+        round(constant + sum(f * v for f, v in zip(features, hVals))). The constant holds the kings and
+        king threats, which have fixed values.
+        :return: (constant, features), with features None if the game is over and the constant its value
+        """
+        board_threat = Threat(board_state, pieces)
+        board_threat.getThreat()
+        whiteKing = None
+        blackKing = None
+
+        gameOver = board_threat.is_game_over()
+        if gameOver == 1:
+            return -1000000, None
+        elif gameOver == 2:
+            return 1000000, None
+        elif gameOver == 3:
+            return 0, None
+
+        constant = 0
+        f = [0] * FEATURE_COUNT
+        material = {ChessPiece.B_PAWN: (0, 1), ChessPiece.B_KNIGHT: (1, 1), ChessPiece.B_BISHOP: (2, 1),
+                    ChessPiece.B_ROOK: (3, 1), ChessPiece.B_QUEEN: (4, 1), ChessPiece.W_PAWN: (5, -1),
+                    ChessPiece.W_KNIGHT: (6, -1), ChessPiece.W_BISHOP: (7, -1), ChessPiece.W_ROOK: (8, -1),
+                    ChessPiece.W_QUEEN: (9, -1)}
+        for row in range(8):
+            for col in range(8):
+                piece = board_state.squares[row][col]
+                if piece in material:
+                    f[material[piece][0]] += material[piece][1]
+                elif piece == ChessPiece.B_KING:
+                    blackKing = (row, col)
+                    constant += 100000
+                elif piece == ChessPiece.W_KING:
+                    whiteKing = (row, col)
+                    constant -= 100000
+
+        if whiteKing is not None and blackKing is not None:
+            for row in range(8):
+                for col in range(8):
+                    distWK = sqrt(((row - whiteKing[0]) ** 2) + ((col - whiteKing[1]) ** 2))
+                    distBK = sqrt(((row - blackKing[0]) ** 2) + ((col - blackKing[1]) ** 2))
+                    if (row, col) in board_threat.blackThreat.keys():
+                        f[10] += board_threat.blackThreat[(row, col)]
+                        f[11] += distWK
+                    if (row, col) in board_threat.whiteThreat.keys():
+                        f[12] -= board_threat.whiteThreat[(row, col)]
+                        f[13] -= distBK
+
+        # Threatened pieces, by the index of their weight. Threats on the queen count five times.
+        blackTargets = {ChessPiece.B_PAWN: 14, ChessPiece.B_KNIGHT: 15, ChessPiece.B_BISHOP: 16,
+                        ChessPiece.B_ROOK: 17, ChessPiece.B_QUEEN: 18, ChessPiece.W_PAWN: 19,
+                        ChessPiece.W_KNIGHT: 20, ChessPiece.W_BISHOP: 21, ChessPiece.W_ROOK: 22}
+        for move, threat in board_threat.blackThreat.items():
+            piece = board_state.squares[move[0]][move[1]]
+            if piece in blackTargets:
+                f[blackTargets[piece]] += threat
+            elif piece == ChessPiece.W_QUEEN:
+                f[23] += threat * 5
+            elif piece == ChessPiece.W_KING:
+                constant += 100000
+            if move[0] == 4:
+                f[24] += threat
+            if move[0] == 3:
+                f[25] += threat
+            if move[0] == 2 or move[0] == 5:
+                f[26] += threat
+            if move[1] == 3 or move[1] == 4:
+                f[27] += threat
+            if move[1] == 2 or move[1] == 5:
+                f[28] += threat
+
+        whiteTargets = {ChessPiece.W_PAWN: 29, ChessPiece.W_KNIGHT: 30, ChessPiece.W_BISHOP: 31,
+                        ChessPiece.W_ROOK: 32, ChessPiece.W_QUEEN: 33, ChessPiece.B_PAWN: 34,
+                        ChessPiece.B_KNIGHT: 35, ChessPiece.B_BISHOP: 36, ChessPiece.B_ROOK: 37}
+        for move, threat in board_threat.whiteThreat.items():
+            piece = board_state.squares[move[0]][move[1]]
+            if piece in whiteTargets:
+                f[whiteTargets[piece]] -= threat
+            elif piece == ChessPiece.B_QUEEN:
+                f[38] -= threat * 5
+            elif piece == ChessPiece.B_KING:
+                constant -= 100000
+            if move[0] == 3:
+                f[39] -= threat
+            if move[0] == 4:
+                f[40] -= threat
+            if move[0] == 2 or move[0] == 5:
+                f[41] -= threat
+            if move[1] == 3 or move[1] == 4:
+                f[42] -= threat
+            if move[1] == 2 or move[1] == 5:
+                f[43] -= threat
+
+        return constant, f
+
+
+def linear_score(features, hVals):
+    """
+    opponent_AI.evaluate of a position from its opponent_AI.features.
+    """
+    constant, f = features
+    if f is None:
+        return constant
+    return round(constant + sum(x * v for x, v in zip(f, hVals)))
+
+
+# Heuristic weights evaluate uses. Weight vectors are longer, the rest of each vector is unused.
+FEATURE_COUNT = 44
+
+
+################################################################################
+# Training positions graded by Input.fitness. Board numbers 8 and 14 are unused.
+TRAINING_BOARDS = {
+    # tie/ 0 score
+    1: [['♜', '♞', '♝', '♛', '♚', '♝', '♞', '♜'],
+        ['♟', '♟', '♟', '♟', '♟', '♟', '♟', '♟'],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        ['♙', '♙', '♙', '♙', '♙', '♙', '♙', '♙'],
+        ['♖', '♘', '♗', '♕', '♔', '♗', '♘', '♖']],
+
+    # mild white advantage
+    2: [['♜', '♞', '♝', '♛', '♚', '♝', '♞', '♜'],
+        ['♟', '♟', '♟', '♟', '♟', '♟', '♟', '♟'],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, '♙', None, None, None],
+        [None, None, None, None, None, None, None, None],
+        ['♙', '♙', '♙', '♙', None, '♙', '♙', '♙'],
+        ['♖', '♘', '♗', '♕', '♔', '♗', '♘', '♖']],
+
+    # white advantage
+    3: [[None, None, None, None, None, '♜', '♚', None],
+        [None, None, None, None, None, '♟', '♟', '♟'],
+        [None, None, '♟', None, '♟', None, None, None],
+        [None, '♟', '♙', None, None, None, None, None],
+        [None, '♙', None, None, None, None, None, None],
+        [None, None, None, None, None, '♘', None, '♙'],
+        [None, None, None, None, '♗', '♙', '♙', None],
+        [None, None, None, None, None, None, '♔', None]],
+    # black advantage
+    4: [[None, None, None, '♜', None, None, '♚', None],
+        [None, None, '♜', None, None, '♟', None, None],
+        [None, None, None, None, '♟', None, '♟', None],
+        [None, '♟', None, None, '♙', None, None, '♟'],
+        [None, '♙', None, '♙', None, None, None, None],
+        [None, None, None, None, None, None, None, '♙'],
+        [None, None, None, None, None, '♙', '♙', None],
+        [None, None, None, None, '♕', None, '♔', None]],
+
+    # white advantage
+    5: [[None, None, None, None, None, None, '♚', None],
+        ['♟', None, None, None, '♙', None, None, '♟'],
+        [None, '♟', None, None, None, '♕', None, None],
+        [None, None, None, '♟', None, None, None, '♔'],
+        [None, None, '♟', '♙', None, None, '♙', None],
+        [None, '♞', '♙', None, None, None, None, None],
+        [None, None, None, None, None, None, None, '♙'],
+        [None, None, None, None, '♛', None, None, None]],
+
+    # strong black advantage
+    6: [[None, '♛', None, None, None, '♗', '♚', None],
+        [None, None, None, None, None, '♟', None, '♟'],
+        [None, None, '♟', None, None, None, '♟', None],
+        [None, '♟', None, '♝', None, None, None, None],
+        [None, None, None, None, '♞', None, None, None],
+        [None, None, None, None, None, '♘', None, '♙'],
+        ['♜', None, None, None, None, None, '♙', '♔'],
+        [None, None, None, None, None, None, None, None]],
+
+    # even game
+    7: [['♜', None, '♝', '♛', '♚', '♝', None, '♜'],
+        ['♟', '♟', '♟', None, None, '♟', '♟', '♟'],
+        [None, None, '♞', '♟', None, '♞', None, None],
+        [None, None, None, None, '♟', None, None, None],
+        [None, None, None, None, '♙', None, None, None],
+        [None, None, '♘', '♙', None, '♘', None, None],
+        ['♙', '♙', '♙', None, None, '♙', '♙', '♙'],
+        ['♖', None, '♗', '♕', '♔', '♗', None, '♖']],
+
+    # B Queen
+    9: [[None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, '♚', '♟'],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, '♛', None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        [None, None, None, None, None, None, None, None],
+        [None, '♔', '♙', None, None, None, None, None],
+        [None, None, None, None, None, None, None, None]],
+
+    # B Rook
+    10: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♜', None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # B Bishop
+    11: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♝' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # B Knight
+    12: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♞' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+    # B Pawn
+    13: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♟' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # W Queen
+    15: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♕', None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # W Rook
+    16: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♖', None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # W Bishop
+    17: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♗' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+
+    # W Knight
+    18: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♘' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+    # W Pawn
+    19: [[None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, '♚', '♟'],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, '♙' , None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, None, None, None, None, None, None, None],
+         [None, '♔', '♙', None, None, None, None, None],
+         [None, None, None, None, None, None, None, None]],
+}
+
+
+################################################################################
+# Score bands of Input.fitness for the boards that should score near 0: (bound, fitness added for a score
+# outside -bound..bound)
+NEUTRAL_BANDS = [(24000, 3), (12000, 3), (6000, 2), (5000, 2), (4000, 2), (3000, 2), (2000, 1), (1000, 1),
+                 (500, 1), (400, 1), (300, 1), (250, 1), (200, 1)]
+
+
+class PopulationFitness:
+    """
+    Input.fitness of a whole population at once with numpy. The training boards' scores are one matrix
+    product of their features with the population's weights, and each of fitness's conditions is one
+    comparison across the population. Gives the same fitness as Input.fitness.
+    """
+    # Features whose coefficients are not integers (king distances), the rest are multiplied exactly
+    FLOAT_FEATURES = [11, 13]
+
+    def __init__(self, training_features, chunk_size=65536):
+        """
+        :param training_features: opponent_AI.features of each training board, see Input.training_features
+        :param chunk_size: individuals scored per matrix product, bounding memory for large populations
+        """
+        self.numbers = sorted(training_features)
+        self.constants = np.array([training_features[n][0] for n in self.numbers], dtype=np.int64)
+        # Boards where the game is over score their constant whatever the weights
+        self.over = np.array([training_features[n][1] is None for n in self.numbers])
+        features = np.array([training_features[n][1] if training_features[n][1] is not None else [0] * FEATURE_COUNT
+                             for n in self.numbers], dtype=np.float64)
+        self.float_features = features[:, self.FLOAT_FEATURES]
+        integer = features.copy()
+        integer[:, self.FLOAT_FEATURES] = 0
+        self.int_features = integer.astype(np.int64)
+        self.chunk_size = chunk_size
+
+    def scores(self, weights):
+        """
+        :param weights: individuals x weights integer matrix
+        :return: training boards x individuals matrix of evaluate scores
+        """
+        weights = np.asarray(weights, dtype=np.int64)[:, :FEATURE_COUNT]
+        exact = self.constants[:, None] + self.int_features @ weights.T
+        fractional = self.float_features @ weights[:, self.FLOAT_FEATURES].T.astype(np.float64)
+        scores = np.rint(exact + fractional).astype(np.int64)
+        scores[self.over] = self.constants[self.over, None]
+        return scores
+
+    def __call__(self, population):
+        """
+        :return: numpy array of the fitness of each individual of population, in order
+        """
+        weights = np.asarray(population, dtype=np.int64)
+        return np.concatenate([self._fitness(weights[i:i + self.chunk_size])
+                               for i in range(0, len(weights), self.chunk_size)] or [np.zeros(0, np.int64)])
+
+    def _fitness(self, weights):
+        score = dict(zip(self.numbers, self.scores(weights)))
+        fitness = np.zeros(len(weights), dtype=np.int64)
+
+        def add(condition, amount=1):
+            fitness[condition] += amount
+
+        for bound, amount in NEUTRAL_BANDS:
+            add(~((-bound < score[1]) & (score[1] < bound)), amount)
+        add(score[2] > score[1])
+        add(score[3] > -200)
+        add(score[4] < 300)
+        add(score[5] > -200)
+        add(score[3] > score[2])
+        add(score[5] > score[2])
+        add(score[6] < 500)
+        add(score[6] < score[4])
+        for bound, amount in NEUTRAL_BANDS:
+            add(~((-bound < score[7]) & (score[7] < bound)), amount)
+
+        def descending(*boards):
+            result = np.ones(len(weights), dtype=bool)
+            for higher, lower in zip(boards, boards[1:]):
+                result &= higher > lower
+            return result
+
+        zero = np.zeros(len(weights), dtype=np.int64)
+        add(~descending(score[9], score[10], score[11], score[13], zero))
+        add(~descending(score[9], score[10], score[12], score[13], zero))
+        add(~descending(zero, score[19], score[18], score[16], score[15]))
+        add(~descending(zero, score[19], score[17], score[16], score[15]))
+        add(~descending(score[16], score[18] + score[17], score[15]))
+        add(~descending(score[9], score[11] + score[12], score[10]))
+        return fitness
+
+
+################################################################################
+class FitnessCache:
+    """
+    Fitness of weight vectors already graded, keyed by the weights as a tuple. Holds up to size vectors,
+    dropping the least recently used one when full.
+
+    Attributes:
+        hits: lookups that found the weights.
+        misses: lookups that did not.
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.grades = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hVals):
+        """
+        :return: the fitness of hVals, None if it has not been graded
+        """
+        key = tuple(hVals)
+        grade = self.grades.get(key)
+        if grade is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.grades.move_to_end(key)
+        return grade
+
+    def put(self, hVals, grade):
+        key = tuple(hVals)
+        self.grades[key] = grade
+        self.grades.move_to_end(key)
+        if len(self.grades) > self.size:
+            self.grades.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+################################################################################
+# Bumped when the checkpoint contents change, older checkpoints are refused
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, state):
+    """
+    Writes a tuning checkpoint atomically: to a temporary file first, then renamed over path, so a crash
+    while writing leaves the last checkpoint whole.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(dict(state, version=CHECKPOINT_VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """
+    :return: the state saved by save_checkpoint
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("%s is not a version %d checkpoint" % (path, CHECKPOINT_VERSION))
+    return state
+
+
+################################################################################
+# Grader of each fitness worker process, see init_worker
+_grader = None
+
+
+def headless_input(processes=1, seed=None, verbose=False, training_set=None):
+    """
+    Input on a board with no window, for grading and evolving populations without the GUI.
+    :param training_set: chessAIPositions.TrainingSet to grade on instead of the training boards
+    """
+    board = ChessBoard(None, Chess.SQUARE_SIZE)
+    grader = Input(board, ChessPiece(board), None, None, processes=processes, seed=seed, verbose=verbose)
+    grader.training_set = training_set
+    return grader
+
+
+################################################################################
+class MetricsWriter:
+    """
+    Writes one record of metrics per generation of Input.tune, as JSON lines or CSV.
+    """
+    FIELDS = ["generation", "best", "mean", "median", "diversity", "unique", "cache_hit_rate", "evaluations",
+              "evaluations_per_second", "seconds", "elapsed", "retain", "random_select", "mutate"]
+
+    def __init__(self, path, format=None):
+        """
+        :param format: "jsonl" or "csv", by default csv if path ends in .csv and jsonl otherwise
+        """
+        self.format = format or ("csv" if path.endswith(".csv") else "jsonl")
+        if self.format not in ("jsonl", "csv"):
+            raise ValueError("Unknown metrics format %r" % self.format)
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.csv = None
+        if self.format == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=self.FIELDS)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv is not None:
+            self.csv.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def diversity(population):
+    """
+    Spread of a population: the standard deviation of each weight across the population, averaged over
+    the weights, and the fraction of individuals that are distinct.
+    """
+    if np is not None:
+        matrix = np.asarray(population)
+        spread = float(matrix.std(axis=0).mean())
+        unique = len(np.unique(matrix, axis=0)) / len(matrix)
+    else:
+        spread = statistics.mean(statistics.pstdev(weights) for weights in zip(*population))
+        unique = len(set(tuple(hVals) for hVals in population)) / len(population)
+    return spread, unique
+
+
+def init_worker(seed):
+    """
+    Sets up a fitness worker process: a headless grader, and the random module seeded from seed and the
+    worker's number so runs with the same seed draw the same numbers.
+    """
+    global _grader
+    _grader = headless_input()
+    if seed is not None:
+        identity = multiprocessing.current_process()._identity
+        seed_random(seed * 1000 + (identity[-1] if identity else 0))
+
+
+def worker_fitness(hVals):
+    return _grader.fitness(hVals)
+
 
 ################################################################################
 class Input:
@@ -1678,20 +2228,29 @@ class Input:
         selected_row: row of selected piece.
         selected_col: col of selected piece.
         turn_color: color of player taking current turn.
+        processes: worker processes grading each generation, 1 grades in this process.
+        seed: seed of the fitness workers' random numbers, None for unseeded.
+        fitness_cache: FitnessCache of the weights graded so far.
+        evaluations: weight vectors graded so far (not counting the ones found in the cache).
+        verbose: print the fitness of every individual graded, and a line per generation.
+        training_set: chessAIPositions.TrainingSet graded on instead of the training boards, None for the boards.
         
     """
 
-    def __init__(self, chess_board, pieces, window, update):
+    def __init__(self, chess_board, pieces, window, update, processes=None, seed=None, cache_size=100000,
+                 verbose=True):
         """Inits and setup keyboard input handlers.
         
         Args:
             chess_board: Object of ChessBoard
             pieces: Object of CheckPiece
-            window: Turtle screen.
+            window: Turtle screen, or None for no GUI.
             update: Refers to update().
+            processes: Worker processes for fitness, default one per CPU.
+            seed: Seed for the fitness workers.
+            cache_size: Weight vectors whose fitness is remembered.
+            verbose: Print every grade and a line per generation.
         """
-        import turtle
-
         self.board = chess_board
         self.pieces = pieces
         self.update = update
@@ -1699,8 +2258,63 @@ class Input:
         self.selected_row = -1
         self.selected_col = -1
         self.turn_color = "white"
-        self.window = turtle.Screen()
-        window.onclick(self.findHeuristic)
+        self.processes = processes or os.cpu_count() or 1
+        self.seed = seed
+        self.pool = None
+        self.fitness_cache = FitnessCache(cache_size)
+        self.evaluations = 0
+        self.verbose = verbose
+        self._training_features = None
+        self._population_fitness = None
+        self.training_set = None
+        if window is None:
+            self.window = None
+        else:
+            import turtle
+            self.window = turtle.Screen()
+            window.onclick(self.findHeuristic)
+
+    def close(self):
+        """
+        Shuts down the fitness workers.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def grade(self, population):
+        """
+        Fitness of each member of population, in population order. Members already in the fitness cache
+        are not graded again, the others are graded once each: all together with PopulationFitness when
+        numpy is available, otherwise on a process pool when there is more than one process.
+        """
+        grades = [self.fitness_cache.get(hVals) for hVals in population]
+        # Each distinct ungraded vector, crossing over often makes the same child more than once
+        ungraded = list(OrderedDict.fromkeys(tuple(hVals) for hVals, grade in zip(population, grades)
+                                             if grade is None))
+        if not ungraded:
+            return grades
+
+        if np is not None:
+            newGrades = self.population_fitness()(ungraded).tolist()
+        elif self.processes == 1:
+            newGrades = [self.fitness(list(hVals)) for hVals in ungraded]
+        else:
+            if self.pool is None:
+                # Spawned rather than forked, so the workers do not inherit the GUI's Tk state
+                context = multiprocessing.get_context("spawn")
+                self.pool = context.Pool(self.processes, initializer=init_worker, initargs=(self.seed,))
+            chunksize = max(1, len(ungraded) // (4 * self.processes))
+            newGrades = self.pool.map(worker_fitness, [list(hVals) for hVals in ungraded], chunksize)
+
+        self.evaluations += len(ungraded)
+        for hVals, grade in zip(ungraded, newGrades):
+            self.fitness_cache.put(hVals, grade)
+            # For troubleshooting
+            if self.verbose:
+                print(grade, ": ", list(hVals))
+        graded = dict(zip(ungraded, newGrades))
+        return [graded[tuple(hVals)] if grade is None else grade for hVals, grade in zip(population, grades)]
 
     def newList(self):
         """
@@ -1726,6 +2340,33 @@ class Input:
             popSize -= 1
         return popList
 
+    def training_features(self):
+        """
+        opponent_AI.features of each training board, worked out on the first call. Grading a weight vector
+        then takes a dot product per board instead of a full evaluate.
+        """
+        if self._training_features is None:
+            board_state = self.board.deep_copy()
+            pieces_state = self.pieces.deep_copy()
+            ai = opponent_AI(self.board, self.pieces)
+            self._training_features = {}
+            for number, squares in TRAINING_BOARDS.items():
+                board_state.squares = squares
+                self._training_features[number] = ai.features(board_state, pieces_state)
+        return self._training_features
+
+    def population_fitness(self):
+        """
+        PopulationFitness of the training boards, or the training set's DatasetFitness, made on the first
+        call. Needs numpy.
+        """
+        if self._population_fitness is None:
+            if self.training_set is not None:
+                self._population_fitness = self.training_set.fitness()
+            else:
+                self._population_fitness = PopulationFitness(self.training_features())
+        return self._population_fitness
+
     def fitness(self, hVals):
         """
         Evaluates how good the list of heuristic weights is at evaluating board states. 
@@ -1733,183 +2374,15 @@ class Input:
         met the 'fitness' counter is incremented accordingly.
         
         """
+        if self.training_set is not None:
+            return int(self.population_fitness()([hVals])[0])
+
         fitness = 0
 
-        board_state = self.board.deep_copy()
-        pieces_state = self.pieces.deep_copy()
-
-        ai = opponent_AI(self.board, self.pieces)
-
-        # tie/ 0 score
-        board1 = [['♜', '♞', '♝', '♛', '♚', '♝', '♞', '♜'],
-                ['♟', '♟', '♟', '♟', '♟', '♟', '♟', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                ['♙', '♙', '♙', '♙', '♙', '♙', '♙', '♙'],
-                ['♖', '♘', '♗', '♕', '♔', '♗', '♘', '♖']]
-
-        # mild white advantage
-        board2 = [['♜', '♞', '♝', '♛', '♚', '♝', '♞', '♜'],
-                ['♟', '♟', '♟', '♟', '♟', '♟', '♟', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, '♙', None, None, None],
-                [None, None, None, None, None, None, None, None],
-                ['♙', '♙', '♙', '♙', None, '♙', '♙', '♙'],
-                ['♖', '♘', '♗', '♕', '♔', '♗', '♘', '♖']]
-
-        # white advantage
-        board3 = [[None, None, None, None, None, '♜', '♚', None],
-                [None, None, None, None, None, '♟', '♟', '♟'],
-                [None, None, '♟', None, '♟', None, None, None],
-                [None, '♟', '♙', None, None, None, None, None],
-                [None, '♙', None, None, None, None, None, None],
-                [None, None, None, None, None, '♘', None, '♙'],
-                [None, None, None, None, '♗', '♙', '♙', None],
-                [None, None, None, None, None, None, '♔', None]]
-        # black advantage
-        board4 = [[None, None, None, '♜', None, None, '♚', None],
-                [None, None, '♜', None, None, '♟', None, None],
-                [None, None, None, None, '♟', None, '♟', None],
-                [None, '♟', None, None, '♙', None, None, '♟'],
-                [None, '♙', None, '♙', None, None, None, None],
-                [None, None, None, None, None, None, None, '♙'],
-                [None, None, None, None, None, '♙', '♙', None],
-                [None, None, None, None, '♕', None, '♔', None]]
-
-        # white advantage
-        board5 = [[None, None, None, None, None, None, '♚', None],
-                ['♟', None, None, None, '♙', None, None, '♟'],
-                [None, '♟', None, None, None, '♕', None, None],
-                [None, None, None, '♟', None, None, None, '♔'],
-                [None, None, '♟', '♙', None, None, '♙', None],
-                [None, '♞', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, '♙'],
-                [None, None, None, None, '♛', None, None, None]]
-
-        # strong black advantage
-        board6 = [[None, '♛', None, None, None, '♗', '♚', None],
-                [None, None, None, None, None, '♟', None, '♟'],
-                [None, None, '♟', None, None, None, '♟', None],
-                [None, '♟', None, '♝', None, None, None, None],
-                [None, None, None, None, '♞', None, None, None],
-                [None, None, None, None, None, '♘', None, '♙'],
-                ['♜', None, None, None, None, None, '♙', '♔'],
-                [None, None, None, None, None, None, None, None]]
-
-        # even game
-        board7 = [['♜', None, '♝', '♛', '♚', '♝', None, '♜'],
-                ['♟', '♟', '♟', None, None, '♟', '♟', '♟'],
-                [None, None, '♞', '♟', None, '♞', None, None],
-                [None, None, None, None, '♟', None, None, None],
-                [None, None, None, None, '♙', None, None, None],
-                [None, None, '♘', '♙', None, '♘', None, None],
-                ['♙', '♙', '♙', None, None, '♙', '♙', '♙'],
-                ['♖', None, '♗', '♕', '♔', '♗', None, '♖']]
-
-        # B Queen
-        board9 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♛', None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # B Rook
-        board10 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♜', None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # B Bishop
-        board11 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♝' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # B Knight
-        board12 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♞' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-        # B Pawn
-        board13 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♟' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # W Queen
-        board15 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♕', None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # W Rook
-        board16 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♖', None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # W Bishop
-        board17 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♗' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        # W Knight
-        board18 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♘' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-        # W Pawn
-        board19 = [[None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, '♚', '♟'],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, '♙' , None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, None, None, None, None, None, None, None],
-                [None, '♔', '♙', None, None, None, None, None],
-                [None, None, None, None, None, None, None, None]]
-
-        board_state.squares = board1
-
-        score1 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        # Each training board's evaluate score, as a dot product of its features with the weights
+        scores = {number: linear_score(features, hVals) for number, features in self.training_features().items()}
+
+        score1 = scores[1]
 
         # encourages heuristic to evaluate black and white pieces equivalently and opposite to each other
         if not (-24000 < score1 < 24000):
@@ -1964,30 +2437,22 @@ class Input:
 #         if not (-50 < score1 < 50):
 #             fitness += 1
 
-        board_state.squares = board2
-
-        score2 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score2 = scores[2]
 
         if score2 > score1:
             fitness += 1
 
-        board_state.squares = board3
-
-        score3 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score3 = scores[3]
 
         if score3 > -200:
             fitness += 1
 
-        board_state.squares = board4
-
-        score4 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score4 = scores[4]
 
         if score4 < 300:
             fitness += 1
 
-        board_state.squares = board5
-
-        score5 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score5 = scores[5]
 
         if score5 > -200:
             fitness += 1
@@ -1998,9 +2463,7 @@ class Input:
         if score5 > score2:
             fitness += 1
 
-        board_state.squares = board6
-
-        score6 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score6 = scores[6]
 
         if score6 < 500:
             fitness += 1
@@ -2008,9 +2471,7 @@ class Input:
         if score6 < score4:
             fitness += 1
 
-        board_state.squares = board7
-
-        score7 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score7 = scores[7]
 
         # encourages heuristic to evaluate black and white pieces equivalently and opposite to each other
         if not (-24000 < score7 < 24000):
@@ -2064,16 +2525,11 @@ class Input:
 #         if not (-50 < score7 < 50):
 #             fitness += 1
 
-        board_state.squares = board9
-        score9 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board10
-        score10 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board11
-        score11 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board12
-        score12 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board13
-        score13 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score9 = scores[9]
+        score10 = scores[10]
+        score11 = scores[11]
+        score12 = scores[12]
+        score13 = scores[13]
 
         # Optimizes Black piece values relative to board impact
         if not (score9 > score10 > score11 > score13 > 0):
@@ -2081,16 +2537,11 @@ class Input:
         if not (score9 > score10 > score12 > score13 > 0):
             fitness += 1
 
-        board_state.squares = board15
-        score15 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board16
-        score16 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board17
-        score17 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board18
-        score18 = ai.evaluate(board_state, pieces_state, Vals=hVals)
-        board_state.squares = board19
-        score19 = ai.evaluate(board_state, pieces_state, Vals=hVals)
+        score15 = scores[15]
+        score16 = scores[16]
+        score17 = scores[17]
+        score18 = scores[18]
+        score19 = scores[19]
 
         # Optimizes White piece values relative to board impact
         if not (0 > score19 > score18 > score16 > score15):
@@ -2105,9 +2556,6 @@ class Input:
         if not ((score9) > (score11 + score12) > score10):
             fitness += 1
 
-        # For troubleshooting
-        print(fitness, ": ", hVals)
-
         return fitness
 
     def evolve(self, popList, retain, random_select, mutate):
@@ -2116,13 +2564,11 @@ class Input:
         best fitness (lowest value). Random mutation and random selection of some 
         members of the population prevent getting stuck at local maxima.
         """
-        popGrades = []
         parents = []
         # deep copy of population List
         population = list(popList)
 
-        for p in population:
-            popGrades.append(self.fitness(p))
+        popGrades = self.grade(population)
 
         parentPopSize = round(len(popList) * retain)
 
@@ -2176,37 +2622,169 @@ class Input:
 
         return children
 
-    def findHeuristic(self, _, __):
+    def evolve_array(self, population, retain, random_select, mutate, rng, selection="truncation",
+                     crossover="one-point", tournament=3, grades=None):
         """
-        Finds optimized heuristic weights for chess AI minimax heuristic
+        evolve on a numpy integer matrix of individuals x weights, with every operator applied to the whole
+        population at once, so large populations stay cheap.
+
+        Args:
+            population: Individuals x weights matrix.
+            retain, random_select, mutate: As for evolve.
+            rng: numpy random Generator.
+            selection: "truncation" keeps the fittest retain fraction as evolve does, "tournament" picks
+                each of them as the fittest of tournament random individuals.
+            crossover: "one-point" takes each child's weights up to a random point from one parent and the
+                rest from the other as evolve does, "uniform" picks each weight from either parent.
+            tournament: Individuals per tournament.
+            grades: Fitness of each individual if already known, otherwise they are graded.
+
+        Returns:
+            The next generation's matrix: the children, then the parents.
         """
-        popSize = 100
-        retain = 0.25
-        random_select = 0.1
-        mutate = 0.1
+        size, length = population.shape
+        if grades is None:
+            grades = self.population_fitness()(population)
+            self.evaluations += size
+        grades = np.asarray(grades)
+        parentPopSize = round(size * retain)
+
+        if selection == "truncation":
+            # A stable sort keeps the first of equally fit individuals first, as evolve's scan does
+            order = np.argsort(grades, kind="stable")
+            chosen = order[:parentPopSize]
+            rest = order[parentPopSize:]
+        elif selection == "tournament":
+            entrants = rng.integers(0, size, size=(parentPopSize, tournament))
+            chosen = entrants[np.arange(parentPopSize), np.argmin(grades[entrants], axis=1)]
+            rest = np.setdiff1d(np.arange(size), chosen)
+        else:
+            raise ValueError("Unknown selection %r" % selection)
+        # Random others become parents too
+        chosen = np.concatenate([chosen, rest[rng.random(len(rest)) < random_select]])
+        parents = population[chosen]
+
+        # Random mutations: one weight of each mutating parent replaced
+        mutants = np.flatnonzero(rng.random(len(parents)) < mutate)
+        parents[mutants, rng.integers(0, length, size=len(mutants))] = rng.integers(1, 1501, size=len(mutants))
+
+        # Crossing over between pairs of different parents
+        count = max(0, size - len(parents))
+        first = rng.integers(0, len(parents), size=count)
+        if len(parents) > 1:
+            second = (first + rng.integers(1, len(parents), size=count)) % len(parents)
+        else:
+            second = first
+        if crossover == "one-point":
+            fromFirst = np.arange(length)[None, :] < rng.integers(0, length + 1, size=count)[:, None]
+        elif crossover == "uniform":
+            fromFirst = rng.random((count, length)) < 0.5
+        else:
+            raise ValueError("Unknown crossover %r" % crossover)
+        children = np.where(fromFirst, parents[first], parents[second])
 
-        popList = self.populationList(popSize)
+        return np.concatenate([children, parents])
 
-        solved = False
-        count = 0
-        while not solved:
+    def tune(self, popSize=100, retain=0.25, random_select=0.1, mutate=0.1, generations=None, seed=None,
+             checkpoint=None, checkpoint_every=1, resume=False, operators="list", selection="truncation",
+             crossover="one-point", metrics=None):
+        """
+        Evolves a population of heuristic weights until one has fitness 0, or one has fitness 10 or less
+        after 50 generations, or the generation cap is reached.
+
+        With a checkpoint file, the run's state (population, fitness cache, the drifting mutate and
+        random_select, generation count and random state) is saved to it between generations. A resumed
+        run carries on from there exactly as if it had not stopped.
+
+        Args:
+            popSize: Individuals in the population.
+            retain: Fraction of the population kept as parents each generation.
+            random_select: Chance of each other individual becoming a parent too.
+            mutate: Chance of each parent having one weight replaced.
+            generations: Most generations to evolve, None for no limit.
+            seed: Seed of the random numbers, None for unseeded.
+            checkpoint: File to save the run's state to, None for no checkpoints.
+            checkpoint_every: Generations between checkpoints.
+            resume: Carry on from the checkpoint file if there is one. popSize, retain, random_select,
+                mutate and seed then come from the checkpoint, and operators must be the ones it was
+                written with.
+            operators: "list" evolves lists of weights with evolve, "array" a numpy matrix with evolve_array.
+            selection, crossover: Operators of evolve_array.
+            metrics: MetricsWriter to write each generation's metrics to, or None.
+
+        Returns:
+            (weights, fitness, generations evolved) of the fittest individual of the last generation.
+        """
+        if operators == "array":
+            rng = np.random.default_rng(seed)
+        if resume and checkpoint is not None and os.path.exists(checkpoint):
+            state = load_checkpoint(checkpoint)
+            # Checkpoints from before the operators were saved hold a numpy random state only for "array"
+            saved = state.get("operators", "array" if "numpy_random_state" in state else "list")
+            if saved != operators:
+                raise ValueError("%s was written with %s operators, it cannot be resumed with %s operators"
+                                 % (checkpoint, saved, operators))
+            popList = state["population"]
+            retain = state["retain"]
+            random_select = state["random_select"]
+            mutate = state["mutate"]
+            count = state["generation"]
+            # Put back least recently used first, keeping the cache's order and its size limit
+            for hVals, grade in state["fitness_cache"].items():
+                self.fitness_cache.put(hVals, grade)
+            setstate(state["random_state"])
+            if operators == "array":
+                rng.bit_generator.state = state["numpy_random_state"]
+        else:
+            if seed is not None:
+                seed_random(seed)
+            if operators == "array":
+                popList = rng.integers(1, 1501, size=(popSize, 52))
+            else:
+                popList = self.populationList(popSize)
+            count = 0
+
+        start = time.time()
+        grades = None
+        while True:
+            generationStart = time.time()
+            evaluations = self.evaluations
+            hits, misses = self.fitness_cache.hits, self.fitness_cache.misses
             # evolves current
-            popList = (self.evolve(popList, retain, random_select, mutate))
-#             print(popList)  # for troubleshooting
-            for i in popList:
-                if (self.fitness(i) == 0):
-                    print("solution: ", i)
-                    solved = True
-                    break
-                # if plateus at a local minima, then end after 50 generations
-                if count >= 50:
-                    if (self.fitness(i) <= 10):
-                        print("solution: ", i)
-                        solved = True
-                        break
-            if solved is True:
+            if operators == "array":
+                # The last generation's grades are passed on rather than worked out again
+                popList = self.evolve_array(popList, retain, random_select, mutate, rng, selection=selection,
+                                            crossover=crossover, grades=grades)
+                grades = self.population_fitness()(popList).tolist()
+                self.evaluations += len(popList)
+                best = int(np.argmin(grades))
+            else:
+                popList = (self.evolve(popList, retain, random_select, mutate))
+                grades = self.grade(popList)
+                best = min(range(len(popList)), key=lambda i: grades[i])
+
+            if metrics is not None:
+                seconds = time.time() - generationStart
+                lookups = self.fitness_cache.hits - hits + self.fitness_cache.misses - misses
+                spread, unique = diversity(popList)
+                metrics.write({"generation": count + 1, "best": grades[best], "mean": statistics.mean(grades),
+                               "median": statistics.median(grades), "diversity": spread, "unique": unique,
+                               "cache_hit_rate": (self.fitness_cache.hits - hits) / lookups if lookups else 0.0,
+                               "evaluations": self.evaluations - evaluations,
+                               "evaluations_per_second": (self.evaluations - evaluations) / seconds if seconds else 0.0,
+                               "seconds": seconds, "elapsed": time.time() - start, "retain": retain,
+                               "random_select": random_select, "mutate": mutate})
+
+            if grades[best] == 0:
+                break
+            # if plateus at a local minima, then end after 50 generations
+            if count >= 50 and grades[best] <= 10:
+                break
+            if generations is not None and count + 1 >= generations:
                 break
-            print("-----------------")
+            if self.verbose:
+                print("-----------------")
+                print("fitness cache: %d hits, %d misses" % (self.fitness_cache.hits, self.fitness_cache.misses))
 
             # will modify mutation, random_select and retain values to help leave a
             # local minima. More randomness the longer it takes up to specific points
@@ -2217,11 +2795,173 @@ class Input:
                     random_select += 0.01
             count += 1
 
+            if checkpoint is not None and count % checkpoint_every == 0:
+                state = {"population": popList, "retain": retain, "random_select": random_select, "mutate": mutate,
+                         "generation": count, "fitness_cache": self.fitness_cache.grades, "random_state": getstate(),
+                         "operators": operators}
+                if operators == "array":
+                    state["numpy_random_state"] = rng.bit_generator.state
+                save_checkpoint(checkpoint, state)
+
+        return [int(v) for v in popList[best]], grades[best], count + 1
+
+    def findHeuristic(self, _, __):
+        """
+        Finds optimized heuristic weights for chess AI minimax heuristic
+        """
+        weights, _, _ = self.tune()
+        print("solution: ", weights)
+
+        self.close()
         return exit(0)
 
 
+################################################################################
+# Island model: separate populations evolving in their own processes, trading their best individuals
+TOPOLOGIES = ["ring", "bi-ring", "full"]
+
+
+def migration_targets(topology, islands):
+    """
+    :return: for each island, the islands it sends its migrants to
+    """
+    if islands == 1:
+        return [[]]
+    if topology == "ring":
+        return [[(i + 1) % islands] for i in range(islands)]
+    if topology == "bi-ring":
+        return [sorted({(i + 1) % islands, (i - 1) % islands}) for i in range(islands)]
+    if topology == "full":
+        return [[j for j in range(islands) if j != i] for i in range(islands)]
+    raise ValueError("Unknown topology %r, expected one of %s" % (topology, ", ".join(TOPOLOGIES)))
+
+
+def run_island(island, inboxes, targets, results, flags, barrier, popSize, retain, random_select, mutate, generations,
+               seed, interval, migrants, verbose=False, positions=None, cache_dir=None):
+    """
+    Evolves one island's population, as Input.tune does, in its own process. Every interval generations the
+    islands meet at a barrier: each posts whether it has met the stopping rule since the last meeting, and if
+    any has they all stop there. Otherwise each sends copies of its best migrants individuals to its target
+    islands and replaces its worst individuals with the ones it receives, waiting for the migrants of every
+    island sending to it. The islands stop at the same generation whatever their pace, so a seeded run gives
+    the same result every time.
+    """
+    # Islands report their progress on stderr, stdout is left to the process that started them
+    sys.stdout = sys.stderr
+    training_set = None
+    if positions is not None:
+        # Imported here, chessAIPositions imports this module. island_tune has already cached the features
+        from chessAIPositions import load_training_set
+        training_set = load_training_set(positions, cache_dir=cache_dir, processes=1)
+    grader = headless_input(processes=1, verbose=verbose, training_set=training_set)
+    if seed is not None:
+        seed_random(seed * 1000 + island)
+    sources = sum(island in t for t in targets)
+    pending = {}  # Migrants that arrived early, by generation
+    popList = grader.populationList(popSize)
+    solved = False
+    count = 0
+    while True:
+        popList = grader.evolve(popList, retain, random_select, mutate)
+        grades = grader.grade(popList)
+        order = sorted(range(len(popList)), key=lambda i: grades[i])
+        best = order[0]
+
+        if grades[best] == 0 or (count >= 50 and grades[best] <= 10):
+            solved = True
+        if generations is not None and count + 1 >= generations:
+            break
+
+        if (count + 1) % interval == 0:
+            flags[island] = solved
+            barrier.wait()
+            stop = any(flags[:])
+            # Nobody posts the next meeting's flags before everyone has read these
+            barrier.wait()
+            if stop:
+                break
+
+            if sources:
+                for target in targets[island]:
+                    inboxes[target].put((count, island, [list(popList[i]) for i in order[:migrants]]))
+                # Migrants of this generation from every source, in source order
+                arrived = pending.pop(count, [])
+                while len(arrived) < sources:
+                    message = inboxes[island].get()
+                    if message[0] == count:
+                        arrived.append(message)
+                    else:
+                        pending.setdefault(message[0], []).append(message)
+                immigrants = [hVals for _, _, individuals in sorted(arrived, key=lambda m: m[1])
+                              for hVals in individuals]
+                # The worst individuals make way for the immigrants
+                for i, hVals in zip(reversed(order), immigrants[:len(order) - 1]):
+                    popList[i] = hVals
+
+        # Same drift of the operator rates as Input.tune
+        if count % 3 == 0:
+            if mutate < 0.2:
+                mutate += 0.01
+            if random_select < 0.3:
+                random_select += 0.01
+        count += 1
+
+    results.put((island, list(popList[best]), grades[best], count + 1))
+    # Migrants nobody will read must not keep this process from exiting
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+
+def island_tune(islands=None, popSize=100, retain=0.25, random_select=0.1, mutate=0.1, generations=None, seed=None,
+                topology="ring", interval=5, migrants=2, verbose=False, positions=None, cache_dir=None):
+    """
+    Tunes the heuristic weights with an island model: islands populations of popSize, one per process
+    (default one per CPU), trading migrants individuals every interval generations along topology. The
+    stopping rule is checked when the islands meet to migrate, so a solution stops the run at the next
+    meeting.
+    :param positions: training positions file to grade on instead of the training boards, see chessAIPositions
+    :param cache_dir: feature cache directory of the positions file
+    :return: (weights, fitness, generations evolved, island) of the fittest individual found
+    """
+    islands = islands or os.cpu_count() or 1
+    if positions is not None:
+        # Features are extracted once here, the islands load them from the cache
+        from chessAIPositions import load_training_set
+        load_training_set(positions, cache_dir=cache_dir)
+    targets = migration_targets(topology, islands)
+    context = multiprocessing.get_context("spawn")
+    inboxes = [context.Queue() for _ in range(islands)]
+    results = context.Queue()
+    flags = context.Array("b", islands, lock=False)
+    barrier = context.Barrier(islands)
+    processes = [context.Process(target=run_island,
+                                 args=(i, inboxes, targets, results, flags, barrier, popSize, retain, random_select,
+                                       mutate, generations, seed, interval, migrants, verbose, positions, cache_dir))
+                 for i in range(islands)]
+    for process in processes:
+        process.start()
+    try:
+        finished = []
+        while len(finished) < islands:
+            try:
+                finished.append(results.get(timeout=1))
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    # Islands waiting at the barrier for the failed one give up
+                    barrier.abort()
+                    raise RuntimeError("An island process failed")
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+    island, weights, fitness, evolved = min(finished, key=lambda result: (result[2], result[0]))
+    return weights, fitness, evolved, island
+
+
 ################################################################################
 # Run the Game.
 # print "\x1b[30m \x1b[0m"
-chess = Chess()
-chess.run()
+if __name__ == "__main__":
+    chess = Chess()
+    chess.run()
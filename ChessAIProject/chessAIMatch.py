@@ -0,0 +1,412 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Headless engine-vs-engine matches. Two engines, which can differ in their weights or be chessAI.py files
+# from different checkouts, play each opening of a suite twice with colors swapped, on a pool of worker
+# processes. The report gives the Elo difference of engine A over engine B with a 95% error bar, stops
+# early once an SPRT between two Elo hypotheses is decided, and records nodes/sec and depth reached per
+# game so speed and strength can be judged together.
+#
+# usage: python3 chessAIMatch.py [--games 100] [--tc 10+0.1 | --movetime 1 | --depth 3] [--b-vals default]
+#                                [--b-engine ../old/chessAI.py] [--sprt 0 10] [--output report.json]
+#
+# An engine file must come from a checkout recent enough to have opponent_AI.search, the headless search
+# the match plays with. Older chessAI.py files are refused before they are imported, as importing them
+# starts the game's window.
+
+import argparse
+import ast
+import collections
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from chessAI import ChessPiece, Threat, opponent_AI, position_hash, side_to_move
+from chessAIAnalyze import parse_position
+from chessAIBenchmark import STANDARD_POSITIONS
+
+# Games longer than this are drawn
+MAX_PLIES = 300
+# Moves left in the game assumed when sharing out the clock
+MOVES_TO_GO = 30
+
+# Engine modules loaded in each worker, by chessAI.py path
+_modules = {}
+
+
+def check_engine(path):
+    """
+    Checks that a chessAI.py file's opponent_AI has a search method, by reading the file without importing it.
+    :raises ValueError: if it has none
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "opponent_AI":
+            if any(isinstance(n, ast.FunctionDef) and n.name == "search" for n in node.body):
+                return
+    raise ValueError("%s has no opponent_AI.search, engines must come from a checkout with the headless search"
+                     % path)
+
+
+def load_engine(path):
+    """
+    opponent_AI class of a chessAI.py file, None for this one.
+    """
+    if path is None:
+        return opponent_AI
+    path = os.path.abspath(path)
+    if path not in _modules:
+        check_engine(path)
+        spec = importlib.util.spec_from_file_location("chessAI_%d" % len(_modules), path)
+        module = importlib.util.module_from_spec(spec)
+        sys.path.insert(0, os.path.dirname(path))
+        try:
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.pop(0)
+        _modules[path] = module
+    return _modules[path].opponent_AI
+
+
+def parse_vals(text):
+    """
+    Engine weights from "tuned", "default", a JSON list or a JSON file holding one.
+    """
+    if text in (None, "tuned"):
+        return opponent_AI.TUNED_VALS
+    if text == "default":
+        return opponent_AI.DEFAULT_VALS
+    if os.path.exists(text):
+        with open(text) as f:
+            return json.load(f)
+    return json.loads(text)
+
+
+def parse_tc(text):
+    """
+    (base seconds, increment seconds) of a "base+increment" time control.
+    """
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+
+def _play(pieces, move):
+    """
+    Plays an engine move the way Input.onclick does, promoting pawns to queens.
+    """
+    (from_row, from_col), (to_row, to_col) = move
+    board = pieces.board
+    board.move_piece(from_row, from_col, to_row, to_col)
+    if to_row == 0 and board.squares[to_row][to_col] == ChessPiece.W_PAWN:
+        board.squares[to_row][to_col] = ChessPiece.W_QUEEN
+    elif to_row == 7 and board.squares[to_row][to_col] == ChessPiece.B_PAWN:
+        board.squares[to_row][to_col] = ChessPiece.B_QUEEN
+    pieces.moveHistory.append((board.squares[to_row][to_col], from_row, from_col, to_row, to_col))
+
+
+def _adjudicate(pieces, seen):
+    """
+    :return: (result, reason) once the game is over, otherwise None
+    """
+    squares = pieces.board.squares
+    kings = [piece for row in squares for piece in row if piece in (ChessPiece.W_KING, ChessPiece.B_KING)]
+    if ChessPiece.W_KING not in kings:
+        return "0-1", "king captured"
+    if ChessPiece.B_KING not in kings:
+        return "1-0", "king captured"
+    threat = Threat(pieces.board, pieces)
+    threat.getThreat()
+    over = threat.is_game_over()
+    if over == 1:
+        return "1-0", "checkmate"
+    if over == 2:
+        return "0-1", "checkmate"
+    if over == 3:
+        return "1/2-1/2", "stalemate or insufficient material"
+    if seen[position_hash(pieces.board, pieces)] >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if len(pieces.moveHistory) - pieces.history_start >= MAX_PLIES:
+        return "1/2-1/2", "move limit"
+    return None
+
+
+def play_game(job):
+    """
+    Plays one game.
+    :param job: dict with the game number, opening FEN, and per color engine path, weights, time control
+                (base, increment), movetime and depth
+    :return: dict with the result, reason, moves and each engine's nodes, time and depths
+    """
+    pieces = ChessPiece.from_fen(job["fen"])
+    engines = {color: load_engine(job[color]["engine"])(None, None) for color in ("white", "black")}
+    clocks = {color: job[color]["tc"][0] if job[color]["tc"] else None for color in ("white", "black")}
+    stats = {color: {"nodes": 0, "seconds": 0.0, "moves": 0, "depths": []} for color in ("white", "black")}
+    seen = collections.Counter([position_hash(pieces.board, pieces)])
+
+    outcome = _adjudicate(pieces, seen)
+    while outcome is None:
+        color = side_to_move(pieces)
+        spec = job[color]
+        if spec["movetime"] is not None:
+            budget = spec["movetime"]
+        elif spec["tc"] is not None:
+            budget = min(clocks[color] / MOVES_TO_GO + spec["tc"][1] * 3 / 4, clocks[color] / 2)
+        else:
+            budget = None
+        max_depth = spec["depth"] or 64
+
+        start = time.time()
+        value, move, search_stats = engines[color].search(
+            pieces.board, pieces, color, depth=1, max_depth=max_depth, vals=spec["vals"],
+            timeout=start + budget if budget is not None else None)
+        elapsed = time.time() - start
+
+        stats[color]["nodes"] += search_stats.nodes
+        stats[color]["seconds"] += elapsed
+        stats[color]["moves"] += 1
+        stats[color]["depths"].append(search_stats.iterations[-1]["depth"] if search_stats.iterations else 0)
+        if clocks[color] is not None:
+            clocks[color] += spec["tc"][1] - elapsed
+            if clocks[color] < 0:
+                outcome = ("0-1" if color == "white" else "1-0"), "time forfeit"
+                break
+        if move is None:
+            outcome = "1/2-1/2", "no move found"
+            break
+
+        _play(pieces, move)
+        seen[position_hash(pieces.board, pieces)] += 1
+        outcome = _adjudicate(pieces, seen)
+
+    for color in ("white", "black"):
+        s = stats[color]
+        s["nps"] = s["nodes"] / s["seconds"] if s["seconds"] else None
+        s["average_depth"] = sum(s["depths"]) / len(s["depths"]) if s["depths"] else 0
+        s["max_depth"] = max(s["depths"], default=0)
+    return {"game": job["game"], "fen": job["fen"], "a_color": job["a_color"], "result": outcome[0],
+            "reason": outcome[1], "moves": pieces.moveHistory[pieces.history_start:],
+            "plies": len(pieces.moveHistory) - pieces.history_start, "white": stats["white"],
+            "black": stats["black"]}
+
+
+def elo(score):
+    """
+    Elo difference for an expected score.
+    """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo_difference):
+    return 1 / (1 + 10 ** (-elo_difference / 400))
+
+
+def match_statistics(wins, draws, losses, elo0=0.0, elo1=10.0, alpha=0.05, beta=0.05):
+    """
+    Elo estimate with its 95% interval and the SPRT log-likelihood ratio (normal approximation of the
+    generalized SPRT) for H0: elo = elo0 against H1: elo = elo1, from A's point of view.
+    """
+    games = wins + draws + losses
+    result = {"games": games, "wins": wins, "draws": draws, "losses": losses,
+              "sprt": {"elo0": elo0, "elo1": elo1, "alpha": alpha, "beta": beta,
+                       "lower_bound": math.log(beta / (1 - alpha)), "upper_bound": math.log((1 - beta) / alpha),
+                       "llr": 0.0, "decision": None}}
+    if not games:
+        return result
+
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    result.update({"score": score, "elo": elo(score),
+                   "elo_error": (elo(min(score + margin, 1)) - elo(max(score - margin, 0))) / 2})
+
+    if variance > 0:
+        s0, s1 = expected_score(elo0), expected_score(elo1)
+        llr = games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+        sprt = result["sprt"]
+        sprt["llr"] = llr
+        if llr >= sprt["upper_bound"]:
+            sprt["decision"] = "H1"
+        elif llr <= sprt["lower_bound"]:
+            sprt["decision"] = "H0"
+    return result
+
+
+def load_openings(path=None):
+    """
+    Opening FENs from an EPD or FEN file, or the benchmark's standard positions.
+    """
+    if path is None:
+        return [ChessPiece.START_FEN] + [fen for _, fen in STANDARD_POSITIONS]
+    openings = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                openings.append(parse_position(line)[0])
+    return openings
+
+
+def jobs(openings, games, a, b):
+    """
+    Each opening is played twice, A with white and then with black.
+    """
+    for game in range(games):
+        fen = openings[(game // 2) % len(openings)]
+        a_color = "white" if game % 2 == 0 else "black"
+        yield {"game": game + 1, "fen": fen, "a_color": a_color,
+               "white": a if a_color == "white" else b, "black": b if a_color == "white" else a}
+
+
+def write_pgn(pgn, game, tags):
+    """
+    Writes a played game to a PGNWriter. A game with a move the writer cannot replay is written up to that
+    move with the unknown result "*", rather than stopping the match.
+    """
+    from chessAIPGN import PGNWriter
+    moves, result = game["moves"], game["result"]
+    # Replayed into a buffer first, so a game that fails part way is not left half written in the file
+    check = PGNWriter(io.StringIO())
+    check.begin_game(tags, game["fen"])
+    for i, move in enumerate(moves):
+        try:
+            check.write_move(move)
+        except ValueError as e:
+            print("game %d: move %d cannot be written as PGN (%s), the game is cut off there"
+                  % (game["game"], i + 1, e), file=sys.stderr)
+            moves, result = moves[:i], "*"
+            break
+    pgn.write_game(moves, tags=dict(tags, Result=result), fen=game["fen"], result=result)
+
+
+def run_match(a, b, openings, games=100, processes=None, sprt=(0.0, 10.0), alpha=0.05, beta=0.05,
+              log=None, pgn=None):
+    """
+    Plays the match, stopping early if the SPRT is decided.
+    :param a, b: engine specs, dicts of engine path, vals, tc, movetime and depth
+    :param log: called with each game's result and the running statistics
+    :param pgn: chessAIPGN.PGNWriter to write the games to
+    :return: the report
+    """
+    counts = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    wins = draws = losses = 0
+    speed = {"a": {"nodes": 0, "seconds": 0.0, "depths": []}, "b": {"nodes": 0, "seconds": 0.0, "depths": []}}
+    results = []
+    statistics = match_statistics(0, 0, 0, sprt[0], sprt[1], alpha, beta)
+    processes = processes or os.cpu_count() or 1
+
+    with multiprocessing.Pool(processes) as pool:
+        window = collections.deque()
+        pending = jobs(openings, games, a, b)
+        for job in pending:
+            window.append(pool.apply_async(play_game, (job,)))
+            if len(window) >= processes:
+                break
+        while window:
+            game = window.popleft().get()
+            results.append(game)
+            counts[game["result"]] += 1
+            a_white = game["a_color"] == "white"
+            if game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == a_white:
+                wins += 1
+            else:
+                losses += 1
+            for engine, color in (("a", game["a_color"]), ("b", "black" if a_white else "white")):
+                speed[engine]["nodes"] += game[color]["nodes"]
+                speed[engine]["seconds"] += game[color]["seconds"]
+                speed[engine]["depths"].extend(game[color]["depths"])
+
+            statistics = match_statistics(wins, draws, losses, sprt[0], sprt[1], alpha, beta)
+            if pgn is not None:
+                white, black = ("A", "B") if a_white else ("B", "A")
+                write_pgn(pgn, game, {"Event": "chessAI match", "Round": game["game"], "White": white,
+                                      "Black": black, "Result": game["result"], "Termination": game["reason"]})
+            if log is not None:
+                log(game, statistics)
+            if statistics["sprt"]["decision"] is not None:
+                pool.terminate()
+                break
+            job = next(pending, None)
+            if job is not None:
+                window.append(pool.apply_async(play_game, (job,)))
+
+    for engine in speed.values():
+        engine["nps"] = engine["nodes"] / engine["seconds"] if engine["seconds"] else None
+        engine["average_depth"] = sum(engine["depths"]) / len(engine["depths"]) if engine["depths"] else 0
+        del engine["depths"]
+    for game in results:
+        del game["moves"]
+    return dict(statistics, results=counts, speed=speed, games_played=results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Engine-vs-engine match with Elo and SPRT statistics")
+    parser.add_argument("--games", type=int, default=100, help="most games to play")
+    parser.add_argument("--openings", help="EPD or FEN file of opening positions (default: built-in suite)")
+    parser.add_argument("--tc", help="time control per game, base+increment in seconds (default 10+0.1)")
+    parser.add_argument("--movetime", type=float, help="seconds per move instead of a time control")
+    parser.add_argument("--depth", type=int, help="deepest search, alone it gives fixed-depth games")
+    for engine in ("a", "b"):
+        parser.add_argument("--%s-engine" % engine, help="chessAI.py of engine %s (default: this one)"
+                            % engine.upper())
+        parser.add_argument("--%s-vals" % engine, help='weights of engine %s: "tuned" (default), "default", '
+                                                       'a JSON list or a JSON file' % engine.upper())
+    parser.add_argument("--sprt", type=float, nargs=2, default=[0.0, 10.0], metavar=("ELO0", "ELO1"),
+                        help="SPRT hypotheses, A is not stronger (ELO0) or is ELO1 stronger")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--processes", type=int, help="games played at once (default: one per CPU)")
+    parser.add_argument("--pgn", help="append the games to this PGN file")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # A depth alone gives fixed-depth games, otherwise the time control applies
+    if args.movetime is not None or (args.depth and args.tc is None):
+        tc = None
+    else:
+        tc = parse_tc(args.tc or "10+0.1")
+    specs = {}
+    for engine in ("a", "b"):
+        path = getattr(args, engine + "_engine")
+        if path is not None:
+            try:
+                check_engine(path)
+            except (OSError, SyntaxError, ValueError) as e:
+                parser.error("--%s-engine: %s" % (engine, e))
+        specs[engine] = {"engine": path, "vals": parse_vals(getattr(args, engine + "_vals")),
+                         "tc": tc, "movetime": args.movetime, "depth": args.depth}
+
+    def log(game, statistics):
+        print("game %d (A %s): %s by %s, %d plies | +%d =%d -%d, Elo %+.1f +/- %.1f, LLR %.2f" %
+              (game["game"], game["a_color"], game["result"], game["reason"], game["plies"],
+               statistics["wins"], statistics["draws"], statistics["losses"], statistics.get("elo", 0.0),
+               statistics.get("elo_error", 0.0), statistics["sprt"]["llr"]), file=sys.stderr)
+
+    pgn = None
+    if args.pgn:
+        from chessAIPGN import PGNWriter
+        pgn = PGNWriter(open(args.pgn, "a", encoding="utf-8"))
+    try:
+        report = run_match(specs["a"], specs["b"], load_openings(args.openings), games=args.games,
+                           processes=args.processes, sprt=args.sprt, alpha=args.alpha, beta=args.beta, log=log,
+                           pgn=pgn)
+    finally:
+        if pgn is not None:
+            pgn.stream.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Streaming PGN support. PGNWriter writes a game move by move while it is played, read_games reads PGN files
+# lazily one game at a time, so archives of millions of games can be fed to the opening book, the tuners
+# and regression suites without loading them into memory.
+#
+# Moves are ChessPiece.moveHistory entries, ("piece", fromRow, fromCol, toRow, toCol), or
+# ((fromRow, fromCol), (toRow, toCol)) moves as the AI makes them.
+
+import re
+
+from chessAI import ChessPiece, Threat, side_to_move, square_name, parse_square
+
+PIECE_LETTERS = {ChessPiece.W_KING: "K", ChessPiece.W_QUEEN: "Q", ChessPiece.W_ROOK: "R",
+                 ChessPiece.W_BISHOP: "B", ChessPiece.W_KNIGHT: "N",
+                 ChessPiece.B_KING: "K", ChessPiece.B_QUEEN: "Q", ChessPiece.B_ROOK: "R",
+                 ChessPiece.B_BISHOP: "B", ChessPiece.B_KNIGHT: "N"}
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Tags every PGN game starts with, in this order
+SEVEN_TAG_ROSTER = (("Event", "?"), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"),
+                    ("White", "?"), ("Black", "?"), ("Result", "*"))
+
+SAN_PATTERN = re.compile(r"^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|[^\s(){};]+")
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+
+
+def _can_move(pieces, from_row, from_col, to_row, to_col):
+    """
+    is_move_valid without its side effects on the board and castling flags.
+    """
+    flags = (pieces.blackCanCastleQside, pieces.blackCanCastleKside,
+             pieces.whiteCanCastleQside, pieces.whiteCanCastleKside)
+    testing = pieces.testing
+    pieces.testing = True
+    try:
+        return bool(pieces.is_move_valid(from_row, from_col, to_row, to_col))
+    finally:
+        pieces.testing = testing
+        (pieces.blackCanCastleQside, pieces.blackCanCastleKside,
+         pieces.whiteCanCastleQside, pieces.whiteCanCastleKside) = flags
+
+
+def _in_check(board_state, pieces, color):
+    """
+    True if color's king is attacked on board_state.
+    """
+    king = ChessPiece.W_KING if color == "white" else ChessPiece.B_KING
+    threat = Threat(board_state, pieces)
+    threat.getThreat()
+    attacks = threat.blackThreat if color == "white" else threat.whiteThreat
+    for row in range(8):
+        for col in range(8):
+            if board_state.squares[row][col] == king:
+                return (row, col) in attacks
+    return False
+
+
+def _after(board_state, move):
+    """
+    Copy of board_state with only the moving piece moved, enough to test for check.
+    """
+    (from_row, from_col), (to_row, to_col) = move
+    board = board_state.deep_copy()
+    board.squares[to_row][to_col] = board.squares[from_row][from_col]
+    board.squares[from_row][from_col] = None
+    return board
+
+
+def _legal(pieces, move):
+    color = pieces.piece_color(pieces.board.squares[move[0][0]][move[0][1]])
+    return not _in_check(_after(pieces.board, move), pieces, color)
+
+
+def _origins(pieces, piece, to_row, to_col):
+    """
+    Squares holding piece that can legally move to (to_row, to_col).
+    """
+    origins = []
+    for row in range(8):
+        for col in range(8):
+            if pieces.board.squares[row][col] == piece and _can_move(pieces, row, col, to_row, to_col):
+                origins.append((row, col))
+    if len(origins) > 1:
+        # A pinned piece does not count, PGN leaves it out of the disambiguation
+        origins = [o for o in origins if _legal(pieces, (o, (to_row, to_col)))]
+    return origins
+
+
+def san(pieces, move, promotion=None):
+    """
+    Standard algebraic notation of a move in the position of pieces, before it is played.
+    :param move: ((fromRow, fromCol), (toRow, toCol))
+    :param promotion: piece a pawn promotes to, a queen if None
+    """
+    (from_row, from_col), (to_row, to_col) = move
+    squares = pieces.board.squares
+    piece = squares[from_row][from_col]
+    color = pieces.piece_color(piece)
+
+    if piece in (ChessPiece.W_KING, ChessPiece.B_KING) and abs(to_col - from_col) == 2:
+        text = "O-O" if to_col == 6 else "O-O-O"
+    elif piece in (ChessPiece.W_PAWN, ChessPiece.B_PAWN):
+        text = square_name(to_row, to_col)
+        if from_col != to_col:
+            text = "abcdefgh"[from_col] + "x" + text
+        if to_row in (0, 7):
+            text += "=" + (PIECE_LETTERS[promotion] if promotion is not None else "Q")
+    else:
+        text = PIECE_LETTERS[piece]
+        others = [o for o in _origins(pieces, piece, to_row, to_col) if o != (from_row, from_col)]
+        if others:
+            if all(col != from_col for _, col in others):
+                text += "abcdefgh"[from_col]
+            elif all(row != from_row for row, _ in others):
+                text += str(8 - from_row)
+            else:
+                text += square_name(from_row, from_col)
+        if squares[to_row][to_col] is not None:
+            text += "x"
+        text += square_name(to_row, to_col)
+
+    return text + _check_suffix(pieces, move, "black" if color == "white" else "white")
+
+
+def _check_suffix(pieces, move, opponent):
+    board = _after(pieces.board, move)
+    if not _in_check(board, pieces, opponent):
+        return ""
+    threat = Threat(board, pieces)
+    threat.getThreat()
+    for reply in (threat.whiteMoves if opponent == "white" else threat.blackMoves):
+        if not _in_check(_after(board, reply), pieces, opponent):
+            return "+"
+    return "#"
+
+
+def parse_san(pieces, text):
+    """
+    Finds the move written as text in standard algebraic notation in the position of pieces.
+    :return: (move, promotion) where promotion is the piece a pawn promotes to, or None
+    :raises ValueError: if text is not a move in this position
+    """
+    color = side_to_move(pieces)
+    text = text.rstrip("+#!?")
+    home_row = 7 if color == "white" else 0
+    if text in ("O-O", "0-0"):
+        return ((home_row, 4), (home_row, 6)), None
+    if text in ("O-O-O", "0-0-0"):
+        return ((home_row, 4), (home_row, 2)), None
+
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError("Bad SAN move %r" % text)
+    letter, from_file, from_rank, target, promotion = match.groups()
+    to_row, to_col = parse_square(target)
+
+    if letter is None:
+        piece = ChessPiece.W_PAWN if color == "white" else ChessPiece.B_PAWN
+    else:
+        piece = ChessPiece.FEN_TO_GLYPH[letter if color == "white" else letter.lower()]
+    origins = [(row, col) for row, col in _origins(pieces, piece, to_row, to_col)
+               if (from_file is None or col == ord(from_file) - ord("a")) and
+               (from_rank is None or row == 8 - int(from_rank))]
+    if len(origins) != 1:
+        raise ValueError("%s is %s in this position" % (text, "ambiguous" if origins else "not a valid move"))
+
+    if promotion is not None:
+        promotion = ChessPiece.FEN_TO_GLYPH[promotion if color == "white" else promotion.lower()]
+    return (origins[0], (to_row, to_col)), promotion
+
+
+class PGNWriter:
+    """
+    Writes games to a text stream one move at a time, flushing after every move so a game in progress is
+    already on disk. It replays the moves on its own headless board to write them in standard algebraic
+    notation.
+
+    Since the result is only known at the end, the Result tag is written from the tags given to begin_game
+    ("*" by default) and the real result is the termination marker written by end_game.
+    """
+
+    LINE_LENGTH = 79
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pieces = None
+        self.line = ""
+
+    def begin_game(self, tags=None, fen=None):
+        """
+        :param tags: dict of PGN tags, added after the seven tag roster
+        :param fen: starting position if not the standard one
+        """
+        tags = dict(tags or {})
+        if fen is not None and fen != ChessPiece.START_FEN:
+            tags.setdefault("SetUp", "1")
+            tags.setdefault("FEN", fen)
+        for name, default in SEVEN_TAG_ROSTER:
+            self._write_tag(name, tags.pop(name, default))
+        for name, value in tags.items():
+            self._write_tag(name, value)
+        self.stream.write("\n")
+        self.stream.flush()
+
+        self.pieces = ChessPiece.from_fen(fen or ChessPiece.START_FEN)
+        self.line = ""
+        if side_to_move(self.pieces) == "black":
+            self._write_token("%d..." % self._move_number())
+
+    def _write_tag(self, name, value):
+        self.stream.write('[%s "%s"]\n' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')))
+
+    def _move_number(self):
+        return 1 + (self.pieces.ply_start + len(self.pieces.moveHistory) - self.pieces.history_start) // 2
+
+    def _write_token(self, token):
+        if self.line and len(self.line) + 1 + len(token) > self.LINE_LENGTH:
+            self.stream.write("\n")
+            self.line = ""
+        if self.line:
+            self.stream.write(" ")
+            self.line += " "
+        self.stream.write(token)
+        self.line += token
+
+    def write_move(self, move):
+        """
+        Writes the next move of the game and plays it on the writer's board.
+        :param move: a moveHistory entry, or a ((fromRow, fromCol), (toRow, toCol)) move
+        """
+        if len(move) == 5:
+            piece, from_row, from_col, to_row, to_col = move
+        else:
+            piece = None
+            (from_row, from_col), (to_row, to_col) = move
+        moving = self.pieces.board.squares[from_row][from_col]
+        promotion = piece if piece is not None and piece != moving else None
+
+        if side_to_move(self.pieces) == "white":
+            self._write_token("%d." % self._move_number())
+        self._write_token(san(self.pieces, ((from_row, from_col), (to_row, to_col)), promotion))
+        self.pieces.push_move(from_row, from_col, to_row, to_col, promotion)
+        self.stream.flush()
+
+    def end_game(self, result="*"):
+        """
+        Writes the game termination marker, "1-0", "0-1", "1/2-1/2" or "*".
+        """
+        if result not in RESULTS:
+            raise ValueError("Bad PGN result %r" % result)
+        self._write_token(result)
+        self.stream.write("\n\n")
+        self.stream.flush()
+        self.pieces = None
+        self.line = ""
+
+    def write_game(self, moves, tags=None, fen=None, result="*"):
+        """
+        Writes a whole game at once.
+        """
+        self.begin_game(tags, fen)
+        for move in moves:
+            self.write_move(move)
+        self.end_game(result)
+
+
+class PGNGame:
+    """
+    One game read from a PGN file: its tags, its moves in standard algebraic notation and its result.
+    """
+
+    def __init__(self, tags, sans, result):
+        self.tags = tags
+        self.sans = sans
+        self.result = result
+
+    @property
+    def fen(self):
+        return self.tags.get("FEN", ChessPiece.START_FEN)
+
+    def replay(self):
+        """
+        Generator replaying the game on a new headless board. Yields (pieces, move, promotion) for each move
+        with pieces still in the position before the move, which is played when the generator is resumed.
+        Stops at the first move that cannot be read.
+        """
+        pieces = ChessPiece.from_fen(self.fen)
+        for text in self.sans:
+            try:
+                move, promotion = parse_san(pieces, text)
+            except ValueError:
+                return
+            yield pieces, move, promotion
+            (from_row, from_col), (to_row, to_col) = move
+            try:
+                pieces.push_move(from_row, from_col, to_row, to_col, promotion)
+            except ValueError:
+                return
+
+    def moves(self):
+        """
+        Generator of the game's moves as moveHistory entries.
+        """
+        for pieces, move, promotion in self.replay():
+            piece = promotion if promotion is not None else pieces.board.squares[move[0][0]][move[0][1]]
+            yield (piece, move[0][0], move[0][1], move[1][0], move[1][1])
+
+
+def _parse_movetext(lines):
+    """
+    :return: (SAN moves of the main line, result)
+    """
+    sans = []
+    result = "*"
+    depth = 0
+    for token in TOKEN_PATTERN.findall("\n".join(lines)):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(0, depth - 1)
+        elif depth or token[0] in "{;$":
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            token = MOVE_NUMBER_PATTERN.sub("", token)
+            if token:
+                sans.append(token)
+    return sans, result
+
+
+def read_games(source):
+    """
+    Generator of the games in a PGN file, read one at a time.
+    :param source: file name or an iterable of lines
+    """
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as f:
+            yield from read_games(f)
+        return
+
+    tags = {}
+    movetext = []
+    for line in source:
+        line = line.strip()
+        if line.startswith("%"):
+            continue
+        if line.startswith("[") or (not line and movetext):
+            if movetext:
+                # The end of a game's movetext
+                sans, result = _parse_movetext(movetext)
+                yield PGNGame(tags, sans, result)
+                tags = {}
+                movetext = []
+            match = TAG_PATTERN.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        if line:
+            movetext.append(line)
+
+    if tags or movetext:
+        sans, result = _parse_movetext(movetext)
+        yield PGNGame(tags, sans, result)
@@ -0,0 +1,335 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Training positions for the genetic algorithm tuner, read from EPD or CSV files instead of the hard-coded
+# TRAINING_BOARDS. Each position has a FEN and one or more labels:
+#
+#   score        the value evaluate should give it (black-positive, evaluate's units)
+#   result       the game result, 1-0, 0-1 or 1/2-1/2 (* for an unknown result, the same as none)
+#   group, rank  an ordering group: within a group, evaluate should score rank 1 above rank 2 above rank 3...
+#
+# EPD lines carry them as operations (ce for the score, c9 or result for the result, group and rank), and
+# CSV files as columns named fen, score, result, group and rank.
+#
+# Files are streamed, and their positions' features (opponent_AI.features) extracted in chunks on a pool of
+# worker processes. The feature matrix is cached on disk, keyed by the file's hash and FEATURE_VERSION, so
+# later tuning runs on the same file skip extraction.
+#
+# usage: python3 chessAIPositions.py positions.epd [--cache-dir .chessai-cache] [--processes 4]
+
+import argparse
+import collections
+import csv
+import hashlib
+import multiprocessing
+import os
+import shutil
+
+from chessAI import ChessPiece as FENPiece
+from chessAIAnalyze import parse_position
+from chessAIGeneticAlgo import FEATURE_COUNT, Chess, ChessBoard, ChessPiece, np, opponent_AI
+
+# Bumped whenever opponent_AI.features changes, so cached feature matrices of older versions are not used
+FEATURE_VERSION = 1
+
+DEFAULT_CACHE_DIR = ".chessai-cache"
+
+# Game results as the sign evaluate's score should have, None for an unknown result
+RESULTS = {"1-0": -1, "0-1": 1, "1/2-1/2": 0, "*": None}
+
+ARRAYS = ["constants", "features", "over", "score", "result", "group", "rank"]
+
+# Type of each array
+DTYPES = {"constants": "int64", "features": "float64", "over": "bool", "score": "float64", "result": "float64",
+          "group": "int64", "rank": "int64"}
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file's contents, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _label(fields):
+    """
+    :return: (fen, score, result, group, rank) of a position's fields, missing labels as None
+    :raises ValueError: if a label is not a number or result
+    """
+    score = fields.get("score", fields.get("ce"))
+    result = fields.get("result", fields.get("c9"))
+    group = fields.get("group")
+    rank = fields.get("rank")
+    if result not in (None, "") and result not in RESULTS:
+        raise ValueError("unknown result %r" % result)
+    return (fields["fen"], float(score) if score not in (None, "") else None,
+            RESULTS[result] if result not in (None, "") else None,
+            group if group not in (None, "") else None, int(rank) if rank not in (None, "") else None)
+
+
+def read_positions(path):
+    """
+    Yields the labeled positions of an EPD or CSV file one at a time, see _label.
+    :raises ValueError: naming the file and line of a position that cannot be read
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(f)
+            rows = ((reader.line_num, row) for row in reader)
+        else:
+            rows = ((number, line.strip()) for number, line in enumerate(f, 1))
+            rows = ((number, line) for number, line in rows if line and not line.startswith("#"))
+        for number, row in rows:
+            try:
+                if not isinstance(row, dict):
+                    fen, operations = parse_position(row)
+                    row = dict(operations, fen=fen)
+                position = _label(row)
+            except (KeyError, ValueError) as e:
+                raise ValueError("%s line %d: %s" % (path, number, e)) from e
+            yield position
+
+
+def position_features(fen):
+    """
+    opponent_AI.features of a FEN position, on the genetic algorithm's board.
+    """
+    parsed = FENPiece.from_fen(fen)
+    board = ChessBoard(None, Chess.SQUARE_SIZE, squares=[list(row) for row in parsed.board.squares])
+    pieces = ChessPiece(board, blackCanCastleQside=parsed.blackCanCastleQside,
+                        blackCanCastleKside=parsed.blackCanCastleKside,
+                        whiteCanCastleQside=parsed.whiteCanCastleQside,
+                        whiteCanCastleKside=parsed.whiteCanCastleKside)
+    pieces.moveHistory = list(parsed.moveHistory[-1:])
+    return opponent_AI(board, pieces).features(board, pieces)
+
+
+def extract(chunk):
+    """
+    Features of a chunk of positions.
+    :return: (constants, features, over) lists
+    """
+    constants, features, over = [], [], []
+    for fen in chunk:
+        constant, f = position_features(fen)
+        constants.append(constant)
+        features.append(f if f is not None else [0] * FEATURE_COUNT)
+        over.append(f is None)
+    return constants, features, over
+
+
+class TrainingSet:
+    """
+    Features and labels of a file of training positions, as numpy arrays with one row per position.
+
+    Attributes:
+        constants: evaluate's constant term of each position.
+        features: positions x FEATURE_COUNT feature matrix.
+        over: True for positions where the game is over, which score their constant whatever the weights.
+        score: target score, NaN if none.
+        result: sign the score should have by the game result (-1 white won, 1 black won, 0 draw), NaN if none.
+        group: ordering group number, -1 if none.
+        rank: rank within the ordering group.
+    """
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.constants)
+
+    def fitness(self, **kwargs):
+        return DatasetFitness(self, **kwargs)
+
+
+def count_positions(path):
+    """
+    Number of positions in a file. Counting them first sizes the arrays, and finds unreadable labels before
+    any features are extracted.
+    """
+    return sum(1 for _ in read_positions(path))
+
+
+def _allocate(count, directory=None):
+    """
+    Arrays of a TrainingSet of count positions, .npy files memory-mapped in directory, or in memory if None.
+    """
+    arrays = {}
+    for name in ARRAYS:
+        shape = (count, FEATURE_COUNT) if name == "features" else (count,)
+        if directory is None:
+            arrays[name] = np.empty(shape, dtype=DTYPES[name])
+        else:
+            arrays[name] = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode="w+",
+                                                     dtype=DTYPES[name], shape=shape)
+    return arrays
+
+
+def _build(path, arrays, processes, chunk_size):
+    """
+    Streams a positions file through feature extraction on a process pool, writing each chunk's rows into
+    arrays as it comes back, so only the chunks in flight are held as Python objects.
+    """
+    groups = {}
+
+    def add(start, result):
+        constants, features, over = result
+        end = start + len(constants)
+        arrays["constants"][start:end] = constants
+        arrays["features"][start:end] = features
+        arrays["over"][start:end] = over
+
+    def chunks():
+        start = 0
+        chunk = []
+        for i, (fen, score, result, group, rank) in enumerate(read_positions(path)):
+            chunk.append(fen)
+            arrays["score"][i] = score if score is not None else np.nan
+            arrays["result"][i] = result if result is not None else np.nan
+            arrays["group"][i] = groups.setdefault(group, len(groups)) if group is not None else -1
+            arrays["rank"][i] = rank if rank is not None else 0
+            if len(chunk) == chunk_size:
+                yield start, chunk
+                start = i + 1
+                chunk = []
+        if chunk:
+            yield start, chunk
+
+    if processes == 1:
+        for start, chunk in chunks():
+            add(start, extract(chunk))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            # A few chunks per worker are queued ahead
+            window = collections.deque()
+            for start, chunk in chunks():
+                window.append((start, pool.apply_async(extract, (chunk,))))
+                if len(window) >= 2 * processes:
+                    start, result = window.popleft()
+                    add(start, result.get())
+            while window:
+                start, result = window.popleft()
+                add(start, result.get())
+
+
+def load_training_set(path, cache_dir=DEFAULT_CACHE_DIR, processes=None, chunk_size=1000):
+    """
+    Training positions of an EPD or CSV file, from the feature cache if this version of the features has
+    been extracted from this file before, otherwise extracted and saved to the cache. Cached arrays are
+    memory-mapped rather than read, and extraction writes straight into them, so neither holds the whole
+    file in memory.
+    :param cache_dir: feature cache directory, None for no cache
+    :param processes: worker processes for extraction (default: one per CPU)
+    """
+    if np is None:
+        raise RuntimeError("numpy is needed to tune on a positions file")
+    processes = processes or os.cpu_count() or 1
+    if cache_dir is None:
+        arrays = _allocate(count_positions(path))
+        _build(path, arrays, processes, chunk_size)
+        return TrainingSet(arrays)
+
+    entry = os.path.join(cache_dir, "%s-v%d" % (file_hash(path), FEATURE_VERSION))
+    if not os.path.isdir(entry):
+        # Written to a temporary directory and renamed, so a half written entry is never used
+        tmp = entry + ".tmp%d" % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            arrays = _allocate(count_positions(path), tmp)
+            _build(path, arrays, processes, chunk_size)
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            os.replace(tmp, entry)
+        except OSError:  # Another run cached the same file first
+            if not os.path.isdir(entry):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return TrainingSet({name: np.load(os.path.join(entry, name + ".npy"), mmap_mode="r") for name in ARRAYS})
+
+
+class DatasetFitness:
+    """
+    Fitness of a population on a TrainingSet, the number of labels each individual's evaluate gets wrong:
+    - a score further than tolerance from its target score
+    - a score on the wrong side of -margin..margin for its game result (inside it for a draw)
+    - each pair of neighbouring ranks of an ordering group scored out of order
+    Works like PopulationFitness, with one matrix product per chunk of individuals.
+    """
+
+    def __init__(self, training_set, tolerance=500, margin=200, max_elements=1 << 23):
+        """
+        :param max_elements: positions x individuals scored at once, bounding memory for large sets
+        """
+        self.set = training_set
+        self.tolerance = tolerance
+        self.margin = margin
+        self.max_elements = max_elements
+        self.constants = np.asarray(training_set.constants, dtype=np.float64)
+        self.features = np.asarray(training_set.features)
+        self.over = np.asarray(training_set.over)
+        self.has_score = ~np.isnan(training_set.score)
+        self.has_result = ~np.isnan(training_set.result)
+        # Pairs of positions (higher, lower) where higher's score should be above lower's
+        group = np.asarray(training_set.group)
+        order = np.lexsort((training_set.rank, group))
+        ordered = order[group[order] >= 0]
+        same = group[ordered[:-1]] == group[ordered[1:]]
+        self.higher = ordered[:-1][same]
+        self.lower = ordered[1:][same]
+
+    def scores(self, weights):
+        """
+        :return: positions x individuals matrix of evaluate scores
+        """
+        scores = np.rint(self.constants[:, None] + self.features @ weights[:, :FEATURE_COUNT].T.astype(np.float64))
+        scores[self.over] = self.constants[self.over, None]
+        return scores
+
+    def __call__(self, population):
+        """
+        :return: numpy array of the fitness of each individual of population, in order
+        """
+        weights = np.asarray(population, dtype=np.int64)
+        chunk = max(1, self.max_elements // max(1, len(self.constants)))
+        return np.concatenate([self._fitness(weights[i:i + chunk]) for i in range(0, len(weights), chunk)]
+                              or [np.zeros(0, np.int64)])
+
+    def _fitness(self, weights):
+        scores = self.scores(weights)
+        fitness = np.zeros(len(weights), dtype=np.int64)
+
+        target = self.set.score[self.has_score, None]
+        fitness += (np.abs(scores[self.has_score] - target) > self.tolerance).sum(axis=0)
+
+        result = self.set.result[self.has_result, None]
+        resultScores = scores[self.has_result]
+        wrong = np.where(result > 0, resultScores <= self.margin,
+                         np.where(result < 0, resultScores >= -self.margin, np.abs(resultScores) > self.margin))
+        fitness += wrong.sum(axis=0)
+
+        fitness += (scores[self.higher] <= scores[self.lower]).sum(axis=0)
+        return fitness
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract and cache the features of a training positions file")
+    parser.add_argument("positions", help="EPD or CSV file of labeled positions")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="feature cache directory")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="positions per extraction chunk")
+    args = parser.parse_args(argv)
+
+    training_set = load_training_set(args.positions, cache_dir=args.cache_dir, processes=args.processes,
+                                     chunk_size=args.chunk_size)
+    print("%d positions, features cached in %s" % (len(training_set), args.cache_dir))
+
+
+if __name__ == "__main__":
+    main()
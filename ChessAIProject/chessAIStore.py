@@ -0,0 +1,188 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Persistent analysis cache. Search results deep enough to be worth keeping (depth, value, bound and best
+# move of a position) are saved to an SQLite file shared by every run of the engine, the GUI, the UCI
+# engine and the analysis tools. Transposition tables are seeded from it, so a position searched in an
+# earlier run is answered, or at least has its best move searched first, without repeating the work.
+#
+# Results are keyed by position_hash and by the heuristic weights they were searched with. The file is
+# capped at max_entries rows, the least recently used ones are evicted when it grows past the cap.
+#
+# usage: python3 chessAIStore.py analysis.db [--trim 100000] [--clear]
+
+import argparse
+import sqlite3
+import time
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    key INTEGER NOT NULL,
+    vals INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    value NOT NULL,
+    flag INTEGER NOT NULL,
+    move TEXT,
+    used REAL NOT NULL,
+    PRIMARY KEY (key, vals)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used);
+"""
+
+# Memory-mapped I/O for the database file, SQLite reads pages straight from the map
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def vals_id(vals):
+    """
+    Short id of a list of heuristic weights, results searched with different weights are kept apart.
+    """
+    return zlib.crc32(",".join(repr(v) for v in vals).encode())
+
+
+def _signed(key):
+    # SQLite integers are signed 64 bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def _encode_move(move):
+    if move is None:
+        return None
+    (from_row, from_col), (to_row, to_col) = move
+    return "%d%d%d%d" % (from_row, from_col, to_row, to_col)
+
+
+def _decode_move(text):
+    if text is None:
+        return None
+    return (int(text[0]), int(text[1])), (int(text[2]), int(text[3]))
+
+
+class AnalysisStore:
+    """
+    SQLite file of search results. Writes are buffered and only go to the file on flush(), which the
+    search calls once per move, so the search itself never waits on the disk.
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        """
+        :param max_entries: rows kept in the file, the least recently used are evicted past this
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA mmap_size=%d" % MMAP_SIZE)
+        self.db.executescript(SCHEMA)
+        self.pending = {}
+        self.touched = set()
+        self._vals = None
+        self._vals_id = None
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _id(self, vals):
+        if vals is not self._vals:
+            self._vals = vals
+            self._vals_id = vals_id(vals)
+        return self._vals_id
+
+    def get(self, key, vals):
+        """
+        :return: (depth, value, flag, move) saved for the position, None if there is none
+        """
+        row_key = (_signed(key), self._id(vals))
+        if row_key in self.pending:
+            self.hits += 1
+            return self.pending[row_key]
+        row = self.db.execute("SELECT depth, value, flag, move FROM analysis WHERE key = ? AND vals = ?",
+                              row_key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched.add(row_key)
+        return row[0], row[1], row[2], _decode_move(row[3])
+
+    def put(self, key, vals, depth, value, flag, move):
+        """
+        Buffers a result, keeping the deepest one of each position until the next flush.
+        """
+        row_key = (_signed(key), self._id(vals))
+        entry = self.pending.get(row_key)
+        if entry is None or entry[0] <= depth:
+            self.pending[row_key] = (depth, value, flag, move)
+
+    def flush(self):
+        """
+        Writes buffered results, keeping a saved result that is deeper than the new one, marks the results
+        read since the last flush as used, and evicts the least recently used rows past max_entries.
+        """
+        if not self.pending and not self.touched:
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO analysis (key, vals, depth, value, flag, move, used) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key, vals) DO UPDATE SET depth = excluded.depth, value = excluded.value, "
+                "flag = excluded.flag, move = excluded.move, used = excluded.used "
+                "WHERE excluded.depth >= analysis.depth",
+                [(key, vid, depth, value, flag, _encode_move(move), now)
+                 for (key, vid), (depth, value, flag, move) in self.pending.items()])
+            self.db.executemany("UPDATE analysis SET used = ? WHERE key = ? AND vals = ?",
+                                [(now, key, vid) for key, vid in self.touched])
+        self.pending.clear()
+        self.touched.clear()
+        if len(self) > self.max_entries:
+            # Evict down to 90% of the cap so the next few flushes do not each evict again
+            self.evict(self.max_entries * 9 // 10)
+
+    def evict(self, entries):
+        """
+        Deletes the least recently used results until at most entries are left.
+        """
+        excess = len(self) - entries
+        if excess > 0:
+            with self.db:
+                self.db.execute("DELETE FROM analysis WHERE (key, vals) IN "
+                                "(SELECT key, vals FROM analysis ORDER BY used LIMIT ?)", (excess,))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def clear(self):
+        self.pending.clear()
+        self.touched.clear()
+        with self.db:
+            self.db.execute("DELETE FROM analysis")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or trim an analysis cache file")
+    parser.add_argument("path", help="analysis cache file")
+    parser.add_argument("--trim", type=int, help="evict least recently used results down to this many")
+    parser.add_argument("--clear", action="store_true", help="delete every result")
+    args = parser.parse_args(argv)
+
+    with AnalysisStore(args.path) as store:
+        if args.clear:
+            store.clear()
+        elif args.trim is not None:
+            store.evict(args.trim)
+        print("%d results in %s" % (len(store), args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Endgame tablebases for king and pieces against a lone king: KQK, KRK, KPK and KBNK.
+#
+# generate() works out every position of an endgame by retrograde analysis, backwards from the checkmates,
+# and writes one byte per position: 0 for a draw, 255 for an impossible position, otherwise the distance to
+# mate in plies plus one. Positions are indexed by the squares of the white king, the white pieces and the
+# black king, then the side to move. Positions where black has the pieces are looked up color flipped.
+#
+# Tablebases memory-maps the files so the search can probe them at its leaves and at the root.
+#
+# KQK, KRK and KPK take 10 to 20 seconds each, KBNK (33 million positions) runs for hours.
+#
+# usage: python3 chessAITablebase.py [--directory tablebases] [KQK KRK KPK KBNK]
+
+import argparse
+import itertools
+import mmap
+import os
+import time
+
+from chessAI import ChessPiece
+
+# Generated in this order, KPK needs KQK and KRK for its promotions
+TABLES = ("KQK", "KRK", "KPK", "KBNK")
+
+ILLEGAL = 255
+
+# Value of a won tablebase position, less the distance to mate, below the value of a mate on the board
+TABLEBASE_WIN = 900000
+
+WHITE_GLYPHS = {ChessPiece.W_QUEEN: "Q", ChessPiece.W_ROOK: "R", ChessPiece.W_BISHOP: "B",
+                ChessPiece.W_KNIGHT: "N", ChessPiece.W_PAWN: "P"}
+BLACK_GLYPHS = {ChessPiece.B_QUEEN: "Q", ChessPiece.B_ROOK: "R", ChessPiece.B_BISHOP: "B",
+                ChessPiece.B_KNIGHT: "N", ChessPiece.B_PAWN: "P"}
+PIECE_ORDER = "QRBNP"
+
+# Endings a lone king always draws
+DRAWN = ("KK", "KBK", "KNK")
+
+# Squares are row * 8 + col, row 0 is the 8th rank like ChessBoard.squares
+KING_MOVES = []
+KNIGHT_MOVES = []
+for _square in range(64):
+    _row, _col = divmod(_square, 8)
+    KING_MOVES.append(tuple(r * 8 + c for r in range(_row - 1, _row + 2) for c in range(_col - 1, _col + 2)
+                            if 0 <= r < 8 and 0 <= c < 8 and (r, c) != (_row, _col)))
+    KNIGHT_MOVES.append(tuple((_row + dr) * 8 + _col + dc
+                              for dr, dc in ((1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1))
+                              if 0 <= _row + dr < 8 and 0 <= _col + dc < 8))
+
+ORTHOGONAL = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def _ray(square, dr, dc):
+    row, col = divmod(square, 8)
+    squares = []
+    row, col = row + dr, col + dc
+    while 0 <= row < 8 and 0 <= col < 8:
+        squares.append(row * 8 + col)
+        row, col = row + dr, col + dc
+    return tuple(squares)
+
+
+RAYS = {"R": [[_ray(s, dr, dc) for dr, dc in ORTHOGONAL] for s in range(64)],
+        "B": [[_ray(s, dr, dc) for dr, dc in DIAGONAL] for s in range(64)]}
+RAYS["Q"] = [RAYS["R"][s] + RAYS["B"][s] for s in range(64)]
+
+# LINES[piece][a][b] are the squares between a and b if piece slides from a to b, otherwise None
+LINES = {piece: [[None] * 64 for _ in range(64)] for piece in "QRB"}
+for _piece in "QRB":
+    for _square in range(64):
+        for _ray_squares in RAYS[_piece][_square]:
+            for _i, _target in enumerate(_ray_squares):
+                LINES[_piece][_square][_target] = _ray_squares[:_i]
+
+# A white pawn attacks diagonally towards row 0
+PAWN_ATTACKS = [tuple(s - 8 + dc for dc in (-1, 1) if s >= 8 and 0 <= s % 8 + dc < 8) for s in range(64)]
+
+
+def _attacked(target, wk, types, squares, occupied):
+    """
+    True if a white piece attacks target. occupied is the set of squares that block sliding pieces.
+    """
+    if target in KING_MOVES[wk]:
+        return True
+    for piece, square in zip(types, squares):
+        if square == target:
+            continue
+        if piece == "N":
+            if target in KNIGHT_MOVES[square]:
+                return True
+        elif piece == "P":
+            if target in PAWN_ATTACKS[square]:
+                return True
+        else:
+            between = LINES[piece][square][target]
+            if between is not None and not any(s in occupied for s in between):
+                return True
+    return False
+
+
+class Endgame:
+    """
+    Indexing and move generation for one endgame, white king and pieces against the black king.
+    """
+
+    def __init__(self, material):
+        self.material = material
+        self.types = material[1:-1]
+        self.size = 2 * 64 ** (len(self.types) + 2)
+
+    def index(self, wk, squares, bk, white_to_move):
+        i = wk
+        for square in squares:
+            i = i * 64 + square
+        return (i * 64 + bk) * 2 + (0 if white_to_move else 1)
+
+    def decode(self, index):
+        white_to_move = index & 1 == 0
+        index >>= 1
+        bk = index & 63
+        index >>= 6
+        squares = []
+        for _ in self.types:
+            squares.append(index & 63)
+            index >>= 6
+        return index, tuple(reversed(squares)), bk, white_to_move
+
+    def legal_placement(self, wk, squares, bk):
+        if len(set(squares) | {wk, bk}) != len(squares) + 2 or bk in KING_MOVES[wk]:
+            return False
+        return all(not (piece == "P" and square // 8 in (0, 7)) for piece, square in zip(self.types, squares))
+
+    def black_moves(self, wk, squares, bk):
+        """
+        :return: (white-to-move placements the black king can move to, True if it can capture a piece safely)
+        """
+        occupied = set(squares) | {wk}
+        moves = []
+        for target in KING_MOVES[bk]:
+            if target in KING_MOVES[wk] or target == wk:
+                continue
+            if target in squares:
+                # Taking a piece is safe if no other white piece defends it
+                others = [(p, s) for p, s in zip(self.types, squares) if s != target]
+                if not _attacked(target, wk, [p for p, _ in others], [s for _, s in others], occupied):
+                    return moves, True
+                continue
+            if not _attacked(target, wk, self.types, squares, occupied):
+                moves.append(target)
+        return moves, False
+
+    def white_unmoves(self, wk, squares, bk):
+        """
+        White-to-move placements a white piece could have moved from, without captures or promotions.
+        """
+        occupied = set(squares) | {wk, bk}
+        for origin in KING_MOVES[wk]:
+            if origin not in occupied and origin not in KING_MOVES[bk]:
+                yield origin, squares
+        for i, (piece, square) in enumerate(zip(self.types, squares)):
+            if piece == "N":
+                origins = [s for s in KNIGHT_MOVES[square] if s not in occupied]
+            elif piece == "P":
+                origins = []
+                if square + 8 < 56 and square + 8 not in occupied:
+                    origins.append(square + 8)
+                    if square // 8 == 4 and square + 16 not in occupied:
+                        origins.append(square + 16)
+            else:
+                origins = []
+                for ray in RAYS[piece][square]:
+                    for s in ray:
+                        if s in occupied:
+                            break
+                        origins.append(s)
+            for origin in origins:
+                yield wk, squares[:i] + (origin,) + squares[i + 1:]
+
+
+def generate(material, directory="tablebases", log=print):
+    """
+    Retrograde analysis of an endgame. Positions are resolved in order of distance to mate: black
+    positions lost in d plies give white wins in d + 1, and a black position is lost once every black
+    move leads to a white win.
+    :return: path of the table written
+    """
+    endgame = Endgame(material)
+    table = bytearray(endgame.size)
+    buckets = [[]]
+    start = time.time()
+
+    # Mark the impossible positions and find the checkmates
+    for placement in itertools.product(range(64), repeat=len(endgame.types) + 2):
+        wk, squares, bk = placement[0], placement[1:-1], placement[-1]
+        white = endgame.index(wk, squares, bk, True)
+        if not endgame.legal_placement(wk, squares, bk):
+            table[white] = table[white + 1] = ILLEGAL
+            continue
+        in_check = _attacked(bk, wk, endgame.types, squares, set(squares) | {wk})
+        if in_check:
+            table[white] = ILLEGAL
+        moves, capture = endgame.black_moves(wk, squares, bk)
+        if in_check and not moves and not capture:
+            table[white + 1] = 1
+            buckets[0].append(white + 1)
+
+    if "P" in endgame.types:
+        _promotions(endgame, table, buckets, directory)
+    log("%s: %d mates found in %.0fs" % (material, len(buckets[0]), time.time() - start))
+
+    distance = 0
+    while distance < len(buckets):
+        for index in buckets[distance]:
+            wk, squares, bk, white_to_move = endgame.decode(index)
+            if not white_to_move:
+                # Lost for black: every white move into it wins
+                for pred_wk, pred_squares in endgame.white_unmoves(wk, squares, bk):
+                    pred = endgame.index(pred_wk, pred_squares, bk, True)
+                    if table[pred] == 0:
+                        _push(buckets, distance + 1, pred)
+                continue
+            if table[index] != 0:  # already won in fewer moves
+                continue
+            table[index] = distance + 1
+            occupied = set(squares) | {wk, bk}
+            for origin in KING_MOVES[bk]:
+                if origin in occupied or origin in KING_MOVES[wk]:
+                    continue
+                pred = endgame.index(wk, squares, origin, False)
+                if table[pred] != 0:
+                    continue
+                moves, capture = endgame.black_moves(wk, squares, origin)
+                if capture or not moves:
+                    continue
+                if all(table[endgame.index(wk, squares, m, True)] not in (0, ILLEGAL) for m in moves):
+                    table[pred] = distance + 2
+                    _push(buckets, distance + 1, pred)
+        buckets[distance] = None
+        distance += 1
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, material + ".tb")
+    with open(path + ".tmp", "wb") as f:
+        f.write(table)
+    os.replace(path + ".tmp", path)
+    log("%s: longest mate %d plies, written to %s in %.0fs" % (material, distance - 1, path, time.time() - start))
+    return path
+
+
+def _push(buckets, distance, index):
+    if distance > 253:
+        raise ValueError("Distance to mate does not fit in a byte")
+    while len(buckets) <= distance:
+        buckets.append([])
+    buckets[distance].append(index)
+
+
+def _promotions(endgame, table, buckets, directory):
+    """
+    Seeds white wins by promoting the pawn into a won queen or rook ending.
+    """
+    promoted = {}
+    for material in ("KQK", "KRK"):
+        path = os.path.join(directory, material + ".tb")
+        if not os.path.exists(path):
+            raise ValueError("%s needs %s, generate it first" % (endgame.material, material))
+        with open(path, "rb") as f:
+            promoted[material] = (Endgame(material), f.read())
+
+    pawn = endgame.types.index("P")
+    for placement in itertools.product(range(64), repeat=len(endgame.types) + 2):
+        wk, squares, bk = placement[0], placement[1:-1], placement[-1]
+        if squares[pawn] // 8 != 1:
+            continue
+        white = endgame.index(wk, squares, bk, True)
+        target = squares[pawn] - 8
+        if table[white] == ILLEGAL or target in (wk, bk) or target in squares:
+            continue
+        best = None
+        for other, values in promoted.values():
+            value = values[other.index(wk, squares[:pawn] + (target,) + squares[pawn + 1:], bk, False)]
+            if value not in (0, ILLEGAL) and (best is None or value < best):
+                best = value
+        if best is not None:
+            _push(buckets, best, white)
+
+
+class Tablebases:
+    """
+    The tablebase files of a directory, memory-mapped when first needed.
+    """
+
+    def __init__(self, directory="tablebases"):
+        self.directory = directory
+        self.tables = {}
+        self.hits = 0
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        self.tables = {}
+
+    def _table(self, material):
+        if material not in self.tables:
+            path = os.path.join(self.directory, material + ".tb")
+            self.tables[material] = None
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.tables[material] = (Endgame(material), mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.tables[material]
+
+    def probe(self, board_state, color):
+        """
+        :param color: side to move
+        :return: (result, plies to mate) for the side to move, result 1 for a win, 0 for a draw and -1 for a
+                 loss, or None if there is no table for the position
+        """
+        white, black = [], []
+        white_king = black_king = None
+        for row in range(8):
+            for col in range(8):
+                piece = board_state.squares[row][col]
+                if piece is None:
+                    continue
+                if piece == ChessPiece.W_KING:
+                    white_king = row * 8 + col
+                elif piece == ChessPiece.B_KING:
+                    black_king = row * 8 + col
+                elif piece in WHITE_GLYPHS:
+                    white.append((PIECE_ORDER.index(WHITE_GLYPHS[piece]), row * 8 + col))
+                else:
+                    black.append((PIECE_ORDER.index(BLACK_GLYPHS[piece]), row * 8 + col))
+                if len(white) + len(black) > 2:
+                    return None
+        if white_king is None or black_king is None or (white and black):
+            return None
+
+        # Look positions with the black pieces up with the colors swapped and the board flipped
+        if black:
+            pieces = [(order, (7 - square // 8) * 8 + square % 8) for order, square in black]
+            wk = (7 - black_king // 8) * 8 + black_king % 8
+            bk = (7 - white_king // 8) * 8 + white_king % 8
+            strong_to_move = color == "black"
+        else:
+            pieces, wk, bk = white, white_king, black_king
+            strong_to_move = color == "white"
+        pieces.sort()
+        material = "K" + "".join(PIECE_ORDER[order] for order, _ in pieces) + "K"
+        if material in DRAWN:
+            self.hits += 1
+            return 0, 0
+
+        table = self._table(material)
+        if table is None:
+            return None
+        endgame, values = table
+        squares = tuple(square for _, square in pieces)
+        if not endgame.legal_placement(wk, squares, bk):
+            return None
+        value = values[endgame.index(wk, squares, bk, strong_to_move)]
+        if value == ILLEGAL:
+            return None
+        self.hits += 1
+        if value == 0:
+            return 0, 0
+        return (1 if strong_to_move else -1), value - 1
+
+    def value(self, board_state, color):
+        """
+        Tablebase result as an evaluation, positive when black wins, or None if there is no table for it.
+        Faster mates are worth more.
+        """
+        found = self.probe(board_state, color)
+        if found is None:
+            return None
+        result, plies = found
+        if result == 0:
+            return 0
+        winner = color if result == 1 else ("white" if color == "black" else "black")
+        return (TABLEBASE_WIN - plies) * (1 if winner == "black" else -1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument("tables", nargs="*", default=list(TABLES[:3]),
+                        help="endgames to generate, from %s (default: all but KBNK)" % " ".join(TABLES))
+    parser.add_argument("--directory", default="tablebases", help="directory to write the tables to")
+    args = parser.parse_args(argv)
+
+    for material in TABLES:
+        if material in args.tables:
+            generate(material, args.directory)
+
+
+if __name__ == "__main__":
+    main()
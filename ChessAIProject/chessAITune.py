@@ -0,0 +1,152 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# Headless genetic algorithm tuner. Runs chessAIGeneticAlgo's evolution of the heuristic weights with no
+# turtle window, for batch jobs on servers, and writes the best weights found as JSON.
+#
+# usage: python3 chessAITune.py [--population 100] [--retain 0.25] [--random-select 0.1] [--mutate 0.1]
+#                               [--generations 200] [--seed 1] [--processes 4] [--output weights.json]
+#                               [--checkpoint run.ckpt [--checkpoint-every 5] [--resume]]
+#                               [--islands 8 [--topology ring] [--migration-interval 5] [--migrants 2]]
+#                               [--operators array [--selection tournament] [--crossover uniform]]
+#                               [--metrics metrics.jsonl | metrics.csv] [--verbose]
+#                               [--positions positions.epd | positions.csv [--feature-cache .chessai-cache]]
+#
+# With --checkpoint the run's state is saved between generations, and --resume carries on from it after
+# a crash or preemption, giving the same result as an uninterrupted run.
+#
+# With --islands the GA runs as an island model: that many populations of --population individuals, each
+# in its own process, sending copies of their best individuals to their neighbours every few generations.
+#
+# With --operators array (needs numpy) the population is a numpy matrix and selection, crossover and
+# mutation work on all of it at once, for populations of 10^4 and more.
+#
+# --metrics writes one record per generation (best, mean and median fitness, diversity, cache hit rate,
+# evaluations per second, time and the operator rates) as JSON lines, or CSV for a .csv file. --verbose
+# prints every individual's fitness to stderr as it is graded.
+#
+# --positions (needs numpy) grades the weights on a file of labeled positions instead of the built-in
+# training boards, see chessAIPositions. Their features are cached in --feature-cache, so only the first
+# run on a file extracts them.
+
+import argparse
+import contextlib
+import json
+import sys
+
+from chessAIGeneticAlgo import TOPOLOGIES, MetricsWriter, headless_input, island_tune
+from chessAIPositions import DEFAULT_CACHE_DIR, load_training_set
+
+
+def tune(population=100, retain=0.25, random_select=0.1, mutate=0.1, generations=None, seed=None,
+         processes=None, checkpoint=None, checkpoint_every=1, resume=False, operators="list",
+         selection="truncation", crossover="one-point", metrics=None, verbose=False, positions=None,
+         feature_cache=DEFAULT_CACHE_DIR):
+    """
+    Tunes the heuristic weights without the GUI.
+    :param metrics: file to write per-generation metrics to, see MetricsWriter
+    :param positions: file of labeled positions to grade on instead of the training boards
+    :param feature_cache: feature cache directory of the positions file, None for no cache
+    :return: dict of the best weights, their fitness, and the generations evolved
+    """
+    training_set = None
+    if positions is not None:
+        training_set = load_training_set(positions, cache_dir=feature_cache, processes=processes)
+    grader = headless_input(processes=processes, seed=seed, verbose=verbose, training_set=training_set)
+    writer = MetricsWriter(metrics) if metrics else None
+    # The GA's progress goes to stderr, leaving stdout for the result
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            weights, fitness, evolved = grader.tune(popSize=population, retain=retain, random_select=random_select,
+                                                    mutate=mutate, generations=generations, seed=seed,
+                                                    checkpoint=checkpoint, checkpoint_every=checkpoint_every,
+                                                    resume=resume, operators=operators, selection=selection,
+                                                    crossover=crossover, metrics=writer)
+    finally:
+        grader.close()
+        if writer is not None:
+            writer.close()
+    return {"weights": weights, "fitness": fitness, "generations": evolved}
+
+
+def tune_islands(islands, population=100, retain=0.25, random_select=0.1, mutate=0.1, generations=None, seed=None,
+                 topology="ring", interval=5, migrants=2, verbose=False, positions=None,
+                 feature_cache=DEFAULT_CACHE_DIR):
+    """
+    Tunes the heuristic weights with the island model.
+    :return: dict of the best weights, their fitness, the generations evolved and the island they came from
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        weights, fitness, evolved, island = island_tune(islands, popSize=population, retain=retain,
+                                                        random_select=random_select, mutate=mutate,
+                                                        generations=generations, seed=seed, topology=topology,
+                                                        interval=interval, migrants=migrants, verbose=verbose,
+                                                        positions=positions, cache_dir=feature_cache)
+    return {"weights": weights, "fitness": fitness, "generations": evolved, "island": island}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the chess AI's heuristic weights with no display")
+    parser.add_argument("--population", type=int, default=100, help="individuals per generation")
+    parser.add_argument("--retain", type=float, default=0.25, help="fraction of each generation kept as parents")
+    parser.add_argument("--random-select", type=float, default=0.1,
+                        help="chance of each other individual also becoming a parent")
+    parser.add_argument("--mutate", type=float, default=0.1, help="chance of each parent mutating")
+    parser.add_argument("--generations", type=int, help="stop after this many generations")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible runs")
+    parser.add_argument("--processes", type=int,
+                        help="worker processes grading fitness without numpy (default: one per CPU)")
+    parser.add_argument("--output", help="write the result here instead of stdout")
+    parser.add_argument("--checkpoint", help="file to save the run's state to between generations")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="generations between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="carry on from the checkpoint file if it exists")
+    parser.add_argument("--islands", type=int, help="populations evolving in parallel (island model)")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="ring", help="islands each island sends migrants to")
+    parser.add_argument("--migration-interval", type=int, default=5, help="generations between migrations")
+    parser.add_argument("--migrants", type=int, default=2, help="best individuals sent to each neighbour")
+    parser.add_argument("--operators", choices=["list", "array"], default="list",
+                        help="evolve lists of weights, or a numpy matrix with vectorized operators")
+    parser.add_argument("--selection", choices=["truncation", "tournament"], default="truncation",
+                        help="parent selection of the array operators")
+    parser.add_argument("--crossover", choices=["one-point", "uniform"], default="one-point",
+                        help="crossover of the array operators")
+    parser.add_argument("--metrics", help="write per-generation metrics here (.csv for CSV, otherwise JSON lines)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print every individual's fitness to stderr")
+    parser.add_argument("--positions", help="EPD or CSV file of labeled positions to tune on")
+    parser.add_argument("--feature-cache", default=DEFAULT_CACHE_DIR, help="directory caching the positions' features")
+    args = parser.parse_args(argv)
+    if args.islands and args.metrics:
+        parser.error("--metrics is not supported with --islands")
+    if args.islands and args.checkpoint:
+        parser.error("--checkpoint is not supported with --islands")
+    if args.islands and args.operators == "array":
+        parser.error("--operators array is not supported with --islands")
+
+    if args.islands:
+        result = tune_islands(args.islands, population=args.population, retain=args.retain,
+                              random_select=args.random_select, mutate=args.mutate, generations=args.generations,
+                              seed=args.seed, topology=args.topology, interval=args.migration_interval,
+                              migrants=args.migrants, verbose=args.verbose, positions=args.positions,
+                              feature_cache=args.feature_cache)
+    else:
+        try:
+            result = tune(population=args.population, retain=args.retain, random_select=args.random_select,
+                          mutate=args.mutate, generations=args.generations, seed=args.seed, processes=args.processes,
+                          checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every, resume=args.resume,
+                          operators=args.operators, selection=args.selection, crossover=args.crossover,
+                          metrics=args.metrics, verbose=args.verbose, positions=args.positions,
+                          feature_cache=args.feature_cache)
+        except ValueError as e:  # A checkpoint that cannot be resumed, or an unreadable positions file
+            parser.error(str(e))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+            f.write("\n")
+    else:
+        json.dump(result, sys.stdout)
+        sys.stdout.write("\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
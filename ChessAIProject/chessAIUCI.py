@@ -0,0 +1,305 @@
+# CS 5100
+# Author: Rajesh Sakhamuru, Rohan Subramaniam
+
+# UCI front end for the chess AI, so it can be played from chess GUIs and run in engine tournaments
+# without the turtle window. Reads UCI commands on stdin and answers on stdout.
+#
+# Supported: uci, isready, setoption, ucinewgame, position (startpos or fen, with moves), go (depth, nodes,
+# movetime, wtime/btime/winc/binc/movestogo, infinite, ponder), stop, ponderhit and quit.
+#
+# usage: python3 chessAIUCI.py
+
+import sys
+import threading
+import time
+
+from chessAIStore import AnalysisStore
+from chessAITablebase import TABLEBASE_WIN, Tablebases
+from chessAI import ChessPiece, Threat, opponent_AI, side_to_move, uci_move, uci_pv, parse_uci_move
+
+
+class UCIEngine:
+    """
+    Keeps the current position and runs searches on it in a background thread, so that stop and
+    ponderhit can be read while it thinks.
+    """
+    NAME = "chessAI"
+    AUTHORS = "Rajesh Sakhamuru, Rohan Subramaniam"
+
+    # Deepest iterative deepening pass when go gives no depth
+    MAX_DEPTH = 64
+    # Moves left in the game assumed for sudden death time controls
+    MOVES_TO_GO = 30
+
+    def __init__(self, out=None):
+        self.out = out if out is not None else sys.stdout
+        self.output_lock = threading.Lock()
+        self.eval_cache_size = 65536
+        self.max_depth = 4
+        self.profile = None
+        self.tablebases = None
+        self.analysis_store = None
+        self.ai = self.new_ai()
+        self.pieces = ChessPiece.from_fen(ChessPiece.START_FEN)
+        self.thread = None
+        self.timer = None
+        self.budget = None
+        # Cleared while bestmove has to be held back for stop or ponderhit
+        self.release = threading.Event()
+
+    def new_ai(self):
+        return opponent_AI(None, None, eval_cache_size=self.eval_cache_size, tablebases=self.tablebases,
+                           analysis_store=self.analysis_store)
+
+    def send(self, line):
+        with self.output_lock:
+            print(line, file=self.out, flush=True)
+
+    def loop(self, stream=None):
+        """
+        Reads commands until quit or the end of the input.
+        """
+        for line in (stream if stream is not None else sys.stdin):
+            if not self.handle(line):
+                break
+        self.quit()
+
+    def handle(self, line):
+        """
+        Runs one command line.
+        :return: False once quit has been read
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == "uci":
+            self.send("id name %s" % self.NAME)
+            self.send("id author %s" % self.AUTHORS)
+            self.send("option name EvalCache type spin default 65536 min 0 max 16777216")
+            self.send("option name MaxDepth type spin default 4 min 1 max %d" % self.MAX_DEPTH)
+            self.send("option name Ponder type check default false")
+            self.send("option name Profile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name AnalysisFile type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setoption(args)
+        elif command == "ucinewgame":
+            self.wait()
+            self.ai = self.new_ai()
+            self.pieces = ChessPiece.from_fen(ChessPiece.START_FEN)
+        elif command == "position":
+            self.wait()
+            self.position(args)
+        elif command == "go":
+            self.wait()
+            self.go(args)
+        elif command == "stop":
+            self.ai.stop()
+            self.release.set()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            return False
+        elif command not in ("debug", "register"):
+            self.send("info string unknown command %s" % command)
+        return True
+
+    def setoption(self, args):
+        if "name" not in args:
+            return
+        value_at = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1:value_at]).lower()
+        value = " ".join(args[value_at + 1:])
+        try:
+            if name == "evalcache":
+                self.wait()
+                self.eval_cache_size = int(value)
+                self.ai = self.new_ai()
+            elif name == "maxdepth":
+                self.max_depth = max(1, min(self.MAX_DEPTH, int(value)))
+            elif name == "profile":
+                self.profile = value if value and value != "<empty>" else None
+            elif name == "tablebasepath":
+                self.wait()
+                self.tablebases = Tablebases(value) if value and value != "<empty>" else None
+                self.ai = self.new_ai()
+            elif name == "analysisfile":
+                self.wait()
+                if self.analysis_store is not None:
+                    self.analysis_store.close()
+                self.analysis_store = AnalysisStore(value) if value and value != "<empty>" else None
+                self.ai = self.new_ai()
+        except ValueError:
+            self.send("info string bad value %r for option %s" % (value, name))
+
+    def position(self, args):
+        """
+        position startpos [moves ...] or position fen <fen> [moves ...]
+        """
+        moves_at = args.index("moves") if "moves" in args else len(args)
+        try:
+            if args and args[0] == "fen":
+                pieces = ChessPiece.from_fen(" ".join(args[1:moves_at]))
+            else:
+                pieces = ChessPiece.from_fen(ChessPiece.START_FEN)
+        except ValueError as e:
+            self.send("info string %s" % e)
+            return
+
+        for text in args[moves_at + 1:]:
+            try:
+                ((from_row, from_col), (to_row, to_col)), promotion = parse_uci_move(text)
+                if promotion is not None:
+                    white = pieces.board.squares[from_row][from_col] == ChessPiece.W_PAWN
+                    promotion = ChessPiece.FEN_TO_GLYPH[promotion.upper() if white else promotion]
+                pieces.push_move(from_row, from_col, to_row, to_col, promotion)
+            except ValueError:
+                self.send("info string illegal move %s" % text)
+                break
+        self.pieces = pieces
+
+    def time_budget(self, params, color):
+        """
+        Seconds to think from the go parameters, or None for no time limit.
+        """
+        if "movetime" in params:
+            return params["movetime"] / 1000
+        remaining = params.get("wtime" if color == "white" else "btime")
+        if remaining is None:
+            return None
+        increment = params.get("winc" if color == "white" else "binc", 0)
+        moves_to_go = params.get("movestogo") or self.MOVES_TO_GO
+        budget = remaining / moves_to_go + increment * 3 / 4
+        # Never plan on more than half of the clock
+        return min(budget, remaining / 2) / 1000
+
+    def go(self, args):
+        params = {}
+        flags = set()
+        i = 0
+        while i < len(args):
+            if args[i] in ("infinite", "ponder"):
+                flags.add(args[i])
+                i += 1
+            elif args[i] == "searchmoves":
+                # Searching only some root moves is not supported, the rest of the line is its move list
+                break
+            elif i + 1 < len(args):
+                try:
+                    params[args[i]] = int(args[i + 1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+
+        color = side_to_move(self.pieces)
+        # Without a depth, searches with some other limit deepen until it is reached
+        limited = flags or any(limit in params for limit in ("nodes", "movetime", "wtime", "btime"))
+        max_depth = params.get("depth", self.MAX_DEPTH if limited else self.max_depth)
+        max_depth = max(1, min(self.MAX_DEPTH, max_depth))
+        self.budget = self.time_budget(params, color)
+
+        self.ai.stopped = False
+        if flags:
+            # bestmove waits for stop, or ponderhit when pondering
+            self.release.clear()
+        else:
+            self.release.set()
+            self.start_timer()
+
+        # The search works on its own copy, deep_copy does not carry moveHistory over
+        pieces = self.pieces.deep_copy()
+        pieces.moveHistory = list(self.pieces.moveHistory)
+        self.thread = threading.Thread(target=self.think,
+                                       args=(pieces, color, max_depth, params.get("nodes"), "ponder" in flags))
+        self.thread.start()
+
+    def start_timer(self):
+        if self.budget is not None:
+            self.timer = threading.Timer(self.budget, self.ai.stop)
+            self.timer.start()
+
+    def ponderhit(self):
+        """
+        The opponent played the move we were pondering on, carry on searching as a normal search.
+        """
+        if self.thread is not None and not self.release.is_set():
+            self.start_timer()
+            self.release.set()
+
+    def think(self, pieces, color, max_depth, node_limit, pondering):
+        start = time.time()
+        sign = 1 if color == "black" else -1
+
+        def info(stats, iteration):
+            elapsed = time.time() - start
+            self.send("info depth %d score %s nodes %d nps %d time %d pv %s" %
+                      (iteration["depth"], self.score(sign * iteration["value"], iteration["pv"]), stats.nodes,
+                       stats.nodes / elapsed if elapsed else 0, elapsed * 1000,
+                       " ".join(uci_pv(pieces.board, iteration["pv"]))))
+
+        value, move, stats = self.ai.search(pieces.board, pieces, color, depth=1, max_depth=max_depth,
+                                            vals=opponent_AI.TUNED_VALS, callback=info, profile=self.profile,
+                                            node_limit=node_limit)
+        self.release.wait()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        pv = stats.iterations[-1]["pv"] if stats.iterations else []
+        if move is None:
+            # Not even the first iteration finished, play anything legal
+            threat = Threat(pieces.board, pieces)
+            threat.getThreat()
+            moves = threat.blackMoves if color == "black" else threat.whiteMoves
+            move = moves[0] if moves else None
+        if move is None:
+            self.send("bestmove 0000")
+        elif len(pv) > 1 and pv[0] == move:
+            line = uci_pv(pieces.board, pv[:2])
+            self.send("bestmove %s ponder %s" % (line[0], line[1]))
+        else:
+            self.send("bestmove %s" % uci_move(pieces.board, move))
+
+    def score(self, value, pv):
+        """
+        UCI score of a value from the side to move's point of view: mate in moves for won or lost
+        positions, including tablebase ones, centipawns scaled by the weight of a pawn otherwise.
+        """
+        if abs(value) >= 1000000:
+            moves = (len(pv) + 1) // 2
+            return "mate %d" % (moves if value > 0 else -moves)
+        if abs(value) > TABLEBASE_WIN - 1000:
+            # Tablebase wins count plies to mate from where the line left the search
+            moves = (TABLEBASE_WIN - abs(value) + len(pv) + 1) // 2
+            return "mate %d" % (moves if value > 0 else -moves)
+        return "cp %d" % (value * 100 // opponent_AI.TUNED_VALS[0])
+
+    def wait(self):
+        """
+        Lets a running search finish before the position or options change.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def quit(self):
+        self.ai.stop()
+        self.release.set()
+        self.wait()
+        if self.analysis_store is not None:
+            self.analysis_store.close()
+
+
+def main():
+    UCIEngine().loop()
+
+
+if __name__ == "__main__":
+    main()